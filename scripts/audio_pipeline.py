@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+End-to-end audio -> stems -> MIDI, without the MP3 round trip.
+
+The two-step workflow encodes six stems to 320 kbps MP3 (stem_separation.py),
+then decodes each MP3 again for tempo estimation and inside basic-pitch
+(audio_to_midi.py). Here the separated waveforms are handed straight to the
+transcription engine: each stem is downmixed and resampled once, from Demucs'
+44.1 kHz float output to basic-pitch's 22.05 kHz, and nothing lossy sits in
+between. MP3 stems are only written when --stems-dir is given. Stems that
+stem_activity.py finds silent are neither encoded nor transcribed.
+"""
+
+import argparse
+from pathlib import Path
+
+import librosa
+
+from audio_to_midi import ARTIFACTS, merge_track
+from stem_activity import DEFAULT_THRESHOLDS
+from stem_separation import InMemoryStemSeparator
+from transcription import (AUDIO_SAMPLE_RATE, DEFAULT_BATCH_SIZE, StemJob,
+                           TranscriptionEngine, estimate_tempo)
+
+EXTENSIONS = ["mp3", "wav", "ogg", "flac"]
+
+
+def find_audio_files(input_path: Path) -> list:
+    """Audio files with supported extensions"""
+    return sorted(f for f in Path(input_path).iterdir()
+                  if f.suffix.lower().lstrip(".") in EXTENSIONS)
+
+
+def separated_stem_jobs(separator, audio_files, stems_dir=None, mp3_rate=320, thresholds=DEFAULT_THRESHOLDS):
+    """Separate each file and yield one StemJob per non-silent stem, resampled once
+
+    thresholds=None transcribes (and stores) every stem.
+    """
+    for audio_file in audio_files:
+        track_name = audio_file.stem
+        print(f"\nSeparating track: {track_name}")
+        try:
+            stems = separator.separate(audio_file)
+            activity = separator.analyze(stems, **thresholds) if thresholds is not None else None
+            if stems_dir is not None:
+                separator.save_stems(stems, Path(stems_dir) / track_name, bitrate=mp3_rate, activity=activity,
+                                     skip_silent=thresholds is not None, **(thresholds or {}))
+        except Exception as e:
+            print(f"Error separating {audio_file.name}: {str(e)}")
+            continue
+
+        for stem_name, source in stems.items():
+            if activity is not None and activity[stem_name]['silent']:
+                print(f"Skipping silent stem: {stem_name}")
+                continue
+            try:
+                y = librosa.resample(source.mean(0).numpy(), orig_sr=separator.samplerate,
+                                     target_sr=AUDIO_SAMPLE_RATE)
+                tempo = estimate_tempo(y)
+            except Exception as e:
+                print(f"Error loading {stem_name}: {str(e)}")
+                continue
+            yield StemJob(track_name, stem_name, y, tempo=tempo, source_path=audio_file)
+
+
+def run_pipeline(input_path, output_directory, stems_dir=None, batch_size=DEFAULT_BATCH_SIZE,
+                 artifacts=(), overwrite=False, device=None, thresholds=DEFAULT_THRESHOLDS, skip_files=()):
+    """Separate and transcribe every audio file in input_path into <output_directory>/<track>.mid
+
+    Files named in skip_files (e.g. duplicates flagged by fingerprint_index.py) are left out.
+    """
+    output_directory = Path(output_directory)
+    output_directory.mkdir(parents=True, exist_ok=True)
+
+    audio_files = [f for f in find_audio_files(input_path) if f.name not in skip_files]
+    if not overwrite:
+        audio_files = [f for f in audio_files if not (output_directory / f"{f.stem}.mid").exists()]
+    if not audio_files:
+        print("No unprocessed files found.")
+        return
+
+    print(f"Found {len(audio_files)} files to process")
+    separator = InMemoryStemSeparator(device=device)
+    engine = TranscriptionEngine(batch_size=batch_size)
+
+    successful = 0
+    track_results = []
+    for result in engine.transcribe(separated_stem_jobs(separator, audio_files, stems_dir, thresholds=thresholds)):
+        # Results arrive in job order; a new track name means the previous track is complete
+        if track_results and result.job.track != track_results[0].job.track:
+            successful += merge_track(track_results[0].job.track, track_results, str(output_directory), artifacts)
+            track_results = []
+        track_results.append(result)
+    if track_results:
+        successful += merge_track(track_results[0].job.track, track_results, str(output_directory), artifacts)
+
+    print("\nProcessing complete!")
+    print(f"Successfully processed: {successful} tracks")
+    print(f"Failed to process: {len(audio_files) - successful} tracks")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Separate audio files into stems and transcribe them to MIDI in one pass")
+    parser.add_argument("input_path", help="Directory containing input audio files")
+    parser.add_argument("output_path", help="Directory for the combined MIDI files")
+    parser.add_argument("--stems-dir", default=None,
+                        help="Also write 320 kbps MP3 stems to <stems-dir>/<track>/ (off by default)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Model windows per transcription batch")
+    parser.add_argument("--artifacts", nargs="*", default=[], choices=ARTIFACTS,
+                        help="Per-stem outputs to keep in <output_path>/<track>/")
+    parser.add_argument("--device", default=None, help="Torch device for Demucs (default: mps, cuda or cpu)")
+    parser.add_argument("--overwrite", action="store_true", help="Reprocess tracks that already have a MIDI file")
+    parser.add_argument("--silence-db", type=float, default=DEFAULT_THRESHOLDS['silence_db'],
+                        help="Frames quieter than this (dBFS RMS) count as inactive")
+    parser.add_argument("--min-active-sec", type=float, default=DEFAULT_THRESHOLDS['min_active_sec'],
+                        help="Stems with less activity than this are skipped")
+    parser.add_argument("--keep-silent", action="store_true", help="Store and transcribe every stem")
+    parser.add_argument("--fingerprints", metavar="DB",
+                        help="Skip files this fingerprint index flags as duplicates (their stems and MIDI are copied on ingest)")
+
+    args = parser.parse_args()
+
+    thresholds = None if args.keep_silent else {'silence_db': args.silence_db, 'min_active_sec': args.min_active_sec}
+    skip_files = set()
+    if args.fingerprints:
+        from fingerprint_index import duplicate_files
+
+        skip_files = duplicate_files(args.fingerprints)
+    run_pipeline(args.input_path, args.output_path, stems_dir=args.stems_dir, batch_size=args.batch_size,
+                 artifacts=set(args.artifacts), overwrite=args.overwrite, device=args.device, thresholds=thresholds,
+                 skip_files=skip_files)
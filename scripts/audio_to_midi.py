@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Convert separated stems (htdemucs_6s layout: <base>/<track>/<stem>.mp3) into one
+multitrack MIDI file per track.
+
+This is the stem-to-MIDI part of notebooks/audio-to-midi.ipynb. All tracks share
+a single TranscriptionEngine, so the basic-pitch model is loaded once and windows
+from every stem of every track are batched together. The combined MIDI is built
+in memory from the note events; per-stem MIDI, model outputs, note CSVs and
+sonifications are only written when asked for (--artifacts). Stems that are
+silent (per the track's activity.json, or measured right after decoding, see
+stem_activity.py) are skipped before tempo estimation and inference.
+"""
+
+import argparse
+import glob
+import os
+from itertools import groupby
+
+import numpy as np
+import pretty_midi
+
+from instrumentation import span
+from note_store import NoteStore
+from stem_activity import DEFAULT_THRESHOLDS, known_silence, read_manifest, stem_activity
+from transcription import (AUDIO_SAMPLE_RATE, DEFAULT_BATCH_SIZE, StemJob, TranscriptionEngine,
+                           estimate_tempo, load_stem, save_outputs)
+
+# Optional per-stem outputs, as predict_and_save names them
+ARTIFACTS = ['midi', 'model_outputs', 'notes', 'sonify']
+
+
+def get_instrument_program(stem_name):
+    return {
+        'bass': 33,
+        'drums': 0,
+        'guitar': 25,
+        'piano': 0,
+        'vocals': 53,
+        'other': 48,
+    }.get(stem_name.lower(), 0)
+
+
+def find_stems(stems_directory):
+    """All MP3 stems of a track"""
+    return sorted(glob.glob(os.path.join(stems_directory, '*.mp3')))
+
+
+def stem_jobs(stems_directory, thresholds=DEFAULT_THRESHOLDS):
+    """Decode every non-silent stem of a track once and estimate its tempo
+
+    thresholds=None transcribes every stem.
+    """
+    track_name = os.path.basename(stems_directory)
+    print(f"\nProcessing track: {track_name}")
+    manifest = read_manifest(stems_directory) if thresholds is not None else None
+    for mp3_file in find_stems(stems_directory):
+        stem_name = os.path.splitext(os.path.basename(mp3_file))[0]
+        if thresholds is not None and known_silence(manifest, stem_name, **thresholds):
+            print(f"Skipping silent stem: {stem_name}")
+            continue
+        print(f"Processing stem: {stem_name}")
+        try:
+            y = load_stem(mp3_file)
+            if thresholds is not None and stem_activity(y, AUDIO_SAMPLE_RATE, **thresholds)['silent']:
+                print(f"Skipping silent stem: {stem_name}")
+                continue
+            tempo = estimate_tempo(y)
+        except Exception as e:
+            print(f"Error loading {stem_name}: {str(e)}")
+            continue
+        yield StemJob(track_name, stem_name, y, tempo=tempo, source_path=mp3_file)
+
+
+def stem_instrument(stem_name, note_events):
+    """Build the stem's Instrument straight from basic-pitch note events"""
+    if 'drums' in stem_name.lower():
+        instrument = pretty_midi.Instrument(program=0, is_drum=True, name=stem_name)
+        instrument.channel = 9
+    else:
+        instrument = pretty_midi.Instrument(program=get_instrument_program(stem_name), name=stem_name)
+
+    # Note events are (start_s, end_s, pitch, amplitude, pitch_bends); velocity as basic-pitch writes it
+    instrument.notes = [
+        pretty_midi.Note(velocity=int(np.round(127 * amplitude)), pitch=int(pitch), start=start, end=end)
+        for start, end, pitch, amplitude, _ in note_events
+    ]
+    return instrument
+
+
+def build_multitrack_midi(results):
+    """Combine the stems of one track into a single PrettyMIDI, in memory"""
+    final_tempo = int(np.median([result.job.tempo for result in results]))
+    combined_midi = pretty_midi.PrettyMIDI(initial_tempo=final_tempo)
+    for result in results:
+        print(f"Adding stem: {result.job.stem}")
+        instrument = stem_instrument(result.job.stem, result.note_events)
+        print(f"Added {len(instrument.notes)} notes")
+        combined_midi.instruments.append(instrument)
+    return combined_midi
+
+
+def merge_track(track_name, results, output_directory, artifacts=(), note_store=None):
+    """Write <track_name>.mid, plus any requested per-stem artifacts under <output_directory>/<track_name>/
+
+    artifacts may contain 'midi', 'model_outputs', 'notes' and 'sonify'. The
+    notes are also added to note_store (a NoteStore) when one is given.
+    A track with a stem that failed to transcribe is not written.
+    """
+    failed = [result for result in results if result.error]
+    if failed:
+        for result in failed:
+            print(f"Error transcribing {track_name}/{result.job.stem}: {result.error}")
+        return False
+
+    if artifacts:
+        artifacts_directory = os.path.join(output_directory, track_name)
+        os.makedirs(artifacts_directory, exist_ok=True)
+        for result in results:
+            try:
+                save_outputs(result, artifacts_directory,
+                             save_midi='midi' in artifacts,
+                             save_model_outputs='model_outputs' in artifacts,
+                             save_notes='notes' in artifacts,
+                             sonify_midi='sonify' in artifacts)
+            except Exception as e:
+                print(f"Error saving artifacts for {result.job.stem}: {str(e)}")
+
+    with span('midi.merge', track=track_name):
+        combined_midi = build_multitrack_midi(results)
+
+    # Save combined file with track name
+    output_file = os.path.join(output_directory, f"{track_name}.mid")
+    print(f"Saving as: {output_file}")
+
+    try:
+        combined_midi.write(output_file)
+        print(f"Successfully created: {output_file}")
+        if note_store is not None:
+            note_store.add_midi(track_name, combined_midi)
+        return True
+    except Exception as e:
+        print(f"Error saving combined MIDI: {str(e)}")
+        return False
+
+
+def convert_stems_to_midi(stems_directory, output_directory, engine=None, artifacts=(), thresholds=DEFAULT_THRESHOLDS):
+    """Transcribe one track's stems into <output_directory>/<track>.mid"""
+    if not find_stems(stems_directory):
+        print(f"No MP3 files found in {stems_directory}")
+        return False
+
+    os.makedirs(output_directory, exist_ok=True)
+    engine = engine or TranscriptionEngine()
+    results = list(engine.transcribe(stem_jobs(stems_directory, thresholds)))
+    if not results:
+        return False
+    return merge_track(os.path.basename(stems_directory), results, output_directory, artifacts)
+
+
+def process_all_tracks(base_directory, output_directory, engine=None, batch_size=DEFAULT_BATCH_SIZE,
+                       artifacts=(), note_store=None, thresholds=DEFAULT_THRESHOLDS, skip_tracks=()):
+    """Process all track folders in the base directory through one shared engine
+
+    Folders named in skip_tracks (e.g. duplicates flagged by fingerprint_index.py) are left out.
+    """
+
+    # Get all subdirectories
+    track_dirs = sorted(d for d in glob.glob(os.path.join(base_directory, '*'))
+                        if os.path.isdir(d) and os.path.basename(d) not in skip_tracks)
+
+    print(f"Found {len(track_dirs)} tracks to process")
+
+    successful = 0
+    failed = 0
+
+    with_stems = []
+    for track_dir in track_dirs:
+        if find_stems(track_dir):
+            with_stems.append(track_dir)
+        else:
+            print(f"No MP3 files found in {track_dir}")
+            failed += 1
+
+    os.makedirs(output_directory, exist_ok=True)
+    engine = engine or TranscriptionEngine(batch_size=batch_size)
+
+    def all_jobs():
+        for track_dir in with_stems:
+            yield from stem_jobs(track_dir, thresholds)
+
+    # Results arrive in job order, so each track's stems are contiguous
+    finished = set()
+    try:
+        for track_name, track_results in groupby(engine.transcribe(all_jobs()), key=lambda r: r.job.track):
+            try:
+                if merge_track(track_name, list(track_results), output_directory, artifacts, note_store):
+                    successful += 1
+                else:
+                    failed += 1
+            except Exception as e:
+                print(f"Error processing track {track_name}: {str(e)}")
+                failed += 1
+            finished.add(track_name)
+    finally:
+        # The MIDI of every merged track is already on disk; keep its notes even if the loop is interrupted
+        if note_store is not None:
+            note_store.flush()
+
+    # Tracks where no stem could be loaded (or every stem is silent) never produce results
+    failed += sum(1 for d in with_stems if os.path.basename(d) not in finished)
+
+    print(f"\nProcessing complete!")
+    print(f"Successfully processed: {successful} tracks")
+    print(f"Failed to process: {failed} tracks")
+    print(f"Model windows processed: {engine.windows_processed}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transcribe separated stems into multitrack MIDI files")
+    parser.add_argument("base_directory", help="Directory with one folder of stems per track")
+    parser.add_argument("output_directory", help="Directory for the combined MIDI files")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Model windows per inference batch")
+    parser.add_argument("--artifacts", nargs="*", default=[], choices=ARTIFACTS,
+                        help="Per-stem outputs to keep in <output_directory>/<track>/")
+    parser.add_argument("--note-store", default=None, help="Also append every track's notes to this NoteStore directory")
+    parser.add_argument("--silence-db", type=float, default=DEFAULT_THRESHOLDS['silence_db'],
+                        help="Frames quieter than this (dBFS RMS) count as inactive")
+    parser.add_argument("--min-active-sec", type=float, default=DEFAULT_THRESHOLDS['min_active_sec'],
+                        help="Stems with less activity than this are not transcribed")
+    parser.add_argument("--keep-silent", action="store_true", help="Transcribe every stem")
+    parser.add_argument("--fingerprints", metavar="DB",
+                        help="Skip tracks this fingerprint index flags as duplicates (their MIDI is copied on ingest)")
+
+    args = parser.parse_args()
+
+    note_store = NoteStore(args.note_store) if args.note_store else None
+    thresholds = None if args.keep_silent else {'silence_db': args.silence_db, 'min_active_sec': args.min_active_sec}
+    skip_tracks = set()
+    if args.fingerprints:
+        from fingerprint_index import duplicate_tracks
+
+        skip_tracks = duplicate_tracks(args.fingerprints)
+    process_all_tracks(args.base_directory, args.output_directory, batch_size=args.batch_size,
+                       artifacts=set(args.artifacts), note_store=note_store, thresholds=thresholds,
+                       skip_tracks=skip_tracks)
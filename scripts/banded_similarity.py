@@ -0,0 +1,154 @@
+"""
+Banded, bounded-memory time-lag similarity for long recordings.
+
+pychorus' TimeTimeSimilarityMatrix and TimeLagSimilarityMatrix build dense
+N x N float64 matrices over the chroma frames, and `denoise` allocates several
+more temporaries of the same size. That is fine for a pop song but an hour-long
+recording needs many GB.
+
+BandedTimeLagSimilarityMatrix only keeps the lags the chorus search actually
+looks at ([0, max_lag)), stores them as float32 and computes/denoises the band
+in blocks of lag rows. The result can optionally be spilled to a memmap, so peak
+memory grows linearly with the number of chroma frames instead of quadratically.
+
+The layout matches the dense matrix used by the segmentation notebook:
+matrix[lag, t] is the similarity between chroma frame t and frame t - lag, and
+only entries with t >= lag are meaningful (everything else is zero).
+"""
+
+import os
+import tempfile
+from math import sqrt
+from typing import Optional
+
+import numpy as np
+import scipy.ndimage
+
+# Number of lag rows denoised at a time
+DEFAULT_BLOCK_ROWS = 64
+
+
+def raw_time_lag_rows(chroma, lag_start, lag_stop):
+    """Time-lag similarity for lags [lag_start, lag_stop); out-of-range lags are zero rows"""
+    num_chroma, num_samples = chroma.shape
+    rows = np.zeros((lag_stop - lag_start, num_samples), dtype=np.float32)
+    for i, lag in enumerate(range(lag_start, lag_stop)):
+        if lag < 0 or lag >= num_samples:
+            continue
+        diff = chroma[:, lag:] - chroma[:, :num_samples - lag]
+        rows[i, lag:] = 1 - np.sqrt(np.sum(diff * diff, axis=0)) / sqrt(num_chroma)
+    return rows
+
+
+def _trailing_leading_means(matrix, size):
+    """Zero-padded means over the `size` columns ending at / starting at each column"""
+    num_samples = matrix.shape[1]
+    cumulative = np.zeros((matrix.shape[0], num_samples + 1), dtype=np.float64)
+    np.cumsum(matrix, axis=1, out=cumulative[:, 1:])
+    idx = np.arange(num_samples)
+    trailing = cumulative[:, idx + 1] - cumulative[:, np.maximum(idx + 1 - size, 0)]
+    leading = cumulative[:, np.minimum(idx + size, num_samples)] - cumulative[:, idx]
+    return (trailing / size).astype(np.float32), (leading / size).astype(np.float32)
+
+
+class BandedTimeLagSimilarityMatrix:
+    """Drop-in replacement for pychorus' TimeLagSimilarityMatrix restricted to lags < max_lag"""
+
+    def __init__(self, chroma, sample_rate, max_lag: int,
+                 block_rows: int = DEFAULT_BLOCK_ROWS, spill_dir: Optional[str] = None):
+        self.chroma = np.ascontiguousarray(chroma, dtype=np.float32)
+        self.sample_rate = sample_rate
+        self.num_samples = self.chroma.shape[1]
+        self.max_lag = max(1, min(int(max_lag), self.num_samples))
+        self.block_rows = block_rows
+        self.spill_path = None
+        self.matrix = self._allocate((self.max_lag, self.num_samples), spill_dir)
+
+        for start in range(0, self.max_lag, self.block_rows):
+            stop = min(start + self.block_rows, self.max_lag)
+            self.matrix[start:stop] = raw_time_lag_rows(self.chroma, start, stop)
+
+    def _allocate(self, shape, spill_dir):
+        """Allocate the band in memory, or as a memmap in spill_dir"""
+        if spill_dir is None:
+            return np.zeros(shape, dtype=np.float32)
+        os.makedirs(spill_dir, exist_ok=True)
+        fd, self.spill_path = tempfile.mkstemp(suffix='.similarity.f32', dir=spill_dir)
+        os.close(fd)
+        return np.memmap(self.spill_path, dtype=np.float32, mode='w+', shape=shape)
+
+    def close(self):
+        """Release the band and remove the memmap spill file, if any"""
+        self.matrix = None
+        if self.spill_path and os.path.exists(self.spill_path):
+            os.remove(self.spill_path)
+        self.spill_path = None
+
+    def denoise(self, smoothing_size):
+        """Same suppression scheme as pychorus' denoise, computed block by block.
+
+        The time-time matrix is not needed: its diagonal averages are read from
+        neighbouring lag rows, which are recomputed from the chroma per block.
+        Entries below the diagonal (t < lag) are treated as zero.
+        """
+        smoothing_size = max(1, int(smoothing_size))
+        halo = smoothing_size - 1
+        n = self.num_samples
+        time_idx = np.arange(n)
+
+        for start in range(0, self.max_lag, self.block_rows):
+            stop = min(start + self.block_rows, self.max_lag)
+            num_rows = stop - start
+            lags = np.arange(start, stop)[:, None]
+
+            # Raw band for this block plus `halo` rows on either side
+            extended = raw_time_lag_rows(self.chroma, start - halo, stop + halo)
+            block = extended[halo:halo + num_rows]
+
+            left_average, right_average = _trailing_leading_means(block, smoothing_size)
+            max_horizontal_average = np.maximum(left_average, right_average)
+            del left_average, right_average
+
+            down_average = np.zeros((num_rows, n), dtype=np.float32)
+            up_average = np.zeros((num_rows, n), dtype=np.float32)
+            ll_average = np.zeros((num_rows, n), dtype=np.float32)
+            ur_average = np.zeros((num_rows, n), dtype=np.float32)
+            for k in range(smoothing_size):
+                down_average += extended[halo - k:halo - k + num_rows]
+                up_average += extended[halo + k:halo + k + num_rows]
+                # Diagonal neighbours: similarity of frame t - lag with frames t - k and t + k
+                ll_average[:, k:] += extended[halo - k:halo - k + num_rows, :n - k]
+                ur_average[:, :n - k] += extended[halo + k:halo + k + num_rows, k:]
+                # For lag < k the left neighbour lies on the other side of the diagonal
+                for lag in range(start, min(stop, k)):
+                    if k - lag < n and lag < n:
+                        ll_average[lag - start, k:] += self._row(extended, start - halo, k - lag)[k - lag:n - lag]
+            for average in (down_average, up_average, ll_average, ur_average):
+                average /= smoothing_size
+            diagonal_mask = time_idx[None, :] <= lags
+            ll_average[diagonal_mask] = 0
+            ur_average[diagonal_mask] = 0
+
+            non_horizontal_max = np.maximum.reduce([down_average, up_average, ll_average, ur_average])
+            non_horizontal_min = np.minimum.reduce([down_average, up_average, ll_average, ur_average])
+            del down_average, up_average, ll_average, ur_average, extended
+
+            suppression = np.where(max_horizontal_average > non_horizontal_max,
+                                   non_horizontal_min, non_horizontal_max)
+            denoised = max_horizontal_average - suppression
+            denoised[time_idx[None, :] < lags] = 0
+
+            denoised = scipy.ndimage.gaussian_filter1d(denoised, smoothing_size, axis=1)
+            np.maximum(denoised, 0, out=denoised)
+            denoised[lags[:, 0] < 5] = 0
+            self.matrix[start:stop] = denoised
+
+        if isinstance(self.matrix, np.memmap):
+            self.matrix.flush()
+
+    def _row(self, extended, extended_start, lag):
+        """Raw similarity row for `lag`, from the block's extended rows when available"""
+        offset = lag - extended_start
+        if 0 <= offset < extended.shape[0]:
+            return extended[offset]
+        return raw_time_lag_rows(self.chroma, lag, lag + 1)[0]
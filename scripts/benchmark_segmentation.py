@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Benchmark the segmentation pipeline against human-corrected labels.
+
+Annotators correct the automatic labels in Audacity and the results end up in
+./labels/<audio file>_labels.txt. This script re-runs the pipeline in
+scripts/segmentation.py over every audio file that has such a reference and
+reports:
+
+- boundary hit rate (precision / recall / F-measure) at several tolerances,
+  ignoring the track start and end boundaries
+- label agreement: the fraction of the reference timeline where the automatic
+  label matches the corrected one
+- wall time and peak traced memory for each pipeline stage
+
+Predictions are written to a separate output directory so the references are
+never overwritten. Use --no-memory for timings without tracemalloc overhead.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import segmentation
+
+DEFAULT_TOLERANCES = [0.5, 1.0, 3.0]
+LABEL_GRID_SEC = 0.1
+
+
+class StageRecorder:
+    """Context manager factory recording wall time and peak memory per stage"""
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.seconds = defaultdict(float)
+        self.peak_mb = defaultdict(float)
+
+    @contextmanager
+    def __call__(self, name):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+            if self.trace_memory:
+                peak = (tracemalloc.get_traced_memory()[1] - baseline) / 2**20
+                self.peak_mb[name] = max(self.peak_mb[name], peak)
+
+
+def segment_boundaries(segments):
+    """Inner boundaries of a segmentation (track start and end removed)"""
+    times = sorted({round(t, 3) for start, end, _ in segments for t in (start, end)})
+    return times[1:-1]
+
+
+def boundary_scores(reference, estimate, tolerance):
+    """Precision, recall and F-measure of boundary hits within +/- tolerance seconds"""
+    # Greedy left-to-right matching is a maximum matching for points on a line
+    hits = 0
+    j = 0
+    for ref in reference:
+        while j < len(estimate) and estimate[j] < ref - tolerance:
+            j += 1
+        if j < len(estimate) and abs(estimate[j] - ref) <= tolerance:
+            hits += 1
+            j += 1
+    precision = hits / len(estimate) if estimate else 0.0
+    recall = hits / len(reference) if reference else 0.0
+    f_measure = 2 * precision * recall / (precision + recall) if hits else 0.0
+    return precision, recall, f_measure
+
+
+def label_at(segments, t):
+    """Label of the segment containing time t, or None"""
+    for start, end, label in segments:
+        if start <= t < end:
+            return label
+    return None
+
+
+def label_agreement(reference, estimate):
+    """Fraction of the reference timeline where both segmentations use the same label"""
+    if not reference:
+        return 0.0
+    end = max(seg[1] for seg in reference)
+    steps = int(end / LABEL_GRID_SEC)
+    if steps == 0:
+        return 0.0
+    matches = 0
+    for i in range(steps):
+        t = (i + 0.5) * LABEL_GRID_SEC
+        ref_label = label_at(reference, t)
+        if ref_label is not None and ref_label == label_at(estimate, t):
+            matches += 1
+    return matches / steps
+
+
+def find_reference_set(audio_dir, reference_dir):
+    """Audio files that have a corrected label file"""
+    pairs = []
+    for audio_file in sorted(os.listdir(audio_dir)):
+        if not audio_file.endswith(('.mp3', '.wav')):
+            continue
+        labels_file = Path(reference_dir) / f"{audio_file}_labels.txt"
+        if labels_file.exists() and labels_file.stat().st_size > 0:
+            pairs.append((audio_file, labels_file))
+    return pairs
+
+
+def benchmark_track(audio_path, labels_path, output_dir, tolerances, trace_memory):
+    """Run the pipeline on one track and score it against its reference labels"""
+    recorder = StageRecorder(trace_memory)
+    start = time.perf_counter()
+    estimate = segmentation.segment_audio_file(str(audio_path), stage=recorder)
+    total_seconds = time.perf_counter() - start
+    segmentation.write_labels(os.path.join(output_dir, f"{Path(audio_path).name}_labels.txt"), estimate)
+
+    reference = segmentation.read_labels(labels_path)
+    ref_bounds = segment_boundaries(reference)
+    est_bounds = segment_boundaries(estimate)
+    result = {
+        'file': Path(audio_path).name,
+        'seconds': total_seconds,
+        'stage_seconds': dict(recorder.seconds),
+        'stage_peak_mb': dict(recorder.peak_mb),
+        'label_agreement': label_agreement(reference, estimate),
+        'boundaries': {},
+    }
+    for tolerance in tolerances:
+        precision, recall, f_measure = boundary_scores(ref_bounds, est_bounds, tolerance)
+        result['boundaries'][str(tolerance)] = {
+            'precision': precision, 'recall': recall, 'f_measure': f_measure}
+    return result
+
+
+def summarize(results, tolerances):
+    """Average scores and stage costs over all tracks"""
+    count = len(results)
+    summary = {
+        'tracks': count,
+        'label_agreement': sum(r['label_agreement'] for r in results) / count,
+        'boundaries': {},
+        'stage_seconds': {},
+        'stage_peak_mb': {},
+        'total_seconds': sum(r['seconds'] for r in results),
+    }
+    for tolerance in tolerances:
+        key = str(tolerance)
+        summary['boundaries'][key] = {
+            metric: sum(r['boundaries'][key][metric] for r in results) / count
+            for metric in ('precision', 'recall', 'f_measure')}
+    for name in segmentation.STAGES:
+        summary['stage_seconds'][name] = sum(r['stage_seconds'].get(name, 0.0) for r in results)
+        summary['stage_peak_mb'][name] = max(r['stage_peak_mb'].get(name, 0.0) for r in results)
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kilobytes on Linux
+        summary['max_rss_mb'] = max_rss / 2**20 if sys.platform == 'darwin' else max_rss / 2**10
+    return summary
+
+
+def print_summary(summary, tolerances):
+    print(f"\nTracks: {summary['tracks']}    total time: {summary['total_seconds']:.1f}s")
+    if 'max_rss_mb' in summary:
+        print(f"Process peak RSS: {summary['max_rss_mb']:.0f} MB")
+
+    print(f"\n{'tolerance':>10} {'precision':>10} {'recall':>10} {'F':>10}")
+    for tolerance in tolerances:
+        scores = summary['boundaries'][str(tolerance)]
+        print(f"{tolerance:>9}s {scores['precision']:>10.3f} {scores['recall']:>10.3f} {scores['f_measure']:>10.3f}")
+    print(f"\nLabel agreement: {summary['label_agreement']:.3f}")
+
+    total = sum(summary['stage_seconds'].values()) or 1.0
+    print(f"\n{'stage':<18} {'seconds':>10} {'share':>8} {'peak MB':>10}")
+    for name in segmentation.STAGES:
+        seconds = summary['stage_seconds'][name]
+        print(f"{name:<18} {seconds:>10.2f} {seconds / total:>7.1%} {summary['stage_peak_mb'][name]:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark segmentation accuracy and speed against corrected labels")
+    parser.add_argument("--audio-dir", default="./audio", help="Directory containing the reference audio files")
+    parser.add_argument("--reference-dir", default="./labels", help="Directory containing the corrected label files")
+    parser.add_argument("--output-dir", default=None, help="Where to write predicted labels (default: a temp dir)")
+    parser.add_argument("--tolerances", type=float, nargs="+", default=DEFAULT_TOLERANCES,
+                        help="Boundary hit tolerances in seconds")
+    parser.add_argument("--limit", type=int, default=None, help="Only benchmark the first N tracks")
+    parser.add_argument("--memory", action=argparse.BooleanOptionalAction, default=True,
+                        help="Trace per-stage peak memory with tracemalloc (slows Python-heavy stages)")
+    parser.add_argument("--report", default=None, help="Write per-track results and the summary as JSON")
+
+    args = parser.parse_args()
+
+    pairs = find_reference_set(args.audio_dir, args.reference_dir)[:args.limit]
+    if not pairs:
+        print("No audio files with reference labels found.")
+        sys.exit(1)
+
+    output_dir = args.output_dir or tempfile.mkdtemp(prefix="segmentation_benchmark_")
+    os.makedirs(output_dir, exist_ok=True)
+    print(f"Benchmarking {len(pairs)} tracks, predictions in {output_dir}")
+
+    if args.memory:
+        tracemalloc.start()
+
+    results = []
+    for audio_file, labels_file in pairs:
+        try:
+            results.append(benchmark_track(Path(args.audio_dir) / audio_file, labels_file,
+                                           output_dir, args.tolerances, args.memory))
+        except Exception as e:
+            print(f"Error benchmarking {audio_file}: {str(e)}")
+
+    if not results:
+        print("No tracks were benchmarked successfully.")
+        sys.exit(1)
+
+    summary = summarize(results, args.tolerances)
+    print_summary(summary, args.tolerances)
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'summary': summary, 'tracks': results}, f, indent=2)
+        print(f"\nReport written to {args.report}")
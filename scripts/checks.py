@@ -1,3 +1,4 @@
+import importlib.util
 import os
 import subprocess
 import sys
@@ -13,59 +14,28 @@ from mutagen import File
 from mutagen.mp3 import MP3
 from mutagen.wave import WAVE
 
+from label_store import LabelStore, VersionConflict
+
 console = Console()
 
-try:
-    import pyautogui
-    import pygetwindow as gw
-    WINDOWS_AUTOMATION_AVAILABLE = True
-except ImportError:
-    WINDOWS_AUTOMATION_AVAILABLE = False
+# Labels, descriptions and status live in the label store; the text files are only written for Audacity and export
+LABEL_STORE_PATH = os.environ.get('LABEL_STORE', './labels.db')
+STATUS_MARKUP = {'done': "[green]DONE[/green]", 'partial': "[yellow]PARTIAL[/yellow]", 'todo': "[red]TODO[/red]"}
+_store = None
 
-def get_processing_status(audio_file):
-    """Check if file has been processed (has labels and description)"""
-    base_name = Path(audio_file).stem
-    
-    # Handle both .mp3 and .wav extensions in labels filename
-    labels_file = Path('./labels') / f"{audio_file}_labels.txt"  # Using full audio_file name
-    desc_file = Path('./descriptions') / f"{base_name}_description.txt"
-    
-    has_labels = False
-    has_desc = False
-    is_processed = False
-    
-    # Check labels file
-    if labels_file.exists() and labels_file.stat().st_size > 0:
-        # Check if file has valid content (at least one line with timestamps)
-        try:
-            with open(labels_file) as f:
-                content = f.read().strip()
-                has_labels = bool(content and '\t' in content)  # Check for tab-separated content
-        except Exception:
-            has_labels = False
-    
-    # Check description file and its processed status
-    if desc_file.exists() and desc_file.stat().st_size > 0:
-        try:
-            with open(desc_file) as f:
-                content = f.read()
-                # Check if description and genre tags are not empty
-                has_description = 'description:\n' in content and len(content.split('description:\n')[1].split('genre-tags:')[0].strip()) > 0
-                has_tags = 'genre-tags:\n' in content and len(content.split('genre-tags:\n')[1].split('processed:')[0].strip()) > 0
-                # Check processed status
-                is_processed = 'processed: true' in content
-                
-                has_desc = has_description and has_tags
-        except Exception:
-            has_desc = False
-            is_processed = False
-    
-    # Determine status
-    if has_labels and has_desc and is_processed:
-        return "[green]DONE[/green]"
-    elif has_labels or has_desc:
-        return "[yellow]PARTIAL[/yellow]"
-    return "[red]TODO[/red]"
+def get_store():
+    """The shared LabelStore, opened on first use"""
+    global _store
+    if _store is None:
+        _store = LabelStore(LABEL_STORE_PATH, journal_mode=os.environ.get('LABEL_STORE_JOURNAL', 'wal'))
+    return _store
+
+# pyautogui pulls in its screenshot and GUI backends on import, so it is only
+# loaded when the Windows automation actually runs (see AudacityAutomation)
+WINDOWS_AUTOMATION_AVAILABLE = all(importlib.util.find_spec(name) is not None
+                                   for name in ('pyautogui', 'pygetwindow'))
+pyautogui = None
+gw = None
 
 def get_audio_duration(file_path):
     """Get duration of audio file in minutes:seconds format"""
@@ -104,7 +74,7 @@ def get_audio_duration(file_path):
         print(f"Warning: Could not read duration for {file_path}: {str(e)}")
         return "--:--"
 
-def create_table(audio_files, page=1, per_page=10):
+def create_table(audio_files, page=1, per_page=10, empty_message=None):
     """Creates a paginated rich table of audio files with status"""
     start_idx = (page - 1) * per_page
     end_idx = start_idx + per_page
@@ -118,15 +88,18 @@ def create_table(audio_files, page=1, per_page=10):
     table.add_column("Type", style="blue")
     
     audio_dir = Path('./audio')
+    statuses = get_store().statuses(current_files)  # one query for the whole page
     for i, file in enumerate(current_files, start_idx + 1):
         file_path = audio_dir / file
         duration = get_audio_duration(file_path)
-        status = get_processing_status(file)
+        status = STATUS_MARKUP[statuses.get(file, 'todo')]
         file_type = file_path.suffix.upper()[1:]  # Remove dot and uppercase
         table.add_row(str(i), status, file, duration, file_type)
     
     total_pages = (len(audio_files) + per_page - 1) // per_page
-    if total_pages > 1:
+    if not audio_files and empty_message:
+        table.caption = empty_message
+    elif total_pages > 1:
         table.caption = f"Page {page} of {total_pages} (use 'n' for next, 'p' for previous)"
     
     return table, total_pages
@@ -137,6 +110,7 @@ def create_menu():
 [cyan]1.[/cyan] Process Audio File (Edit Labels & Description)
 [cyan]2.[/cyan] Edit Labels Only
 [cyan]3.[/cyan] Edit Description Only
+[cyan]t.[/cyan] Show TODO Files Only / All Files
 [cyan]q.[/cyan] Quit
     """
     return Panel(menu_text, title="🎵 Actions", border_style="blue", box=box.ROUNDED)
@@ -190,17 +164,14 @@ def display_current_file(audio_file):
         info.append("\nSample Rate: ", style="blue")
         info.append(file_info['sample_rate'], style="yellow")
     
-    desc_file = Path('./descriptions') / f"{Path(audio_file).stem}_description.txt"
-    if desc_file.exists():
-        with open(desc_file) as f:
-            content = f.read()
-            current_desc = content.split('description:\n')[1].split('genre-tags:')[0].strip()
-            current_tags = content.split('genre-tags:')[1].split('processed:')[0].strip()
-            
+    record = get_store().get(audio_file)
+    if record is not None:
         info.append("\n\nDescription: ", style="blue")
-        info.append(current_desc or "None", style="yellow")
+        info.append(record['description'] or "None", style="yellow")
         info.append("\nGenre Tags: ", style="blue")
-        info.append(current_tags or "None", style="yellow")
+        info.append(record['genre_tags'] or "None", style="yellow")
+        info.append("\nVersion: ", style="blue")
+        info.append(f"{record['version']} ({record['updated_by'] or 'never saved'})", style="yellow")
     
     return Panel(info, title="Current File Info", border_style="green", box=box.ROUNDED)
 def get_confirmation(prompt_text):
@@ -252,6 +223,10 @@ def create_apple_script(labels_path):
 
 class AudacityAutomation:
     def __init__(self):
+        global pyautogui, gw
+        if pyautogui is None:
+            import pyautogui
+            import pygetwindow as gw
         self.audacity_window = None
         self.current_audio_file = None
         
@@ -453,6 +428,12 @@ def open_in_audacity(audio_file):
     audio_path = os.path.abspath(audio_file)
     labels_path = os.path.abspath(f"./labels/{os.path.basename(audio_file)}_labels.txt")
     
+    # Hand Audacity the labels as they are in the store now
+    record = get_store().get(os.path.basename(audio_file))
+    if record is not None and record['labels']:
+        os.makedirs(os.path.dirname(labels_path), exist_ok=True)
+        get_store().export_labels_file(record['audio_file'], labels_path)
+    
     if not os.path.exists(labels_path):
         console.print(f"[red]Labels file not found: {labels_path}[/red]")
         return False
@@ -501,41 +482,35 @@ def open_in_audacity(audio_file):
         console.print(f"[red]Error: {str(e)}[/red]")
         return False
 
-def create_description_file(audio_file):
-    """Creates or updates a description file for an audio file"""
-    desc_dir = Path('./descriptions')
-    desc_dir.mkdir(exist_ok=True)
-    
-    base_name = Path(audio_file).stem
-    desc_file = desc_dir / f"{base_name}_description.txt"
-    
-    if not desc_file.exists():
-        with open(desc_file, 'w') as f:
-            f.write("description:\ngenre-tags:\nprocessed: true")
-    return desc_file
-
 def update_processing_status(audio_file):
-    """Updates the processing status in the description file"""
-    desc_file = create_description_file(audio_file)
-    
-    with open(desc_file, 'r') as f:
-        content = f.read()
-    
-    if 'processed:' not in content:
-        content += '\nprocessed: true'
-    
-    with open(desc_file, 'w') as f:
-        f.write(content)
+    """Marks the file as processed in the label store"""
+    get_store().mark_processed(audio_file)
+
+def save_or_confirm_overwrite(save, audio_file):
+    """Run save(expected_version); if someone else saved first, ask before overwriting their version"""
+    try:
+        save()
+        return True
+    except VersionConflict as e:
+        console.print(f"[red]Another annotator saved {audio_file} while you were editing: {e}[/red]")
+        if get_confirmation("Overwrite their changes with yours?"):
+            save(overwrite=True)
+            return True
+        console.print("[yellow]Kept their version; your changes were not saved.[/yellow]")
+        return False
+
+def import_edited_labels(audio_file, labels_path, version):
+    """Store the labels Audacity exported, unless the track changed since `version` was read"""
+    def save(overwrite=False):
+        get_store().import_labels_file(audio_file, labels_path, expected_version=None if overwrite else version)
+    return save_or_confirm_overwrite(save, audio_file)
         
 def edit_description(audio_file):
     """Manages the description editing process for an audio file"""
-    desc_file = create_description_file(audio_file)
-    
-    with open(desc_file) as f:
-        content = f.read()
-        current_desc = content.split('description:\n')[1].split('genre-tags:')[0].strip()
-        tags_section = content.split('genre-tags:\n')[1]
-        current_tags = tags_section.split('processed:')[0].strip()
+    get_store().add_tracks([audio_file])
+    record = get_store().get(audio_file)
+    current_desc = record['description']
+    current_tags = record['genre_tags']
     
     print(f"\nWorking on: {audio_file}")
     
@@ -549,10 +524,10 @@ def edit_description(audio_file):
     if not new_tags:
         new_tags = current_tags
     
-    with open(desc_file, 'w') as f:
-        f.write(f"description:\n{new_desc}\ngenre-tags:\n{new_tags}\nprocessed: true")
-    
-    return True
+    def save(overwrite=False):
+        get_store().update(audio_file, expected_version=None if overwrite else record['version'],
+                           description=new_desc, genre_tags=new_tags, processed=True)
+    return save_or_confirm_overwrite(save, audio_file)
 
 def create_export_apple_script(labels_path):
     """Creates AppleScript to export labels from Audacity, with Select All before export"""
@@ -649,6 +624,10 @@ def process_audio_file(audio_file, audio_dir, action):
     console.print(display_current_file(audio_file))
     
     if action in ['1', '2']:
+        get_store().add_tracks([audio_file])
+        # The version the annotator starts from; saving checks that nobody else saved in between
+        version = get_store().get(audio_file)['version']
+        
         # First show the status while opening Audacity
         with console.status("[bold yellow]Opening in Audacity...", spinner="dots"):
             success = open_in_audacity(os.path.join(audio_dir, audio_file))
@@ -661,20 +640,26 @@ def process_audio_file(audio_file, audio_dir, action):
                 labels_path = os.path.abspath(f"./labels/{os.path.basename(audio_file)}_labels.txt")
                 with console.status("[bold yellow]Exporting updated labels...", spinner="dots"):
                     # Pass the audio_file name here
-                    if export_labels(labels_path, audio_file):
+                    exported = export_labels(labels_path, audio_file)
+                if not exported and os.path.exists(labels_path):
+                    exported = get_confirmation("Import the labels file you saved manually?")
+                if exported and os.path.exists(labels_path):
+                    if import_edited_labels(audio_file, labels_path, version):
                         update_processing_status(audio_file)
     
     if action in ['1', '3']:
         console.print("\n[bold yellow]Editing description...[/bold yellow]")
-        if edit_description(audio_file):
-            update_processing_status(audio_file)
+        edit_description(audio_file)
         
 
 def main():
     audio_dir = Path('./audio')
-    audio_files = sorted([f for f in os.listdir(audio_dir) if f.endswith(('.mp3', '.wav'))])
+    all_files = sorted([f for f in os.listdir(audio_dir) if f.endswith(('.mp3', '.wav'))])
+    # Register new files and import any label/description text files they already have
+    get_store().sync_files(all_files)
+    todo_only = False
     
-    if not audio_files:
+    if not all_files:
         console.print(Panel("[red]No audio files found in ./audio directory[/red]", 
                           title="Error", border_style="red", box=box.ROUNDED))
         return
@@ -687,11 +672,25 @@ def main():
             clear_screen()
             console.print(Panel("🎧 Audio Processing Tool", style="bold blue", box=box.ROUNDED))
             
-            table, total_pages = create_table(audio_files, page, per_page)
+            # Rebuilt every time, so files finished in TODO mode drop out of the list
+            if todo_only:
+                present = set(all_files)
+                audio_files = [f for f in get_store().todo() if f in present]
+            else:
+                audio_files = all_files
+            page = max(1, min(page, (len(audio_files) + per_page - 1) // per_page))
+            
+            table, total_pages = create_table(audio_files, page, per_page,
+                                              empty_message="[green]No TODO files left[/green] (press 't' to show all files)")
             console.print(table)
             console.print(create_menu())
             
-            action = Prompt.ask("\nChoose an action", choices=['1', '2', '3', 'q', 'n', 'p'])
+            action = Prompt.ask("\nChoose an action", choices=['1', '2', '3', 't', 'q', 'n', 'p'])
+            
+            if action == 't':
+                todo_only = not todo_only
+                page = 1
+                continue
             
             if action.lower() == 'q':
                 console.print("\n\n[green]Session Completed![/green]\n\n\n")
@@ -1,53 +1,120 @@
 """
 Compare FFT (STFT) and Constant-Q Transform (CQT) spectrograms.
 
-This script loads an audio file, computes both FFT-based and CQT spectrograms,
-and displays them side-by-side to visualize the differences between linear
-and logarithmic frequency representations.
+Renders, for every audio file in a directory, both FFT-based and CQT
+spectrograms side-by-side to visualize the differences between linear and
+logarithmic frequency representations. Files are spread over a process pool.
+
+The dB-scaled magnitudes are cached as .npy files keyed by the audio content
+hash and the transform parameters, so changing the plot (or re-running with
+--cache-only) re-renders images without recomputing any transform, and
+changing one transform's parameters leaves the other's cache valid.
+
+librosa and matplotlib are imported where they are used, so --help and
+modules that only read the cache (spectrogram_tiles.py) start without them.
 """
 
-import librosa
-import librosa.display
-import matplotlib.pyplot as plt
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
 import numpy as np
 
 # Configuration
-AUDIO_FILE = '/Users/mclem/Desktop/MusicGeneration/audio/jandl.wav'
-DURATION = 5.0  # seconds
 SR = 22050  # sample rate
+HOP_LENGTH = 512
+N_FFT = 2048
+N_BINS = 84
+BINS_PER_OCTAVE = 12
+EXTENSIONS = ('.mp3', '.wav', '.ogg', '.flac')
+TRANSFORMS = ('stft', 'cqt')
+
+
+def audio_hash(path, chunk_size=1 << 20):
+    """SHA-1 of the audio file's bytes, read in chunks"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def transform_params(kind, sr=SR, duration=None, hop_length=HOP_LENGTH, n_fft=N_FFT, n_bins=N_BINS,
+                     bins_per_octave=BINS_PER_OCTAVE):
+    """Everything that changes a transform's output, as a dict for the cache key"""
+    params = {'kind': kind, 'sr': sr, 'duration': duration, 'hop_length': hop_length}
+    if kind == 'stft':
+        params['n_fft'] = n_fft
+    else:
+        params.update(n_bins=n_bins, bins_per_octave=bins_per_octave)
+    return params
+
+
+def cache_path(cache_dir, digest, params):
+    """<cache_dir>/<kind>/<hash prefix>/<audio hash>-<params hash>.npy"""
+    params_key = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+    return Path(cache_dir) / params['kind'] / digest[:2] / f"{digest}-{params_key}.npy"
+
+
+def compute_transform(y, params):
+    """dB-scaled magnitude of an STFT or CQT, relative to its maximum"""
+    import librosa
+
+    if params['kind'] == 'stft':
+        D = librosa.stft(y, n_fft=params['n_fft'], hop_length=params['hop_length'])
+    else:
+        D = librosa.cqt(y, sr=params['sr'], hop_length=params['hop_length'], n_bins=params['n_bins'],
+                        bins_per_octave=params['bins_per_octave'])
+    return librosa.amplitude_to_db(np.abs(D), ref=np.max).astype(np.float32)
 
-def main():
-    print(f"Loading audio file: {AUDIO_FILE}")
-    print(f"Duration: {DURATION} seconds")
 
-    # Load audio file (first 10 seconds)
-    y, sr = librosa.load(AUDIO_FILE, duration=DURATION, sr=SR)
-    print(f"Loaded {len(y)} samples at {sr} Hz")
+def load_transforms(audio_path, cache_dir, all_params, cache_only=False):
+    """{kind: dB array} from the cache, computing (and caching) the missing ones from the audio"""
+    digest = audio_hash(audio_path)
+    results = {}
+    y = None
+    for params in all_params:
+        path = cache_path(cache_dir, digest, params)
+        if path.exists():
+            results[params['kind']] = np.load(path)
+            continue
+        if cache_only:
+            raise FileNotFoundError(f"No cached {params['kind']} for {audio_path}")
+        if y is None:
+            import librosa
+            y, _ = librosa.load(str(audio_path), sr=params['sr'], duration=params['duration'])
+        results[params['kind']] = compute_transform(y, params)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, 'wb') as f:
+            np.save(f, results[params['kind']])
+        os.replace(tmp_path, path)
+    return results
 
-    # Compute FFT-based spectrogram (STFT)
-    print("\nComputing STFT (FFT-based spectrogram)...")
-    D_stft = librosa.stft(y)
-    S_stft_db = librosa.amplitude_to_db(np.abs(D_stft), ref=np.max)
 
-    # Compute Constant-Q Transform spectrogram
-    print("Computing CQT (Constant-Q Transform spectrogram)...")
-    C_cqt = librosa.cqt(y, sr=sr, hop_length=512)
-    S_cqt_db = librosa.amplitude_to_db(np.abs(C_cqt), ref=np.max)
+def render_comparison(S_stft_db, S_cqt_db, sr, hop_length, title, output_file):
+    import librosa.display
+    import matplotlib
+    matplotlib.use('Agg')  # workers render to files, never to a window
+    import matplotlib.pyplot as plt
 
     # Create side-by-side visualization
-    print("\nCreating visualization...")
     fig, axes = plt.subplots(2, 1, figsize=(14, 10))
 
     # Plot STFT
     img1 = librosa.display.specshow(
         S_stft_db,
         sr=sr,
+        hop_length=hop_length,
         x_axis='time',
         y_axis='hz',
         ax=axes[0],
         cmap='viridis'
     )
-    axes[0].set_title('FFT-Based Spectrogram (STFT) - Linear Frequency Scale',
+    axes[0].set_title(f'{title}: FFT-Based Spectrogram (STFT) - Linear Frequency Scale',
                       fontsize=14, fontweight='bold')
     axes[0].set_ylabel('Frequency (Hz)', fontsize=12)
     fig.colorbar(img1, ax=axes[0], format='%+2.0f dB')
@@ -56,6 +123,7 @@ def main():
     img2 = librosa.display.specshow(
         S_cqt_db,
         sr=sr,
+        hop_length=hop_length,
         x_axis='time',
         y_axis='cqt_hz',
         ax=axes[1],
@@ -74,14 +142,72 @@ def main():
              ha='center', fontsize=10, style='italic', wrap=True)
 
     plt.tight_layout(rect=[0, 0.03, 1, 1])
-
-    # Save and show
-    output_file = '/Users/mclem/Desktop/MusicGeneration/scripts/fft_vs_cqt_comparison.png'
     plt.savefig(output_file, dpi=150, bbox_inches='tight')
-    print(f"\nVisualization saved to: {output_file}")
+    plt.close(fig)
+
+
+def render_file(audio_path, output_dir, cache_dir, all_params, cache_only=False):
+    """Render <output_dir>/<audio stem>_fft_vs_cqt.png for one audio file"""
+    transforms = load_transforms(audio_path, cache_dir, all_params, cache_only)
+    output_file = Path(output_dir) / f"{Path(audio_path).stem}_fft_vs_cqt.png"
+    render_comparison(transforms['stft'], transforms['cqt'], all_params[0]['sr'], all_params[0]['hop_length'],
+                      Path(audio_path).stem, output_file)
+    return output_file
+
+
+def find_audio_files(input_path):
+    """A single audio file, or the supported audio files in a directory"""
+    input_path = Path(input_path)
+    if input_path.is_file():
+        return [input_path]
+    return sorted(f for f in input_path.iterdir() if f.suffix.lower() in EXTENSIONS)
+
+
+def render_all(input_path, output_dir, cache_dir, workers=None, overwrite=False, cache_only=False, **transform_kwargs):
+    """Render every audio file in input_path on a process pool"""
+    os.makedirs(output_dir, exist_ok=True)
+    all_params = [transform_params(kind, **transform_kwargs) for kind in TRANSFORMS]
+
+    audio_files = find_audio_files(input_path)
+    if not overwrite:
+        audio_files = [f for f in audio_files if not (Path(output_dir) / f"{f.stem}_fft_vs_cqt.png").exists()]
+    print(f"Rendering {len(audio_files)} files")
+
+    successful = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(render_file, f, output_dir, cache_dir, all_params, cache_only): f
+                   for f in audio_files}
+        for future in as_completed(futures):
+            try:
+                print(f"Saved: {future.result()}")
+                successful += 1
+            except Exception as e:
+                print(f"Error rendering {futures[future].name}: {str(e)}")
 
-    plt.show()
     print("\nDone!")
+    print(f"Rendered: {successful} files")
+    print(f"Failed: {len(audio_files) - successful} files")
+
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Render FFT vs CQT spectrogram comparisons for a directory of audio")
+    parser.add_argument("input_path", help="Audio file or directory of audio files")
+    parser.add_argument("output_dir", help="Directory for the PNG images")
+    parser.add_argument("--cache-dir", default=None, help="Transform cache (default: <output_dir>/.cache)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--duration", type=float, default=None, help="Only the first N seconds of each file")
+    parser.add_argument("--sr", type=int, default=SR, help="Sample rate")
+    parser.add_argument("--hop-length", type=int, default=HOP_LENGTH)
+    parser.add_argument("--n-fft", type=int, default=N_FFT)
+    parser.add_argument("--n-bins", type=int, default=N_BINS, help="CQT bins")
+    parser.add_argument("--bins-per-octave", type=int, default=BINS_PER_OCTAVE)
+    parser.add_argument("--overwrite", action="store_true", help="Re-render images that already exist")
+    parser.add_argument("--cache-only", action="store_true",
+                        help="Only re-render from cached transforms; files without a cache entry fail")
+
+    args = parser.parse_args()
+
+    render_all(args.input_path, args.output_dir, args.cache_dir or os.path.join(args.output_dir, ".cache"),
+               workers=args.workers, overwrite=args.overwrite, cache_only=args.cache_only,
+               sr=args.sr, duration=args.duration, hop_length=args.hop_length, n_fft=args.n_fft,
+               n_bins=args.n_bins, bins_per_octave=args.bins_per_octave)
@@ -7,11 +7,11 @@ from rich.console import Console
 from rich.panel import Panel
 from rich.progress import Progress
 from rich.prompt import Confirm
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
 import pickle
 
+from instrumentation import count, span
+from label_store import DEFAULT_PATH as LABEL_STORE_DEFAULT_PATH, LabelStore
+
 console = Console()
 
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
@@ -22,6 +22,10 @@ DESCRIPTIONS_FOLDER_ID = '1q2RErYYsrCPGM-2aqIZCLS7ylqm_wyUQ'
 def get_google_drive_service():
     """Gets Google Drive service using service account credentials."""
     try:
+        # The Google API client takes seconds to import; only load it once we actually connect
+        from google.oauth2 import service_account
+        from googleapiclient.discovery import build
+
         # Path to your service account credentials JSON file
         SERVICE_ACCOUNT_FILE = './secrets/service-account.json'
         
@@ -58,6 +62,8 @@ def create_folder_if_not_exists(service, folder_name, parent_id=None):
 
 def upload_to_drive(service, file_path, folder_id):
     """Uploads a file to Google Drive in the specified folder."""
+    from googleapiclient.http import MediaFileUpload
+
     file_metadata = {
         'name': os.path.basename(file_path),
         'parents': [folder_id]
@@ -69,11 +75,14 @@ def upload_to_drive(service, file_path, folder_id):
         resumable=True
     )
     
-    file = service.files().create(
-        body=file_metadata,
-        media_body=media,
-        fields='id'
-    ).execute()
+    with span('drive.upload', file=os.path.basename(file_path)):
+        file = service.files().create(
+            body=file_metadata,
+            media_body=media,
+            fields='id'
+        ).execute()
+    count('drive.files')
+    count('drive.bytes', os.path.getsize(file_path))
     
     return file.get('id')
 
@@ -105,9 +114,21 @@ def cleanup_directories():
         console.print(f"[red]Error during cleanup: {str(e)}[/red]")
         return False
 
+def export_label_store():
+    """Write the current batch's labels and descriptions from the label store to the text files we upload"""
+    store_path = os.environ.get('LABEL_STORE', LABEL_STORE_DEFAULT_PATH)
+    if not os.path.exists(store_path):
+        return
+    audio_files = [f.name for f in Path('./audio').glob('*') if f.suffix.lower() in ['.mp3', '.wav']]
+    with LabelStore(store_path, journal_mode=os.environ.get('LABEL_STORE_JOURNAL', 'wal')) as store:
+        written = store.export_directory('./labels', './descriptions', audio_files=audio_files)
+    console.print(f"[green]Exported {written} tracks from the label store[/green]")
+
 def export_batch():
     """Main function to handle batch export and cleanup."""
     try:
+        export_label_store()
+        
         # Initialize Google Drive service
         with console.status("[bold yellow]Connecting to Google Drive...") as status:
             service = get_google_drive_service()
@@ -189,4 +210,9 @@ def export_batch():
         return False
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Upload ./labels and ./descriptions to Google Drive, then clean up locally")
+    parser.parse_args()
+
     export_batch()
\ No newline at end of file
@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+"""
+Find the same recording in several encodes and reuse its outputs.
+
+The corpus holds some recordings more than once, for example as a 128 kbps
+MP3, a 320 kbps MP3 and a WAV rip, each under a different name. Each copy was
+separated, segmented, transcribed and tagged separately. File names and byte
+hashes can't tell that these are the same music, but spectral landmarks can:
+
+1. The first FINGERPRINT_SEC seconds are decoded at 11.025 kHz and turned
+   into a log-magnitude spectrogram. The local maxima that stand out from
+   their neighbourhood are kept (at most PEAKS_PER_SEC per second). Lossy
+   encoding, resampling and gain changes leave these peaks in place.
+2. Each peak is paired with the next few peaks after it. A pair gives a hash
+   (anchor bin, target bin, frame distance) at the anchor's frame.
+3. Hashes go into a SQLite table clustered by hash (./fingerprints.db by
+   default). A query looks up its hashes and, for each indexed file, counts
+   the hits that agree on one time offset. The score is the share of the
+   query's hashes found at that offset. Unrelated music scores about 0.001 to
+   0.005. Another encode of the same recording can score as low as 0.1 once a
+   gain change, noise and an encoder delay have moved some peaks, so the
+   default threshold is 0.03, and at least MIN_MATCHES aligned hashes are
+   needed as well.
+
+A file is a near-duplicate when it scores at least --threshold against an
+indexed file and the two durations agree within DURATION_TOLERANCE, which
+keeps a song from matching a DJ mix that contains it. The first indexed copy
+is canonical. `ingest` adds only new or changed files, so the index grows
+incrementally as files arrive. It then copies stems, labels and MIDI to every
+copy that lacks them, from the canonical or else from whichever copy has
+them, so outputs made before the index existed are reused too. Labels are
+shifted by the measured offset. Stems and MIDI are only copied when the copies line up
+within MAX_REUSE_OFFSET_SEC.
+
+stem_separation.py, segmentation.py, audio_to_midi.py,
+parallel_audio_to_midi.py and audio_pipeline.py take --fingerprints DB and
+skip the flagged duplicates, so only the canonical copy is processed and a
+duplicate's MIDI only ever comes from the canonical. Run ingest again
+afterwards to fill in the duplicates:
+
+    python fingerprint_index.py ingest ../audio --stems-dir ../stems --labels-dir ../labels --midi-dir ../midi
+    python fingerprint_index.py duplicates
+    python fingerprint_index.py query some_new_file.mp3
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import time
+
+import numpy as np
+
+DEFAULT_PATH = "./fingerprints.db"
+EXTENSIONS = ('.mp3', '.wav', '.ogg', '.flac')
+
+SR = 11025
+N_FFT = 1024
+HOP_LENGTH = 256
+FINGERPRINT_SEC = 300
+# Neighbourhood a spectral peak must be the maximum of (frequency bins, frames)
+PEAK_NEIGHBORHOOD = (15, 11)
+PEAKS_PER_SEC = 20
+# Each anchor peak is paired with up to FAN_OUT later peaks at most MAX_DT frames ahead
+FAN_OUT = 5
+MAX_DT = 63
+DEFAULT_THRESHOLD = 0.03
+MIN_MATCHES = 20
+# Offset-histogram peaks this close to the highest one count as candidate alignments
+NEAR_PEAK_RATIO = 0.5
+DURATION_TOLERANCE = 0.02
+MAX_REUSE_OFFSET_SEC = 0.1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    audio_file TEXT NOT NULL UNIQUE,
+    size INTEGER,
+    mtime REAL,
+    duration REAL,
+    n_hashes INTEGER,
+    duplicate_of TEXT,
+    score REAL,
+    offset_sec REAL,
+    indexed_at REAL
+);
+CREATE TABLE IF NOT EXISTS hashes (
+    hash INTEGER NOT NULL,
+    file_id INTEGER NOT NULL,
+    t INTEGER NOT NULL,
+    PRIMARY KEY (hash, file_id, t)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS hashes_file ON hashes (file_id);
+"""
+
+
+def spectral_peaks(y, sr=SR):
+    """(frame, bin) of the prominent local maxima of the log spectrogram, in frame order"""
+    from scipy.ndimage import maximum_filter
+    from scipy.signal import stft
+
+    _, _, spectrum = stft(y, fs=sr, nperseg=N_FFT, noverlap=N_FFT - HOP_LENGTH, boundary=None, padded=False)
+    S = 20 * np.log10(np.maximum(np.abs(spectrum), 1e-10))
+    local_max = (S == maximum_filter(S, size=PEAK_NEIGHBORHOOD, mode='constant', cval=-np.inf))
+    # Skip the noise floor and silence
+    local_max &= S > max(np.median(S), S.max() - 60)
+    bins, frames = np.nonzero(local_max)
+
+    # Keep the strongest peaks of each second, so dense passages don't flood the index
+    frames_per_sec = int(round(sr / HOP_LENGTH))
+    magnitude = S[bins, frames]
+    order = np.lexsort((-magnitude, frames // frames_per_sec))
+    seconds = frames[order] // frames_per_sec
+    rank = np.arange(len(order)) - np.searchsorted(seconds, seconds)
+    keep = order[rank < PEAKS_PER_SEC]
+    keep = keep[np.lexsort((bins[keep], frames[keep]))]
+    return frames[keep], bins[keep]
+
+
+def fingerprint_audio(y, sr=SR):
+    """(hashes, anchor frames) for mono audio at SR"""
+    frames, bins = spectral_peaks(y, sr)
+    hashes = []
+    times = []
+    for i in range(len(frames)):
+        paired = 0
+        for j in range(i + 1, len(frames)):
+            dt = frames[j] - frames[i]
+            if dt > MAX_DT or paired == FAN_OUT:
+                break
+            if dt == 0:
+                continue
+            hashes.append((int(bins[i]) << 16) | (int(bins[j]) << 6) | int(dt))
+            times.append(int(frames[i]))
+            paired += 1
+    return np.array(hashes, dtype=np.int64), np.array(times, dtype=np.int64)
+
+
+def fingerprint_file(path, max_sec=FINGERPRINT_SEC):
+    """(hashes, anchor frames, duration in seconds) of an audio file"""
+    import librosa
+
+    duration = librosa.get_duration(path=path)
+    y, _ = librosa.load(path, sr=SR, mono=True, duration=max_sec)
+    hashes, times = fingerprint_audio(y, SR)
+    return hashes, times, duration
+
+
+class FingerprintIndex:
+    """Landmark hashes of every audio file, and which files are copies of which"""
+
+    def __init__(self, path=DEFAULT_PATH, threshold=DEFAULT_THRESHOLD, timeout=30.0):
+        self.path = path
+        self.threshold = threshold
+        self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Reads
+
+    def get(self, audio_file):
+        row = self.conn.execute("SELECT * FROM files WHERE audio_file = ?", (audio_file,)).fetchone()
+        return dict(row) if row else None
+
+    def files(self):
+        return [row['audio_file'] for row in self.conn.execute("SELECT audio_file FROM files ORDER BY id")]
+
+    def duplicates(self):
+        """{duplicate audio file: canonical audio file}"""
+        return {row['audio_file']: row['duplicate_of'] for row in self.conn.execute(
+            "SELECT audio_file, duplicate_of FROM files WHERE duplicate_of IS NOT NULL ORDER BY id")}
+
+    def groups(self):
+        """{canonical: [(copy, offset_sec), ...]} with the canonical first at offset 0, for recordings with copies"""
+        groups = {}
+        for audio_file, canonical in self.duplicates().items():
+            groups.setdefault(canonical, [(canonical, 0.0)]).append((audio_file, self.get(audio_file)['offset_sec']))
+        return groups
+
+    def match(self, hashes, times, duration=None, exclude=None):
+        """Indexed files sharing aligned hashes with the query, best first
+
+        Returns dicts with audio_file, score (share of the query's hashes found
+        at the chosen offset), matches and offset_sec (how many seconds later
+        the shared audio plays in the indexed file than in the query). The
+        offset is the histogram peak nearest 0 among those within
+        NEAR_PEAK_RATIO of the highest.
+        """
+        if not len(hashes):
+            return []
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS query (hash INTEGER, t INTEGER)")
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.execute("DELETE FROM query")
+            self.conn.executemany("INSERT INTO query VALUES (?, ?)", zip(hashes.tolist(), times.tolist()))
+            rows = self.conn.execute(
+                "SELECT h.file_id, h.t - q.t FROM query q JOIN hashes h ON h.hash = q.hash").fetchall()
+        finally:
+            self.conn.execute("COMMIT")
+        if not rows:
+            return []
+        hits = np.array([tuple(row) for row in rows], dtype=np.int64)
+
+        files = {row['id']: dict(row) for row in self.conn.execute("SELECT * FROM files")}
+        results = []
+        for file_id in np.unique(hits[:, 0]):
+            record = files[int(file_id)]
+            if record['audio_file'] == exclude:
+                continue
+            offsets = hits[hits[:, 0] == file_id, 1]
+            # An encoder delay can put the same landmark one frame earlier or later
+            smoothed = np.convolve(np.bincount(offsets - offsets.min()), np.ones(3, dtype=np.int64), mode='same')
+            # A section that repeats exactly also lines up with its repeats, sometimes better than the
+            # true alignment does. Of the near-equal peaks, take the one nearest 0.
+            candidates = np.flatnonzero(smoothed >= NEAR_PEAK_RATIO * smoothed.max())
+            peaks = [int(run[np.argmax(smoothed[run])])
+                     for run in np.split(candidates, np.flatnonzero(np.diff(candidates) > 1) + 1)]
+            best = min(peaks, key=lambda peak: (abs(peak + int(offsets.min())), -smoothed[peak]))
+            matches = int(smoothed[best])
+            if matches < MIN_MATCHES:
+                continue
+            if duration is not None and record['duration'] is not None and \
+                    abs(duration - record['duration']) > DURATION_TOLERANCE * max(duration, record['duration']):
+                continue
+            results.append({'audio_file': record['audio_file'], 'score': round(matches / len(hashes), 4),
+                            'matches': matches,
+                            'offset_sec': round((best + int(offsets.min())) * HOP_LENGTH / SR, 3)})
+        return sorted(results, key=lambda r: r['score'], reverse=True)
+
+    def query_file(self, path):
+        """Matches for an audio file, indexed or not"""
+        hashes, times, duration = fingerprint_file(path)
+        return self.match(hashes, times, duration, exclude=os.path.basename(path))
+
+    # Writes
+
+    def add(self, audio_file, hashes, times, duration, size=None, mtime=None):
+        """Index a file's fingerprint, flagging it as a duplicate when it matches an indexed file
+
+        Returns the canonical file it duplicates, or None.
+        """
+        best = next(iter(self.match(hashes, times, duration, exclude=audio_file)), None)
+        duplicate_of = score = offset_sec = None
+        if best is not None and best['score'] >= self.threshold:
+            canonical = self.get(best['audio_file'])
+            duplicate_of = canonical['duplicate_of'] or canonical['audio_file']
+            score = best['score']
+            # Offsets add up along the chain duplicate -> match -> canonical
+            offset_sec = round(best['offset_sec'] + (canonical['offset_sec'] or 0.0), 3)
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._remove(audio_file)
+            cursor = self.conn.execute(
+                "INSERT INTO files (audio_file, size, mtime, duration, n_hashes, duplicate_of, score, offset_sec, "
+                "indexed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (audio_file, size, mtime, duration, len(hashes), duplicate_of, score, offset_sec, time.time()))
+            self.conn.executemany("INSERT OR IGNORE INTO hashes VALUES (?, ?, ?)",
+                                  ((h, cursor.lastrowid, t) for h, t in zip(hashes.tolist(), times.tolist())))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return duplicate_of
+
+    def _remove(self, audio_file):
+        record = self.get(audio_file)
+        if record is None:
+            return
+        self.conn.execute("DELETE FROM hashes WHERE file_id = ?", (record['id'],))
+        self.conn.execute("DELETE FROM files WHERE id = ?", (record['id'],))
+        # The oldest remaining copy becomes canonical for the others
+        copies = self.conn.execute("SELECT audio_file, offset_sec FROM files WHERE duplicate_of = ? ORDER BY id",
+                                   (audio_file,)).fetchall()
+        if copies:
+            heir = copies[0]
+            self.conn.execute("UPDATE files SET duplicate_of = NULL, score = NULL, offset_sec = NULL "
+                              "WHERE audio_file = ?", (heir['audio_file'],))
+            self.conn.execute("UPDATE files SET duplicate_of = ?, offset_sec = offset_sec - ? WHERE duplicate_of = ?",
+                              (heir['audio_file'], heir['offset_sec'] or 0.0, audio_file))
+
+    def remove(self, audio_file):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._remove(audio_file)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def update(self, audio_dir, prune=True):
+        """Index new and changed files of a directory; returns {audio file: canonical} for the new duplicates"""
+        audio_files = sorted(f for f in os.listdir(audio_dir) if f.lower().endswith(EXTENSIONS))
+        if prune:
+            present = set(audio_files)
+            for audio_file in self.files():
+                if audio_file not in present:
+                    print(f"Removing {audio_file} (no longer in {audio_dir})")
+                    self.remove(audio_file)
+
+        found = {}
+        for audio_file in audio_files:
+            path = os.path.join(audio_dir, audio_file)
+            stat = os.stat(path)
+            record = self.get(audio_file)
+            if record is not None and record['size'] == stat.st_size and record['mtime'] == stat.st_mtime:
+                continue
+            try:
+                hashes, times, duration = fingerprint_file(path)
+            except Exception as e:
+                print(f"Error fingerprinting {audio_file}: {str(e)}")
+                continue
+            canonical = self.add(audio_file, hashes, times, duration, stat.st_size, stat.st_mtime)
+            if canonical:
+                found[audio_file] = canonical
+                print(f"{audio_file}: duplicate of {canonical} (score {self.get(audio_file)['score']:.2f})")
+        return found
+
+
+def shift_labels(labels, offset_sec):
+    """Move (start, end, label) segments from the canonical's timeline onto a copy's"""
+    shifted = []
+    for start, end, label in labels:
+        start, end = max(0.0, start - offset_sec), max(0.0, end - offset_sec)
+        if end > start:
+            shifted.append((start, end, label))
+    return shifted
+
+
+def reuse_outputs(duplicate, canonical, offset_sec=0.0, stems_dir=None, labels_dir=None, midi_dir=None):
+    """Copy one copy's stems, labels and MIDI to another that lacks them; returns what was copied
+
+    offset_sec is how many seconds later the audio plays in canonical than in duplicate.
+    """
+    from label_store import read_audacity_labels, write_audacity_labels
+
+    reused = []
+    duplicate_stem, canonical_stem = os.path.splitext(duplicate)[0], os.path.splitext(canonical)[0]
+    aligned = abs(offset_sec or 0.0) <= MAX_REUSE_OFFSET_SEC
+
+    if labels_dir:
+        source = os.path.join(labels_dir, f"{canonical}_labels.txt")
+        target = os.path.join(labels_dir, f"{duplicate}_labels.txt")
+        if os.path.exists(source) and not os.path.exists(target):
+            write_audacity_labels(target, shift_labels(read_audacity_labels(source), offset_sec or 0.0))
+            reused.append('labels')
+
+    if not aligned:
+        if (stems_dir and os.path.isdir(os.path.join(stems_dir, canonical_stem))) or \
+                (midi_dir and os.path.exists(os.path.join(midi_dir, f"{canonical_stem}.mid"))):
+            print(f"{duplicate}: starts {offset_sec:+.2f}s from {canonical}, not reusing stems or MIDI")
+        return reused
+
+    if stems_dir:
+        source = os.path.join(stems_dir, canonical_stem)
+        target = os.path.join(stems_dir, duplicate_stem)
+        if os.path.isdir(source) and not os.path.exists(target):
+            # Copy next to the target and rename, so a half-copied folder never looks finished
+            shutil.copytree(source, target + ".tmp")
+            os.replace(target + ".tmp", target)
+            reused.append('stems')
+
+    if midi_dir:
+        source = os.path.join(midi_dir, f"{canonical_stem}.mid")
+        target = os.path.join(midi_dir, f"{duplicate_stem}.mid")
+        if os.path.exists(source) and not os.path.exists(target):
+            shutil.copy2(source, target + ".tmp")
+            os.replace(target + ".tmp", target)
+            reused.append('midi')
+    return reused
+
+
+def duplicate_files(index_path):
+    """Audio files an index flags as copies, for stages to skip; empty when there is no index yet"""
+    if not index_path or not os.path.exists(index_path):
+        return set()
+    with FingerprintIndex(index_path) as index:
+        return set(index.duplicates())
+
+
+def duplicate_tracks(index_path):
+    """Track names (stem folders, MIDI files) that only duplicates use, for the stages working on stems
+
+    A name shared with a file that is not a duplicate (song.mp3 and a duplicate song.wav) is kept.
+    """
+    if not index_path or not os.path.exists(index_path):
+        return set()
+    with FingerprintIndex(index_path) as index:
+        duplicates = set(index.duplicates())
+        originals = {os.path.splitext(f)[0] for f in index.files() if f not in duplicates}
+    return {os.path.splitext(f)[0] for f in duplicates} - originals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fingerprint the corpus and reuse outputs across duplicate encodes")
+    parser.add_argument("--db", default=DEFAULT_PATH, help="Fingerprint index database")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Share of aligned hashes at which a file counts as a duplicate")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser("ingest", help="Index new files and reuse outputs for duplicates")
+    ingest_parser.add_argument("audio_dir", nargs="?", default="../audio")
+    ingest_parser.add_argument("--stems-dir", default=None)
+    ingest_parser.add_argument("--labels-dir", default=None)
+    ingest_parser.add_argument("--midi-dir", default=None)
+    ingest_parser.add_argument("--keep-missing", action="store_true",
+                               help="Keep index entries of files no longer in audio_dir")
+
+    subparsers.add_parser("duplicates", help="List duplicates with their canonical file")
+
+    query_parser = subparsers.add_parser("query", help="Show indexed files matching audio files")
+    query_parser.add_argument("files", nargs="+")
+
+    args = parser.parse_args()
+
+    with FingerprintIndex(args.db, args.threshold) as index:
+        if args.command == "ingest":
+            start = time.perf_counter()
+            new = index.update(args.audio_dir, prune=not args.keep_missing)
+            print(f"Indexed in {time.perf_counter() - start:.1f}s; {len(new)} new duplicates")
+            for members in index.groups().values():
+                # Sources in preference order: the canonical first, then the copies in index order
+                for target, target_offset in members:
+                    for source, source_offset in members:
+                        if source == target:
+                            continue
+                        reused = reuse_outputs(target, source, (target_offset or 0.0) - (source_offset or 0.0),
+                                               args.stems_dir, args.labels_dir, args.midi_dir)
+                        if reused:
+                            print(f"{target}: reused {', '.join(reused)} from {source}")
+        elif args.command == "duplicates":
+            for duplicate, canonical in index.duplicates().items():
+                record = index.get(duplicate)
+                print(f"{duplicate}  ->  {canonical}  score {record['score']:.2f}  offset {record['offset_sec']:+.2f}s")
+        elif args.command == "query":
+            for path in args.files:
+                print(path)
+                for result in index.query_file(path)[:5]:
+                    flag = "  duplicate" if result['score'] >= args.threshold else ""
+                    print(f"  {result['audio_file']}  score {result['score']:.3f}  matches {result['matches']}  "
+                          f"offset {result['offset_sec']:+.2f}s{flag}")
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Lightweight tracing shared by the pipeline scripts.
+
+    from instrumentation import span, count
+
+    with span('separation.batch', model=model_name, files=len(batch)):
+        ...
+    count('drive.bytes', os.path.getsize(path))
+
+Spans nest per thread. Counters accumulate, and a background thread samples
+the resident set size. Until tracing is enabled, span() and count() do
+nothing, so the calls can stay in hot paths.
+
+Tracing can be enabled in three ways:
+
+- call enable() in code
+- set PIPELINE_TRACE=trace.json (and optionally PIPELINE_PROFILE=run.prof)
+  in the environment of any script or notebook kernel
+- run a script through this one:
+
+      python instrumentation.py --trace trace.json [--profile run.prof] stem_separation.py ../audio ../stems
+
+When the process exits, spans, counters and RSS samples are written as
+Chrome-trace JSON (open it in chrome://tracing or ui.perfetto.dev), and a
+per-span summary table is printed. Child processes add their pid to the
+trace file name.
+"""
+
+import argparse
+import atexit
+import cProfile
+import json
+import os
+import pstats
+import runpy
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+RSS_INTERVAL_SEC = 0.1
+
+_tracer = None
+
+
+def current_rss_mb():
+    """Resident set size now (Linux), or the peak so far where that is all the OS offers"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return 0.0
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return max_rss / 2**20 if sys.platform == 'darwin' else max_rss / 2**10
+
+
+class Tracer:
+    """Collects spans, counters and RSS samples for one process"""
+
+    def __init__(self, trace_path=None, profile_path=None, rss_interval=RSS_INTERVAL_SEC):
+        self.trace_path = trace_path
+        self.profile_path = profile_path
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+        self.events = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # name -> [calls, total seconds, self seconds, max seconds]
+        self.stats = defaultdict(lambda: [0, 0.0, 0.0, 0.0])
+        self.counters = defaultdict(float)
+        self.peak_rss_mb = 0.0
+        self.finished = False
+
+        self.profiler = None
+        if profile_path:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+        self._stop = threading.Event()
+        self._sampler = None
+        if rss_interval:
+            self._sampler = threading.Thread(target=self._sample_rss, args=(rss_interval,), daemon=True)
+            self._sampler.start()
+
+    def now_us(self):
+        return (time.perf_counter() - self.origin) * 1e6
+
+    def _sample_rss(self, interval):
+        while not self._stop.wait(interval):
+            self.record_rss()
+
+    def record_rss(self):
+        rss = current_rss_mb()
+        with self.lock:
+            self.peak_rss_mb = max(self.peak_rss_mb, rss)
+            self.events.append({'name': 'rss_mb', 'ph': 'C', 'ts': self.now_us(), 'pid': self.pid,
+                                'args': {'rss_mb': round(rss, 1)}})
+
+    @contextmanager
+    def span(self, name, args):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        frame = [0.0]  # time spent in child spans
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            stack.pop()
+            if stack:
+                stack[-1][0] += seconds
+            event = {'name': name, 'ph': 'X', 'ts': (start - self.origin) * 1e6, 'dur': seconds * 1e6,
+                     'pid': self.pid, 'tid': threading.get_ident()}
+            if args:
+                event['args'] = {key: str(value) for key, value in args.items()}
+            with self.lock:
+                self.events.append(event)
+                stats = self.stats[name]
+                stats[0] += 1
+                stats[1] += seconds
+                stats[2] += seconds - frame[0]
+                stats[3] = max(stats[3], seconds)
+
+    def count(self, name, value):
+        with self.lock:
+            self.counters[name] += value
+            self.events.append({'name': name, 'ph': 'C', 'ts': self.now_us(), 'pid': self.pid,
+                                'args': {name: self.counters[name]}})
+
+    def write_chrome_trace(self, path):
+        with self.lock:
+            events = list(self.events)
+        metadata = {'name': 'process_name', 'ph': 'M', 'pid': self.pid,
+                    'args': {'name': os.path.basename(sys.argv[0]) or 'python'}}
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': [metadata] + events, 'displayTimeUnit': 'ms'}, f)
+
+    def print_summary(self, limit=30):
+        wall = time.perf_counter() - self.origin
+        print(f"\nTrace summary (pid {self.pid}): wall {wall:.2f}s, peak RSS {self.peak_rss_mb:.0f} MB")
+        if self.stats:
+            print(f"{'span':<36} {'calls':>7} {'total s':>9} {'self s':>9} {'mean ms':>9} {'max ms':>9} {'share':>7}")
+            ranked = sorted(self.stats.items(), key=lambda item: item[1][2], reverse=True)
+            for name, (calls, total, self_seconds, longest) in ranked[:limit]:
+                print(f"{name:<36} {calls:>7} {total:>9.2f} {self_seconds:>9.2f} {total / calls * 1e3:>9.1f} "
+                      f"{longest * 1e3:>9.1f} {self_seconds / wall:>7.1%}")
+        for name, value in sorted(self.counters.items()):
+            print(f"counter {name}: {value:g}")
+
+    def finish(self):
+        """Stop sampling and profiling, write the outputs and print the summary (once)"""
+        if self.finished:
+            return
+        self.finished = True
+        self._stop.set()
+        self.record_rss()
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_path)
+            print(f"\nProfile written to {self.profile_path}")
+            pstats.Stats(self.profile_path).sort_stats('cumulative').print_stats(15)
+        if self.trace_path:
+            self.write_chrome_trace(self.trace_path)
+            print(f"Trace written to {self.trace_path}")
+        self.print_summary()
+
+
+def _per_process_path(path):
+    """Give child processes (which inherit the environment) their own output file next to the parent's"""
+    owner = os.environ.setdefault("PIPELINE_TRACE_OWNER", str(os.getpid()))
+    if path and owner != str(os.getpid()):
+        root, ext = os.path.splitext(path)
+        return f"{root}.{os.getpid()}{ext}"
+    return path
+
+
+def enable(trace_path=None, profile_path=None, rss_interval=RSS_INTERVAL_SEC):
+    """Start tracing this process; outputs are written at exit (or by finish())"""
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer(_per_process_path(trace_path), _per_process_path(profile_path), rss_interval)
+        atexit.register(finish)
+    return _tracer
+
+
+def enabled():
+    return _tracer is not None
+
+
+def finish():
+    if _tracer is not None:
+        _tracer.finish()
+
+
+@contextmanager
+def span(name, **args):
+    """Time a block as a (nested) span; free when tracing is off"""
+    if _tracer is None:
+        yield
+        return
+    with _tracer.span(name, args):
+        yield
+
+
+def count(name, value=1):
+    """Add to a counter; free when tracing is off"""
+    if _tracer is not None:
+        _tracer.count(name, value)
+
+
+if os.environ.get("PIPELINE_TRACE") or os.environ.get("PIPELINE_PROFILE"):
+    enable(os.environ.get("PIPELINE_TRACE") or None, os.environ.get("PIPELINE_PROFILE") or None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a pipeline script with tracing enabled")
+    parser.add_argument("--trace", default="trace.json", help="Chrome-trace JSON output")
+    parser.add_argument("--profile", default=None, help="Also run cProfile and write its stats here")
+    parser.add_argument("script", help="Script to run")
+    parser.add_argument("script_args", nargs=argparse.REMAINDER, help="Arguments for the script")
+
+    args = parser.parse_args()
+
+    # Set through the environment so the script's own `import instrumentation` (a different module
+    # object from this __main__) and any child processes pick it up
+    os.environ["PIPELINE_TRACE"] = os.path.abspath(args.trace)
+    if args.profile:
+        os.environ["PIPELINE_PROFILE"] = os.path.abspath(args.profile)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import instrumentation
+
+    sys.argv = [args.script] + args.script_args
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args.script)))
+    with instrumentation.span(os.path.basename(args.script)):
+        runpy.run_path(args.script, run_name="__main__")
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+Transactional store for annotation state: labels, descriptions and status.
+
+Until now each track's state was spread over two text files that checks.py
+re-read and string-split on every screen:
+
+- ./labels/<file>_labels.txt
+- ./descriptions/<stem>_description.txt
+
+Annotators editing on a shared folder could silently overwrite each other.
+Here everything lives in one SQLite database (./labels.db by default):
+
+- tracks: one row per audio file, with the description, genre tags, the
+  processed flag, a derived status (todo / partial / done) and a version
+  number; status is indexed, so listing the TODO files is one query
+- segments: the current labels of each track
+- history: every earlier version of a track, with who saved it and when
+
+Every write runs in a transaction and can pass the version it started from.
+If another annotator saved in between, VersionConflict is raised instead of
+overwriting their work.
+
+The default journal mode is WAL, so readers never block the one writer. WAL
+needs every process on the same host. When annotators share the database
+over a network mount, open the store with journal_mode='delete'.
+
+The Audacity text format is kept at the edges: import_labels_file and
+export_labels_file move labels in and out for Audacity. export_directory
+writes the old labels/ and descriptions/ layout for export_batch.py.
+"""
+
+import argparse
+import getpass
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+DEFAULT_PATH = "./labels.db"
+STATUSES = ('todo', 'partial', 'done')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    audio_file TEXT PRIMARY KEY,
+    description TEXT NOT NULL DEFAULT '',
+    genre_tags TEXT NOT NULL DEFAULT '',
+    processed INTEGER NOT NULL DEFAULT 0,
+    has_labels INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'todo',
+    version INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL,
+    updated_by TEXT
+);
+CREATE INDEX IF NOT EXISTS tracks_status ON tracks (status, audio_file);
+CREATE TABLE IF NOT EXISTS segments (
+    audio_file TEXT NOT NULL REFERENCES tracks (audio_file),
+    position INTEGER NOT NULL,
+    start REAL NOT NULL,
+    end REAL NOT NULL,
+    label TEXT NOT NULL,
+    PRIMARY KEY (audio_file, position)
+);
+CREATE TABLE IF NOT EXISTS history (
+    audio_file TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    record TEXT NOT NULL,
+    updated_at REAL,
+    updated_by TEXT,
+    PRIMARY KEY (audio_file, version)
+);
+"""
+
+
+class VersionConflict(Exception):
+    """The track changed since the caller read it"""
+
+
+def read_audacity_labels(labels_path):
+    """Read an Audacity label file into a list of (start, end, label) tuples"""
+    segments = []
+    with open(labels_path) as f:
+        for line in f:
+            # Spectral selection lines start with a backslash
+            if not line.strip() or line.startswith('\\'):
+                continue
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) < 2:
+                continue
+            label = parts[2].strip() if len(parts) > 2 else ''
+            segments.append((float(parts[0]), float(parts[1]), label))
+    return segments
+
+
+def write_audacity_labels(labels_path, segments):
+    """Write (start, end, label) tuples in Audacity's label format, atomically"""
+    tmp_path = f"{labels_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        for start, end, label in segments:
+            f.write(f"{start:.6f}\t{end:.6f}\t{label}\n")
+    os.replace(tmp_path, labels_path)
+
+
+def parse_description_file(desc_path):
+    """(description, genre tags, processed) from a <stem>_description.txt"""
+    with open(desc_path) as f:
+        content = f.read()
+    description = content.split('description:\n')[1].split('genre-tags:')[0].strip() if 'description:\n' in content else ''
+    genre_tags = content.split('genre-tags:')[1].split('processed:')[0].strip() if 'genre-tags:' in content else ''
+    return description, genre_tags, 'processed: true' in content
+
+
+def derive_status(has_labels, description, genre_tags, processed):
+    """The status checks.py has always shown: DONE, PARTIAL or TODO"""
+    has_description = bool(description.strip() and genre_tags.strip())
+    if has_labels and has_description and processed:
+        return 'done'
+    if has_labels or has_description:
+        return 'partial'
+    return 'todo'
+
+
+class LabelStore:
+    """Labels, descriptions and processing status of every track in one SQLite database"""
+
+    def __init__(self, path=DEFAULT_PATH, journal_mode='wal', user=None, timeout=30.0):
+        self.path = path
+        self.user = user or getpass.getuser()
+        self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute(f"PRAGMA journal_mode={journal_mode}")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write(self):
+        """A transaction that takes the write lock up front, so read-check-write is atomic"""
+        return _Transaction(self.conn, "BEGIN IMMEDIATE")
+
+    def _read(self):
+        """A read transaction: one consistent snapshot across several queries"""
+        return _Transaction(self.conn, "BEGIN")
+
+    # Reads
+
+    def get(self, audio_file):
+        """The track's record with its labels, or None"""
+        row = self.conn.execute("SELECT * FROM tracks WHERE audio_file = ?", (audio_file,)).fetchone()
+        if row is None:
+            return None
+        record = dict(row)
+        record['labels'] = self.labels(audio_file)
+        return record
+
+    def labels(self, audio_file):
+        return [(row['start'], row['end'], row['label']) for row in self.conn.execute(
+            "SELECT start, end, label FROM segments WHERE audio_file = ? ORDER BY position", (audio_file,))]
+
+    def tracks(self, status=None):
+        """Audio file names, all or with one status, in name order"""
+        if status is None:
+            rows = self.conn.execute("SELECT audio_file FROM tracks ORDER BY audio_file")
+        else:
+            rows = self.conn.execute("SELECT audio_file FROM tracks WHERE status = ? ORDER BY audio_file", (status,))
+        return [row['audio_file'] for row in rows]
+
+    def todo(self):
+        return self.tracks('todo')
+
+    def statuses(self, audio_files=None):
+        """{audio file: status} for the given files (default: all)"""
+        if audio_files is None:
+            rows = self.conn.execute("SELECT audio_file, status FROM tracks")
+        else:
+            audio_files = list(audio_files)
+            rows = []
+            # Stay below SQLite's limit on bound parameters
+            for i in range(0, len(audio_files), 500):
+                chunk = audio_files[i:i + 500]
+                rows += self.conn.execute(
+                    f"SELECT audio_file, status FROM tracks WHERE audio_file IN ({','.join('?' * len(chunk))})",
+                    chunk).fetchall()
+        return {row['audio_file']: row['status'] for row in rows}
+
+    def status_counts(self):
+        counts = dict.fromkeys(STATUSES, 0)
+        for row in self.conn.execute("SELECT status, COUNT(*) AS n FROM tracks GROUP BY status"):
+            counts[row['status']] = row['n']
+        return counts
+
+    def history(self, audio_file):
+        """Earlier versions of the track, oldest first"""
+        return [{'version': row['version'], 'updated_at': row['updated_at'], 'updated_by': row['updated_by'],
+                 **json.loads(row['record'])}
+                for row in self.conn.execute("SELECT * FROM history WHERE audio_file = ? ORDER BY version",
+                                             (audio_file,))]
+
+    # Writes
+
+    def add_tracks(self, audio_files):
+        """Register audio files; existing rows are left alone. Returns the newly added names"""
+        with self._write():
+            known = set(self.tracks())
+            new = [audio_file for audio_file in audio_files if audio_file not in known]
+            self.conn.executemany("INSERT INTO tracks (audio_file) VALUES (?)", [(a,) for a in new])
+        return new
+
+    def _update(self, audio_file, expected_version, user, labels=None, **fields):
+        """Apply changes to one track inside the caller's transaction; returns the new version"""
+        row = self.conn.execute("SELECT * FROM tracks WHERE audio_file = ?", (audio_file,)).fetchone()
+        if row is None:
+            self.conn.execute("INSERT INTO tracks (audio_file) VALUES (?)", (audio_file,))
+            row = self.conn.execute("SELECT * FROM tracks WHERE audio_file = ?", (audio_file,)).fetchone()
+        if expected_version is not None and row['version'] != expected_version:
+            raise VersionConflict(f"{audio_file} is at version {row['version']} (saved by {row['updated_by']}), "
+                                  f"not {expected_version}")
+
+        if row['version'] > 0:
+            # Keep the version being replaced
+            old = {key: row[key] for key in ('description', 'genre_tags', 'processed', 'status')}
+            old['labels'] = self.labels(audio_file)
+            self.conn.execute("INSERT INTO history (audio_file, version, record, updated_at, updated_by) "
+                              "VALUES (?, ?, ?, ?, ?)",
+                              (audio_file, row['version'], json.dumps(old), row['updated_at'], row['updated_by']))
+
+        values = {key: row[key] for key in ('description', 'genre_tags', 'processed', 'has_labels')}
+        values.update(fields)
+        if labels is not None:
+            self.conn.execute("DELETE FROM segments WHERE audio_file = ?", (audio_file,))
+            self.conn.executemany(
+                "INSERT INTO segments (audio_file, position, start, end, label) VALUES (?, ?, ?, ?, ?)",
+                [(audio_file, i, float(start), float(end), label) for i, (start, end, label) in enumerate(labels)])
+            values['has_labels'] = int(bool(labels))
+        values['status'] = derive_status(values['has_labels'], values['description'], values['genre_tags'],
+                                         values['processed'])
+        version = row['version'] + 1
+        self.conn.execute(
+            "UPDATE tracks SET description = ?, genre_tags = ?, processed = ?, has_labels = ?, status = ?, "
+            "version = ?, updated_at = ?, updated_by = ? WHERE audio_file = ?",
+            (values['description'], values['genre_tags'], int(values['processed']), values['has_labels'],
+             values['status'], version, time.time(), user or self.user, audio_file))
+        return version
+
+    def update(self, audio_file, expected_version=None, user=None, labels=None, **fields):
+        """Change labels and/or description, genre_tags, processed in one transaction; returns the new version
+
+        With expected_version, raises VersionConflict if the track was saved by
+        someone else since that version was read.
+        """
+        unknown = set(fields) - {'description', 'genre_tags', 'processed'}
+        if unknown:
+            raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}")
+        with self._write():
+            return self._update(audio_file, expected_version, user, labels=labels, **fields)
+
+    def save_labels(self, audio_file, segments, expected_version=None, user=None):
+        return self.update(audio_file, expected_version, user, labels=list(segments))
+
+    def save_description(self, audio_file, description, genre_tags, expected_version=None, user=None):
+        return self.update(audio_file, expected_version, user, description=description, genre_tags=genre_tags)
+
+    def mark_processed(self, audio_file, expected_version=None, user=None):
+        return self.update(audio_file, expected_version, user, processed=True)
+
+    # Audacity text format and the old file layout
+
+    def import_labels_file(self, audio_file, labels_path, expected_version=None, user=None):
+        """Replace the track's labels with an Audacity label file; returns the new version"""
+        return self.save_labels(audio_file, read_audacity_labels(labels_path), expected_version, user)
+
+    def export_labels_file(self, audio_file, labels_path):
+        """Write the track's labels as an Audacity label file; returns the version written"""
+        with self._read():
+            record = self.get(audio_file)
+            if record is None:
+                raise KeyError(audio_file)
+            write_audacity_labels(labels_path, record['labels'])
+        return record['version']
+
+    def sync_files(self, audio_files, labels_dir='./labels', descriptions_dir='./descriptions'):
+        """Add new audio files, importing their text label and description files if present
+
+        Label files for tracks that have no labels in the store yet (e.g. new
+        output of segmentation.py) are picked up as well. Returns the names
+        of the tracks that were added or updated.
+        """
+        self.add_tracks(audio_files)
+        changed = []
+        with self._write():
+            rows = self.conn.execute("SELECT audio_file, description, genre_tags, processed, has_labels, version "
+                                     "FROM tracks WHERE version = 0 OR has_labels = 0").fetchall()
+            for row in rows:
+                audio_file = row['audio_file']
+                fields = {}
+                labels = None
+                labels_path = Path(labels_dir) / f"{audio_file}_labels.txt"
+                if labels_path.exists() and labels_path.stat().st_size > 0:
+                    labels = read_audacity_labels(labels_path) or None
+                desc_path = Path(descriptions_dir) / f"{Path(audio_file).stem}_description.txt"
+                if row['version'] == 0 and desc_path.exists():
+                    description, genre_tags, processed = parse_description_file(desc_path)
+                    fields = {'description': description, 'genre_tags': genre_tags, 'processed': processed}
+                if labels is not None or fields:
+                    self._update(audio_file, row['version'], 'import', labels=labels, **fields)
+                    changed.append(audio_file)
+        return changed
+
+    def export_directory(self, labels_dir='./labels', descriptions_dir='./descriptions', status=None,
+                         audio_files=None):
+        """Write the text files export_batch.py uploads, for all tracks or those with a status / in audio_files"""
+        os.makedirs(labels_dir, exist_ok=True)
+        os.makedirs(descriptions_dir, exist_ok=True)
+        selected = None if audio_files is None else set(audio_files)
+        written = 0
+        for audio_file in self.tracks(status):
+            if selected is not None and audio_file not in selected:
+                continue
+            with self._read():
+                record = self.get(audio_file)
+            if record['labels']:
+                write_audacity_labels(Path(labels_dir) / f"{audio_file}_labels.txt", record['labels'])
+            if record['description'] or record['genre_tags'] or record['processed']:
+                desc_path = Path(descriptions_dir) / f"{Path(audio_file).stem}_description.txt"
+                with open(f"{desc_path}.tmp", 'w') as f:
+                    f.write(f"description:\n{record['description']}\ngenre-tags:\n{record['genre_tags']}\n"
+                            f"processed: {'true' if record['processed'] else 'false'}")
+                os.replace(f"{desc_path}.tmp", desc_path)
+            written += 1
+        return written
+
+
+class _Transaction:
+    """BEGIN ... COMMIT, rolled back on error"""
+
+    def __init__(self, conn, begin):
+        self.conn = conn
+        self.begin = begin
+
+    def __enter__(self):
+        self.conn.execute(self.begin)
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query and maintain the annotation label store")
+    parser.add_argument("--db", default=DEFAULT_PATH, help="Label store database")
+    parser.add_argument("--journal-mode", default='wal', choices=['wal', 'delete'],
+                        help="Use 'delete' when the database is on a network mount")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sync_parser = subparsers.add_parser("sync", help="Add audio files and import their text labels/descriptions")
+    sync_parser.add_argument("--audio-dir", default="./audio")
+    sync_parser.add_argument("--labels-dir", default="./labels")
+    sync_parser.add_argument("--descriptions-dir", default="./descriptions")
+
+    subparsers.add_parser("status", help="Count tracks per status")
+    list_parser = subparsers.add_parser("list", help="List tracks, optionally with one status")
+    list_parser.add_argument("status", nargs="?", choices=STATUSES)
+
+    history_parser = subparsers.add_parser("history", help="Show the saved versions of a track")
+    history_parser.add_argument("audio_file")
+
+    import_parser = subparsers.add_parser("import-labels", help="Replace a track's labels with an Audacity label file")
+    import_parser.add_argument("audio_file")
+    import_parser.add_argument("labels_path")
+    import_parser.add_argument("--expected-version", type=int, default=None)
+
+    export_parser = subparsers.add_parser("export", help="Write labels/ and descriptions/ text files")
+    export_parser.add_argument("--labels-dir", default="./labels")
+    export_parser.add_argument("--descriptions-dir", default="./descriptions")
+    export_parser.add_argument("--status", choices=STATUSES, default=None)
+
+    args = parser.parse_args()
+
+    with LabelStore(args.db, journal_mode=args.journal_mode) as store:
+        if args.command == "sync":
+            audio_files = sorted(f for f in os.listdir(args.audio_dir) if f.endswith(('.mp3', '.wav')))
+            changed = store.sync_files(audio_files, args.labels_dir, args.descriptions_dir)
+            print(f"{len(audio_files)} audio files, {len(changed)} imported or updated")
+        elif args.command == "status":
+            for status, n in store.status_counts().items():
+                print(f"{status:<8} {n}")
+        elif args.command == "list":
+            for audio_file in store.tracks(args.status):
+                print(audio_file)
+        elif args.command == "history":
+            for entry in store.history(args.audio_file):
+                print(f"v{entry['version']} {entry['updated_by'] or '-'} {entry['status']}: "
+                      f"{len(entry['labels'])} labels, description {entry['description']!r}")
+        elif args.command == "import-labels":
+            version = store.import_labels_file(args.audio_file, args.labels_path, args.expected_version)
+            print(f"{args.audio_file} is now at version {version}")
+        elif args.command == "export":
+            print(f"Exported {store.export_directory(args.labels_dir, args.descriptions_dir, args.status)} tracks")
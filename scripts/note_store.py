@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Columnar store of every transcribed note in the corpus.
+
+Corpus-level questions (pitch range per stem, note density per segment, empty
+stems) used to mean re-parsing every midi-out/*.mid with pretty_midi or
+music21. The store keeps all notes as one structured NumPy record per note
+(NOTE_DTYPE) in .npy shards that np.load memory-maps, plus an index.json that
+maps each track to its rows. A full scan is a handful of vectorised passes
+over mapped arrays instead of thousands of MIDI parses.
+
+Tracks are appended as they are transcribed (audio_to_midi.py --note-store)
+or ingested from existing MIDI files (`python note_store.py build`). Notes
+are buffered and written out shard_size rows at a time; each shard holds
+whole tracks, sorted by start time within the track. Re-adding a track
+supersedes its old rows.
+"""
+
+import argparse
+import glob
+import json
+import os
+
+import numpy as np
+
+NOTE_DTYPE = np.dtype([
+    ('track', '<u4'),
+    ('stem', '<u2'),
+    ('program', 'u1'),
+    ('is_drum', '?'),
+    ('pitch', 'u1'),
+    ('velocity', 'u1'),
+    ('start', '<f4'),
+    ('end', '<f4'),
+])
+
+INDEX_NAME = "index.json"
+DEFAULT_SHARD_SIZE = 1 << 20  # notes per shard, 16 MB
+
+
+def instrument_notes(instruments, track_id, stem_id):
+    """Structured note array for a list of pretty_midi Instruments; stem_id maps instrument name to stem id"""
+    parts = []
+    for instrument in instruments:
+        notes = np.zeros(len(instrument.notes), dtype=NOTE_DTYPE)
+        if len(notes):
+            notes['pitch'] = [note.pitch for note in instrument.notes]
+            notes['velocity'] = [note.velocity for note in instrument.notes]
+            notes['start'] = [note.start for note in instrument.notes]
+            notes['end'] = [note.end for note in instrument.notes]
+        notes['track'] = track_id
+        notes['stem'] = stem_id(instrument.name)
+        notes['program'] = instrument.program
+        notes['is_drum'] = instrument.is_drum
+        parts.append(notes)
+    notes = np.concatenate(parts) if parts else np.zeros(0, dtype=NOTE_DTYPE)
+    return notes[np.argsort(notes['start'], kind='stable')]
+
+
+class NoteStore:
+    """Append-only, sharded note table with track, stem and time-range queries"""
+
+    def __init__(self, directory, shard_size=DEFAULT_SHARD_SIZE):
+        self.directory = directory
+        self.shard_size = shard_size
+        os.makedirs(directory, exist_ok=True)
+
+        index_path = os.path.join(directory, INDEX_NAME)
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                index = json.load(f)
+        else:
+            index = {'stems': [], 'shards': [], 'tracks': {}}
+        self.stems = index['stems']
+        self.shards = index['shards']
+        # name -> {'id', 'shard', 'offset', 'count', 'stems': {stem: note count}}
+        self.tracks = index['tracks']
+        self._next_id = max((t['id'] for t in self.tracks.values()), default=-1) + 1
+
+        self._buffer = []
+        self._buffer_tracks = []
+        self._buffered = 0
+        self._mapped = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    def __contains__(self, track_name):
+        return track_name in self.tracks or any(name == track_name for name, _ in self._buffer_tracks)
+
+    def stem_id(self, stem_name):
+        """Id for a stem (instrument) name, registering new names"""
+        if stem_name not in self.stems:
+            self.stems.append(stem_name)
+        return self.stems.index(stem_name)
+
+    def track_id(self, track_name):
+        entry = self.tracks.get(track_name)
+        return entry['id'] if entry else None
+
+    def track_names(self):
+        """Track names by id"""
+        return {entry['id']: name for name, entry in self.tracks.items()}
+
+    # Writing
+
+    def add_instruments(self, track_name, instruments):
+        """Buffer the notes of one track; a track that is already stored is replaced on the next flush"""
+        entry = self.tracks.get(track_name)
+        track_id = entry['id'] if entry else self._next_id
+        if entry is None:
+            self._next_id += 1
+        notes = instrument_notes(instruments, track_id, self.stem_id)
+        stems = {instrument.name: len(instrument.notes) for instrument in instruments}
+        self._buffer.append(notes)
+        self._buffer_tracks.append((track_name, {'id': track_id, 'count': len(notes), 'stems': stems}))
+        self._buffered += len(notes)
+        if self._buffered >= self.shard_size:
+            self.flush()
+
+    def add_midi(self, track_name, midi_data):
+        """Buffer the notes of a PrettyMIDI object"""
+        self.add_instruments(track_name, midi_data.instruments)
+
+    def flush(self):
+        """Write buffered tracks to a new shard and update the index"""
+        if not self._buffer_tracks:
+            return
+        shard = f"notes-{len(self.shards):05d}.npy"
+        shard_path = os.path.join(self.directory, shard)
+        with open(shard_path + ".tmp", 'wb') as f:
+            np.save(f, np.concatenate(self._buffer))
+        os.replace(shard_path + ".tmp", shard_path)
+
+        offset = 0
+        for track_name, entry in self._buffer_tracks:
+            entry.update(shard=shard, offset=offset)
+            self.tracks[track_name] = entry
+            offset += entry['count']
+        self.shards.append(shard)
+        self._buffer = []
+        self._buffer_tracks = []
+        self._buffered = 0
+        self._write_index()
+
+    def _write_index(self):
+        index_path = os.path.join(self.directory, INDEX_NAME)
+        with open(index_path + ".tmp", 'w') as f:
+            json.dump({'stems': self.stems, 'shards': self.shards, 'tracks': self.tracks}, f)
+        os.replace(index_path + ".tmp", index_path)
+
+    # Reading
+
+    def shard(self, name):
+        """Memory-mapped shard array"""
+        if name not in self._mapped:
+            self._mapped[name] = np.load(os.path.join(self.directory, name), mmap_mode='r')
+        return self._mapped[name]
+
+    def _live_ranges(self, track_names=None):
+        """(shard, offset, count) of the current rows of the given tracks (all tracks if None), grouped by shard"""
+        entries = self.tracks.values() if track_names is None else \
+            [self.tracks[name] for name in track_names if name in self.tracks]
+        ranges = {}
+        for entry in entries:
+            ranges.setdefault(entry['shard'], []).append((entry['offset'], entry['count']))
+        return ranges
+
+    def scan(self, tracks=None):
+        """Yield the live notes shard by shard, restricted to the given track names"""
+        for shard, ranges in sorted(self._live_ranges(tracks).items()):
+            notes = self.shard(shard)
+            if sum(count for _, count in ranges) == len(notes):
+                yield notes  # the whole shard is live
+            else:
+                ranges.sort()
+                yield np.concatenate([notes[offset:offset + count] for offset, count in ranges])
+
+    def query(self, tracks=None, stems=None, start=None, end=None):
+        """Notes matching all given filters, as one structured array
+
+        tracks and stems are lists of names; start/end (seconds) keep notes that
+        overlap the [start, end) window.
+        """
+        stem_ids = None if stems is None else [self.stems.index(s) for s in stems if s in self.stems]
+        parts = []
+        for notes in self.scan(tracks):
+            mask = np.ones(len(notes), dtype=bool)
+            if stem_ids is not None:
+                mask &= np.isin(notes['stem'], stem_ids)
+            if start is not None:
+                mask &= notes['end'] > start
+            if end is not None:
+                mask &= notes['start'] < end
+            parts.append(notes[mask])
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=NOTE_DTYPE)
+
+    def track_notes(self, track_name):
+        """All notes of one track, ordered by start time"""
+        return self.query(tracks=[track_name])
+
+    def empty_stems(self):
+        """(track, stem) pairs whose instrument was transcribed without any notes"""
+        return sorted((name, stem) for name, entry in self.tracks.items()
+                      for stem, count in entry['stems'].items() if count == 0)
+
+    def stem_summary(self):
+        """Note count and pitch range per stem over the whole corpus"""
+        counts = np.zeros(len(self.stems), dtype=np.int64)
+        low = np.full(len(self.stems), 255, dtype=np.int64)
+        high = np.zeros(len(self.stems), dtype=np.int64)
+        for notes in self.scan():
+            stem = notes['stem'].astype(np.int64)
+            pitch = notes['pitch'].astype(np.int64)
+            counts += np.bincount(stem, minlength=len(self.stems))
+            np.minimum.at(low, stem, pitch)
+            np.maximum.at(high, stem, pitch)
+        return {name: (int(counts[i]), int(low[i]), int(high[i]))
+                for i, name in enumerate(self.stems) if counts[i]}
+
+
+def ingest_midi_directory(store, midi_directory, overwrite=False):
+    """Add every <track>.mid in midi_directory that is not yet in the store"""
+    import pretty_midi
+
+    added = 0
+    for midi_file in sorted(glob.glob(os.path.join(midi_directory, '*.mid'))):
+        track_name = os.path.splitext(os.path.basename(midi_file))[0]
+        if track_name in store and not overwrite:
+            continue
+        try:
+            store.add_midi(track_name, pretty_midi.PrettyMIDI(midi_file))
+            added += 1
+        except Exception as e:
+            print(f"Error reading {midi_file}: {str(e)}")
+    store.flush()
+    return added
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and inspect the columnar note store")
+    parser.add_argument("store_directory", help="Directory holding the note shards and index.json")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Ingest combined MIDI files that are not yet in the store")
+    build_parser.add_argument("midi_directory", help="Directory with <track>.mid files (e.g. ../midi-out)")
+    build_parser.add_argument("--overwrite", action="store_true", help="Re-ingest tracks that are already stored")
+    build_parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE, help="Notes per shard")
+
+    subparsers.add_parser("summary", help="Note counts and pitch ranges per stem, and empty stems")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        store = NoteStore(args.store_directory, shard_size=args.shard_size)
+        added = ingest_midi_directory(store, args.midi_directory, overwrite=args.overwrite)
+        print(f"Added {added} tracks; the store now holds {len(store.tracks)} tracks in {len(store.shards)} shards")
+    else:
+        store = NoteStore(args.store_directory)
+        print(f"{len(store.tracks)} tracks in {len(store.shards)} shards")
+        print(f"\n{'stem':<12} {'notes':>12} {'lowest':>8} {'highest':>8}")
+        for name, (count, low, high) in store.stem_summary().items():
+            print(f"{name:<12} {count:>12} {low:>8} {high:>8}")
+        empty = store.empty_stems()
+        print(f"\nEmpty stems: {len(empty)}")
+        for track_name, stem in empty:
+            print(f"  {track_name}: {stem}")
@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+"""
+Incremental, content-addressed driver for the per-track pipeline.
+
+The per-track stages form a small DAG:
+
+    audio --> stems --> midi --> tokens
+         \\--> labels
+
+Every artifact is stored under <cache>/objects/<stage>/<key[:2]>/<key>/. The
+key is a hash of four things:
+
+- the stage name
+- the stage's parameters
+- the source of the scripts the stage runs: orchestrator.py (which holds
+  the runners) and every script the runner imports from this directory,
+  plus, for tokens, the anticipation package's Python files. Installed
+  libraries (demucs, basic-pitch, msaf, ...) are not hashed, so clear the
+  cache after upgrading one
+- the keys of its inputs
+
+An audio file's key is the SHA-256 of its bytes, cached by size and mtime.
+A run therefore only computes artifacts whose key is not in the cache yet:
+new tracks, or tracks affected by a changed parameter or script. Adding 500
+tracks to a large corpus costs 500 tracks of work plus a stat() per existing
+file.
+
+Each stage runs in long-lived worker subprocesses, with the interpreter given
+by --python <stage>=<path>, because segmentation needs the segmenter
+environment while separation and transcription need audio-to-midi. A worker
+loads its models (Demucs, basic-pitch) once and then takes one track after
+another over a pipe; each track's output is still committed to the cache on
+its own. Stages run concurrently up to a per-stage limit (--workers
+<stage>=N), one worker process per slot. A worker that crashes fails its
+current track and is replaced for the next one. Finished artifacts are
+published to the usual locations:
+
+- audio/stems/htdemucs_6s/<track>/
+- labels/<file>_labels.txt (existing label files, which may hold manual
+  corrections, are never overwritten)
+- midi-out/<track>.mid
+- a folder of <track>.compound.txt token files
+
+checks.py and export_batch.py are interactive/upload steps and stay manual.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+EXTENSIONS = ('.mp3', '.wav', '.ogg', '.flac')
+
+
+class Stage:
+    """One per-track step: its inputs, parameters, concurrency and the scripts its output depends on"""
+
+    def __init__(self, name, inputs, params=None, sources=(), workers=1):
+        self.name = name
+        self.inputs = inputs
+        self.params = params or {}
+        self.sources = sources
+        self.workers = workers
+
+    def code_hash(self, extra_sources=()):
+        """Hash of the stage's scripts (relative to SCRIPTS_DIR) and of any extra files, by path and content"""
+        digest = hashlib.sha256()
+        for source in [SCRIPTS_DIR / source for source in self.sources] + [Path(p) for p in extra_sources]:
+            digest.update(source.name.encode())
+            digest.update(source.read_bytes())
+        return digest.hexdigest()
+
+
+# Stem activity thresholds (stem_activity.DEFAULT_THRESHOLDS): silent stems are neither stored nor transcribed
+SILENCE_THRESHOLDS = {'silence_db': -50.0, 'min_active_sec': 2.0}
+
+# Each stage's sources are orchestrator.py plus the local modules its runner imports, directly or not
+STAGES = [
+    Stage('stems', ['audio'], params={'shifts': 1, 'overlap': 0.25, 'mp3_rate': 320, **SILENCE_THRESHOLDS},
+          sources=['orchestrator.py', 'stem_separation.py', 'stem_activity.py', 'instrumentation.py']),
+    Stage('labels', ['audio'],
+          sources=['orchestrator.py', 'segmentation.py', 'banded_similarity.py', 'instrumentation.py'],
+          workers=os.cpu_count() or 1),
+    Stage('midi', ['stems'], params=dict(SILENCE_THRESHOLDS),
+          sources=['orchestrator.py', 'audio_to_midi.py', 'transcription.py', 'stem_activity.py', 'note_store.py',
+                   'instrumentation.py']),
+    # The anticipation clone's files are added at run time (see anticipation_sources)
+    Stage('tokens', ['midi'], sources=['orchestrator.py'], workers=os.cpu_count() or 1),
+]
+
+
+def anticipation_sources(anticipation_dir):
+    """Python files of the anticipation package that the tokens stage imports"""
+    package = Path(anticipation_dir) / "anticipation"
+    return sorted(package.rglob("*.py")) if package.is_dir() else []
+
+
+# Stage runners. Each is called once in a worker process, loads what the stage needs, and returns
+# run(inputs, output), which is then called per track and writes into an empty output directory
+
+def run_stems(params):
+    from stem_separation import InMemoryStemSeparator
+
+    separator = InMemoryStemSeparator(shifts=params['shifts'], overlap=params['overlap'])
+
+    def run(inputs, output):
+        separator.save_stems(separator.separate(inputs['audio']), output, bitrate=params['mp3_rate'],
+                             silence_db=params['silence_db'], min_active_sec=params['min_active_sec'])
+    return run
+
+
+def run_labels(params):
+    from segmentation import segment_audio_file, write_labels
+
+    def run(inputs, output):
+        write_labels(os.path.join(output, "labels.txt"), segment_audio_file(inputs['audio']))
+    return run
+
+
+def run_midi(params):
+    from audio_to_midi import build_multitrack_midi, stem_jobs
+    from transcription import TranscriptionEngine
+
+    engine = TranscriptionEngine()
+
+    def run(inputs, output):
+        thresholds = {'silence_db': params['silence_db'], 'min_active_sec': params['min_active_sec']}
+        results = list(engine.transcribe(stem_jobs(inputs['stems'], thresholds)))
+        if not results:
+            raise RuntimeError("no stems could be transcribed")
+        failed = [result for result in results if result.error]
+        if failed:
+            raise RuntimeError("; ".join(f"{result.job.stem}: {result.error}" for result in failed))
+        build_multitrack_midi(results).write(os.path.join(output, "track.mid"))
+    return run
+
+
+def run_tokens(params):
+    sys.path.insert(0, os.path.abspath(params['anticipation_dir']))
+    from anticipation.convert import midi_to_compound
+
+    def run(inputs, output):
+        tokens = midi_to_compound(os.path.join(inputs['midi'], "track.mid"))
+        with open(os.path.join(output, "compound.txt"), 'w') as f:
+            f.write(' '.join(str(tok) for tok in tokens))
+    return run
+
+
+RUNNERS = {'stems': run_stems, 'labels': run_labels, 'midi': run_midi, 'tokens': run_tokens}
+
+
+class ArtifactCache:
+    """Content-addressed artifact directories plus a stat-keyed cache of audio hashes"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.hashes_path = self.root / "audio-hashes.json"
+        self.hashes = json.loads(self.hashes_path.read_text()) if self.hashes_path.exists() else {}
+
+    def audio_key(self, path):
+        """SHA-256 of an audio file, rehashed only when its size or mtime changed"""
+        stat = path.stat()
+        known = self.hashes.get(str(path))
+        if known and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        self.hashes[str(path)] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def save_hashes(self):
+        tmp_path = self.hashes_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.hashes))
+        os.replace(tmp_path, self.hashes_path)
+
+    def path(self, stage_name, key):
+        return self.root / "objects" / stage_name / key[:2] / key
+
+    def log_path(self, stage_name, track):
+        path = self.root / "logs" / stage_name / f"{track}.log"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def scratch(self):
+        scratch_root = self.root / "tmp"
+        scratch_root.mkdir(exist_ok=True)
+        return Path(tempfile.mkdtemp(dir=scratch_root))
+
+    def commit(self, scratch, stage_name, key):
+        """Move a finished scratch directory into place; the rename makes the artifact visible atomically"""
+        destination = self.path(stage_name, key)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.rename(scratch, destination)
+        except OSError:
+            shutil.rmtree(scratch, ignore_errors=True)  # another run produced the same key first
+        return destination
+
+
+def artifact_key(stage, code_hash, input_keys):
+    payload = json.dumps({'stage': stage.name, 'params': stage.params, 'code': code_hash, 'inputs': input_keys},
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def place(source, destination):
+    """Hardlink source to destination, copying when links are not possible"""
+    if destination.exists():
+        if os.path.samefile(source, destination):
+            return  # published by an earlier run
+        destination.unlink()
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+class Publisher:
+    """Expose artifacts at the paths the notebooks and scripts already use"""
+
+    def __init__(self, stems_dir=None, labels_dir=None, midi_dir=None, tokens_dir=None):
+        self.dirs = {'stems': stems_dir, 'labels': labels_dir, 'midi': midi_dir, 'tokens': tokens_dir}
+
+    def publish(self, stage_name, artifact, audio_file):
+        target = self.dirs.get(stage_name)
+        if target is None:
+            return
+        target = Path(target)
+        track = audio_file.stem
+        if stage_name == 'stems':
+            (target / track).mkdir(parents=True, exist_ok=True)
+            for stem in artifact.iterdir():
+                place(stem, target / track / stem.name)
+        elif stage_name == 'labels':
+            destination = target / f"{audio_file.name}_labels.txt"
+            if not destination.exists():
+                target.mkdir(parents=True, exist_ok=True)
+                place(artifact / "labels.txt", destination)
+        elif stage_name == 'midi':
+            target.mkdir(parents=True, exist_ok=True)
+            place(artifact / "track.mid", target / f"{track}.mid")
+        elif stage_name == 'tokens':
+            target.mkdir(parents=True, exist_ok=True)
+            place(artifact / "compound.txt", target / f"{track}.compound.txt")
+
+
+def serve_stage(stage_name, params):
+    """Worker process loop: one JSON task per stdin line, one JSON result per line on the original stdout
+
+    Everything the stage prints (including output from native code) goes to
+    the task's log file, so stdout is redirected per task and the results use
+    a duplicate of the original descriptor.
+    """
+    results = os.fdopen(os.dup(1), 'w', buffering=1)
+    # Until the first task, anything printed goes to stderr rather than into the results
+    os.dup2(2, 1)
+    run = None
+    for line in sys.stdin:
+        task = json.loads(line)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        log_fd = os.open(task['log'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.dup2(log_fd, 1)
+        os.dup2(log_fd, 2)
+        os.close(log_fd)
+        error = None
+        try:
+            if run is None:
+                run = RUNNERS[stage_name](params)
+            run(task['inputs'], task['output'])
+        except Exception as e:
+            traceback.print_exc()
+            error = f"{type(e).__name__}: {e}"
+        sys.stdout.flush()
+        sys.stderr.flush()
+        results.write(json.dumps({'ok': error is None, 'error': error}) + "\n")
+
+
+class StageWorker:
+    """A long-lived child interpreter running serve_stage for one stage"""
+
+    def __init__(self, stage, python, params):
+        command = [python, str(SCRIPTS_DIR / "orchestrator.py"), "--serve-stage", stage.name,
+                   "--params", json.dumps(params)]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+                                        cwd=SCRIPTS_DIR)
+
+    def run(self, inputs, scratch, log_path):
+        """Run one track; True on success, False when the stage failed or the worker died"""
+        task = {'inputs': {k: str(v) for k, v in inputs.items()}, 'output': str(scratch), 'log': str(log_path)}
+        try:
+            self.process.stdin.write(json.dumps(task) + "\n")
+            self.process.stdin.flush()
+            line = self.process.stdout.readline()
+        except (BrokenPipeError, OSError):
+            line = ''
+        if not line:
+            self.process.wait()
+            with open(log_path, 'a') as log:
+                log.write(f"\nworker exited with code {self.process.returncode}\n")
+            return False
+        return json.loads(line)['ok']
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+class WorkerPool:
+    """Idle StageWorkers per stage, started on demand and reused across tracks"""
+
+    def __init__(self, pythons, params):
+        self.pythons = pythons
+        self.params = params
+        self.idle = {}
+        self.workers = []
+        self.lock = threading.Lock()
+
+    def acquire(self, stage):
+        with self.lock:
+            idle = self.idle.setdefault(stage.name, [])
+            if idle:
+                return idle.pop()
+        worker = StageWorker(stage, self.pythons.get(stage.name, sys.executable), self.params(stage))
+        with self.lock:
+            self.workers.append(worker)
+        return worker
+
+    def release(self, stage, worker):
+        with self.lock:
+            if worker.alive():
+                self.idle[stage.name].append(worker)
+            else:
+                self.workers.remove(worker)
+
+    def retire(self, stage_name):
+        """Stop a stage's idle workers once it has no tracks left, freeing their models' memory"""
+        with self.lock:
+            idle = self.idle.pop(stage_name, [])
+            for worker in idle:
+                self.workers.remove(worker)
+        for worker in idle:
+            worker.close()
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+
+
+def run_pipeline(audio_dir, cache_dir, publisher, stages=None, pythons=None, workers=None,
+                 anticipation_dir='./notebooks/anticipation', dry_run=False):
+    """Bring every track's requested artifacts up to date, computing only missing keys"""
+    wanted = set(stages or [stage.name for stage in STAGES])
+    # A requested stage needs its upstream stages too
+    for stage in reversed(STAGES):
+        if stage.name in wanted:
+            wanted.update(i for i in stage.inputs if i != 'audio')
+    active = [stage for stage in STAGES if stage.name in wanted]
+    pythons = pythons or {}
+    limits = {stage.name: (workers or {}).get(stage.name, stage.workers) for stage in active}
+    runtime_params = {'tokens': {'anticipation_dir': os.path.abspath(anticipation_dir)}}
+
+    # Stage children run with cwd=SCRIPTS_DIR, so every path they are handed (audio files, and the cache's
+    # artifact and scratch directories) must be absolute
+    audio_dir = Path(audio_dir).resolve()
+    cache = ArtifactCache(Path(cache_dir).resolve())
+    extra_sources = {'tokens': anticipation_sources(anticipation_dir)}
+    code_hashes = {stage.name: stage.code_hash(extra_sources.get(stage.name, ())) for stage in active}
+    audio_files = sorted(f for f in Path(audio_dir).iterdir() if f.suffix.lower() in EXTENSIONS)
+
+    # Plan: artifact keys for every (track, stage); tasks for the ones not in the cache
+    start = time.perf_counter()
+    keys = {}
+    tasks = []
+    for audio_file in audio_files:
+        keys[(audio_file, 'audio')] = cache.audio_key(audio_file)
+        for stage in active:
+            input_keys = [keys[(audio_file, name)] for name in stage.inputs]
+            key = artifact_key(stage, code_hashes[stage.name], input_keys)
+            keys[(audio_file, stage.name)] = key
+            if cache.path(stage.name, key).exists():
+                publisher.publish(stage.name, cache.path(stage.name, key), audio_file)
+            else:
+                tasks.append((audio_file, stage))
+    cache.save_hashes()
+    print(f"{len(audio_files)} tracks, {len(audio_files) * len(active) - len(tasks)} artifacts cached, "
+          f"{len(tasks)} to compute (planned in {time.perf_counter() - start:.1f}s)")
+    for stage in active:
+        print(f"  {stage.name}: {sum(1 for _, s in tasks if s is stage)}")
+    if dry_run or not tasks:
+        return
+
+    pending = {(audio_file, stage.name) for audio_file, stage in tasks}
+    failed = set()
+    running = {stage.name: 0 for stage in active}
+    counts = {'done': 0, 'failed': 0, 'skipped': 0}
+
+    def blocked(audio_file, stage):
+        return any((audio_file, name) in pending or (audio_file, name) in failed for name in stage.inputs)
+
+    pool = WorkerPool(pythons, lambda stage: {**stage.params, **runtime_params.get(stage.name, {})})
+
+    def execute(audio_file, stage):
+        inputs = {name: audio_file if name == 'audio' else cache.path(name, keys[(audio_file, name)])
+                  for name in stage.inputs}
+        scratch = cache.scratch()
+        worker = pool.acquire(stage)
+        try:
+            ok = worker.run(inputs, scratch, cache.log_path(stage.name, audio_file.stem))
+        finally:
+            pool.release(stage, worker)
+        if not ok:
+            shutil.rmtree(scratch, ignore_errors=True)
+            return False
+        artifact = cache.commit(scratch, stage.name, keys[(audio_file, stage.name)])
+        publisher.publish(stage.name, artifact, audio_file)
+        return True
+
+    try:
+        queue = list(tasks)
+        futures = {}
+        with ThreadPoolExecutor(max_workers=sum(limits.values())) as executor:
+            while queue or futures:
+                # Start every task whose inputs exist, within its stage's limit; upstream stages first
+                for audio_file, stage in list(queue):
+                    if any((audio_file, name) in failed for name in stage.inputs):
+                        queue.remove((audio_file, stage))
+                        pending.discard((audio_file, stage.name))
+                        failed.add((audio_file, stage.name))
+                        counts['skipped'] += 1
+                    elif running[stage.name] < limits[stage.name] and not blocked(audio_file, stage):
+                        queue.remove((audio_file, stage))
+                        running[stage.name] += 1
+                        futures[executor.submit(execute, audio_file, stage)] = (audio_file, stage)
+                if not futures:
+                    break  # nothing left that can start
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    audio_file, stage = futures.pop(future)
+                    running[stage.name] -= 1
+                    pending.discard((audio_file, stage.name))
+                    try:
+                        ok = future.result()
+                    except Exception as e:
+                        print(f"Error in {stage.name} for {audio_file.name}: {str(e)}")
+                        ok = False
+                    if ok:
+                        counts['done'] += 1
+                        print(f"{stage.name}: {audio_file.stem} done")
+                    else:
+                        failed.add((audio_file, stage.name))
+                        counts['failed'] += 1
+                        print(f"{stage.name}: {audio_file.stem} failed "
+                              f"(log: {cache.log_path(stage.name, audio_file.stem)})")
+                    if running[stage.name] == 0 and not any(s is stage for _, s in queue):
+                        pool.retire(stage.name)
+    finally:
+        pool.close()
+
+    print(f"\nComputed: {counts['done']}  Failed: {counts['failed']}  Skipped (failed input): {counts['skipped']}")
+    print(f"Wall time: {time.perf_counter() - start:.0f}s")
+
+
+def parse_assignments(values, convert=str):
+    """['stage=value', ...] -> {stage: value}"""
+    result = {}
+    for value in values or []:
+        name, _, setting = value.partition('=')
+        result[name] = convert(setting)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the per-track pipeline incrementally with a content-addressed cache")
+    parser.add_argument("--audio-dir", default="./audio", help="Directory containing the audio files")
+    parser.add_argument("--cache-dir", default="./.pipeline-cache", help="Artifact cache")
+    parser.add_argument("--stages", nargs="*", default=None, choices=[stage.name for stage in STAGES],
+                        help="Stages to bring up to date, with their upstream stages (default: all)")
+    parser.add_argument("--stems-dir", default="./audio/stems/htdemucs_6s", help="Where to publish stems")
+    parser.add_argument("--labels-dir", default="./labels", help="Where to publish new label files")
+    parser.add_argument("--midi-dir", default="./midi-out", help="Where to publish combined MIDI files")
+    parser.add_argument("--tokens-dir", default="./midi/compound", help="Where to publish compound token files")
+    parser.add_argument("--python", nargs="*", default=[], metavar="STAGE=PATH",
+                        help="Interpreter per stage, e.g. labels=~/miniconda3/envs/segmenter/bin/python")
+    parser.add_argument("--workers", nargs="*", default=[], metavar="STAGE=N", help="Concurrent tasks per stage")
+    parser.add_argument("--anticipation-dir", default="./notebooks/anticipation", help="Path of the anticipation clone")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be computed")
+    parser.add_argument("--serve-stage", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--params", default="{}", help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.serve_stage is not None:
+        serve_stage(args.serve_stage, json.loads(args.params))
+    else:
+        run_pipeline(args.audio_dir, args.cache_dir,
+                     Publisher(args.stems_dir, args.labels_dir, args.midi_dir, args.tokens_dir),
+                     stages=args.stages, pythons=parse_assignments(args.python),
+                     workers=parse_assignments(args.workers, int), anticipation_dir=args.anticipation_dir,
+                     dry_run=args.dry_run)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Fault-isolated, resumable version of audio_to_midi.process_all_tracks.
+
+Tracks are handed out one at a time to a pool of worker processes, each with
+its own TranscriptionEngine. A worker writes a track into a private scratch
+directory and only moves the finished .mid (and any --artifacts) into the
+output directory once everything succeeded, so concurrent tracks never share
+files and a killed worker never leaves a half-written MIDI behind.
+
+The supervisor kills a worker whose track runs past --timeout, replaces
+workers that die (native crashes in librosa/basic-pitch), and retires each
+worker after --max-tasks-per-worker tracks to cap memory growth. Every
+finished track is appended to a JSON-lines manifest; re-running the same
+command skips tracks that are already in it.
+"""
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from multiprocessing.connection import wait
+
+from audio_to_midi import ARTIFACTS, convert_stems_to_midi, find_stems
+from note_store import NoteStore
+from stem_activity import DEFAULT_THRESHOLDS
+from transcription import DEFAULT_BATCH_SIZE, TranscriptionEngine
+
+MANIFEST_NAME = "manifest.jsonl"
+DEFAULT_TIMEOUT_SEC = 30 * 60
+DEFAULT_MAX_TASKS_PER_WORKER = 50
+
+
+def read_manifest(manifest_path):
+    """Latest manifest record per track"""
+    records = {}
+    if not os.path.exists(manifest_path):
+        return records
+    with open(manifest_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # torn last line from an interrupted run
+            records[record['track']] = record
+    return records
+
+
+def append_manifest(manifest_path, record):
+    """Append one record and make sure it is on disk before the next track is reported"""
+    with open(manifest_path, 'a') as f:
+        f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def publish_track(scratch_directory, output_directory, track_name):
+    """Move a finished track from its scratch directory into the output directory"""
+    artifacts_directory = os.path.join(scratch_directory, track_name)
+    if os.path.isdir(artifacts_directory):
+        destination = os.path.join(output_directory, track_name)
+        shutil.rmtree(destination, ignore_errors=True)
+        shutil.move(artifacts_directory, destination)
+    # The .mid goes last: its presence marks the track as complete
+    os.replace(os.path.join(scratch_directory, f"{track_name}.mid"),
+               os.path.join(output_directory, f"{track_name}.mid"))
+
+
+def _worker_main(conn, output_directory, scratch_root, batch_size, artifacts, thresholds):
+    """Worker loop: receive track directories, reply with a result record, stop on None"""
+    engine = TranscriptionEngine(batch_size=batch_size)
+    while True:
+        track_dir = conn.recv()
+        if track_dir is None:
+            break
+        track_name = os.path.basename(track_dir)
+        record = {'track': track_name}
+        scratch_directory = tempfile.mkdtemp(prefix=f"{track_name}.", dir=scratch_root)
+        try:
+            if convert_stems_to_midi(track_dir, scratch_directory, engine, artifacts, thresholds):
+                publish_track(scratch_directory, output_directory, track_name)
+                record['status'] = 'done'
+            else:
+                record['status'] = 'failed'
+                record['error'] = "no MIDI produced"
+        except Exception as e:
+            record['status'] = 'failed'
+            record['error'] = str(e)
+        finally:
+            shutil.rmtree(scratch_directory, ignore_errors=True)
+        conn.send(record)
+    conn.close()
+
+
+class _Worker:
+    """A worker process plus the track it is currently working on"""
+
+    def __init__(self, context, worker_args):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,) + worker_args, daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.track_dir = None
+        self.started = None
+        self.tasks_done = 0
+
+    def assign(self, track_dir):
+        self.conn.send(track_dir)
+        self.track_dir = track_dir
+        self.started = time.monotonic()
+
+    def finish(self):
+        self.track_dir = None
+        self.started = None
+        self.tasks_done += 1
+
+    def retire(self):
+        """Let the worker exit after its current loop iteration"""
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=10)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+def process_all_tracks_parallel(base_directory, output_directory, workers=None,
+                                timeout=DEFAULT_TIMEOUT_SEC, max_tasks_per_worker=DEFAULT_MAX_TASKS_PER_WORKER,
+                                batch_size=DEFAULT_BATCH_SIZE, artifacts=(), manifest_path=None,
+                                retry_failed=False, note_store=None, thresholds=DEFAULT_THRESHOLDS, skip_tracks=()):
+    """Process every track folder in base_directory on a pool of isolated workers
+
+    Finished tracks are read back from their .mid into note_store, if given; the
+    supervisor is the store's only writer. Stems below the activity thresholds
+    are not transcribed (thresholds=None transcribes every stem). Folders named
+    in skip_tracks are left out.
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    manifest_path = manifest_path or os.path.join(output_directory, MANIFEST_NAME)
+    manifest = read_manifest(manifest_path)
+    skip_statuses = {'done'} if retry_failed else {'done', 'failed', 'timeout', 'crashed'}
+
+    track_dirs = sorted(d for d in glob.glob(os.path.join(base_directory, '*'))
+                        if os.path.isdir(d) and os.path.basename(d) not in skip_tracks)
+    pending = [d for d in track_dirs
+               if manifest.get(os.path.basename(d), {}).get('status') not in skip_statuses]
+    print(f"Found {len(track_dirs)} tracks, {len(track_dirs) - len(pending)} already in {manifest_path}")
+
+    counts = {'done': 0, 'failed': 0, 'timeout': 0, 'crashed': 0}
+
+    def report(record):
+        if record['status'] == 'done' and note_store is not None:
+            import pretty_midi
+            midi_file = os.path.join(output_directory, f"{record['track']}.mid")
+            try:
+                note_store.add_midi(record['track'], pretty_midi.PrettyMIDI(midi_file))
+            except Exception as e:
+                print(f"Error adding {record['track']} to the note store: {str(e)}")
+        counts[record['status']] += 1
+        append_manifest(manifest_path, record)
+        message = f"[{sum(counts.values())}/{len(pending)}] {record['track']}: {record['status']}"
+        if record.get('error'):
+            message += f" ({record['error']})"
+        print(message)
+
+    # Tracks without stems are recorded right away instead of occupying a worker
+    queue = []
+    for track_dir in pending:
+        if find_stems(track_dir):
+            queue.append(track_dir)
+        else:
+            report({'track': os.path.basename(track_dir), 'status': 'failed', 'error': "no MP3 files found"})
+    queue.reverse()  # pop() from the end keeps the sorted order
+
+    workers = min(workers or os.cpu_count() or 1, len(queue))
+    scratch_root = tempfile.mkdtemp(prefix=".scratch.", dir=output_directory)
+    # spawn, not fork: the parent must not share TensorFlow/torch state with its workers
+    context = multiprocessing.get_context("spawn")
+    worker_args = (output_directory, scratch_root, batch_size, set(artifacts), thresholds)
+    pool = []
+
+    try:
+        while queue or any(w.track_dir for w in pool):
+            while len(pool) < workers and len(pool) < len(queue) + sum(1 for w in pool if w.track_dir):
+                pool.append(_Worker(context, worker_args))
+            for worker in pool:
+                if worker.track_dir is None and queue:
+                    worker.assign(queue.pop())
+
+            busy = [w for w in pool if w.track_dir]
+            ready = wait([w.conn for w in busy], timeout=1.0)
+            now = time.monotonic()
+
+            for worker in busy:
+                track_name = os.path.basename(worker.track_dir)
+                if worker.conn in ready:
+                    try:
+                        record = worker.conn.recv()
+                    except (EOFError, OSError):
+                        record = None
+                    if record is not None:
+                        record['seconds'] = round(now - worker.started, 2)
+                        report(record)
+                        worker.finish()
+                        if worker.tasks_done >= max_tasks_per_worker:
+                            worker.retire()
+                            pool.remove(worker)
+                        continue
+                if not worker.process.is_alive() or worker.conn in ready:
+                    # The pipe closed without a result: the process died mid-track. It may still be
+                    # shutting down, so reap it before reading its exit code
+                    worker.process.join(5)
+                    worker.kill()
+                    report({'track': track_name, 'status': 'crashed', 'seconds': round(now - worker.started, 2),
+                            'error': f"worker exited with code {worker.process.exitcode}"})
+                    pool.remove(worker)
+                elif timeout and now - worker.started > timeout:
+                    report({'track': track_name, 'status': 'timeout', 'seconds': round(now - worker.started, 2),
+                            'error': f"exceeded {timeout}s"})
+                    worker.kill()
+                    pool.remove(worker)
+    finally:
+        for worker in pool:
+            if worker.track_dir is None:
+                worker.retire()
+            else:
+                worker.kill()
+        shutil.rmtree(scratch_root, ignore_errors=True)
+        if note_store is not None:
+            note_store.flush()
+
+    print(f"\nProcessing complete!")
+    print(f"Successfully processed: {counts['done']} tracks")
+    print(f"Failed to process: {counts['failed']} tracks")
+    print(f"Timed out: {counts['timeout']} tracks")
+    print(f"Crashed: {counts['crashed']} tracks")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transcribe separated stems into multitrack MIDI files on a pool of worker processes")
+    parser.add_argument("base_directory", help="Directory with one folder of stems per track")
+    parser.add_argument("output_directory", help="Directory for the combined MIDI files")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT_SEC,
+                        help="Seconds before a track's worker is killed (0 disables)")
+    parser.add_argument("--max-tasks-per-worker", type=int, default=DEFAULT_MAX_TASKS_PER_WORKER,
+                        help="Tracks a worker processes before it is replaced")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Model windows per inference batch")
+    parser.add_argument("--artifacts", nargs="*", default=[], choices=ARTIFACTS,
+                        help="Per-stem outputs to keep in <output_directory>/<track>/")
+    parser.add_argument("--manifest", default=None,
+                        help=f"Completion manifest (default: <output_directory>/{MANIFEST_NAME})")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Retry tracks the manifest lists as failed, timed out or crashed")
+    parser.add_argument("--note-store", default=None, help="Also append every track's notes to this NoteStore directory")
+    parser.add_argument("--silence-db", type=float, default=DEFAULT_THRESHOLDS['silence_db'],
+                        help="Frames quieter than this (dBFS RMS) count as inactive")
+    parser.add_argument("--min-active-sec", type=float, default=DEFAULT_THRESHOLDS['min_active_sec'],
+                        help="Stems with less activity than this are not transcribed")
+    parser.add_argument("--keep-silent", action="store_true", help="Transcribe every stem")
+    parser.add_argument("--fingerprints", metavar="DB",
+                        help="Skip tracks this fingerprint index flags as duplicates (their MIDI is copied on ingest)")
+
+    args = parser.parse_args()
+
+    thresholds = None if args.keep_silent else {'silence_db': args.silence_db, 'min_active_sec': args.min_active_sec}
+
+    skip_tracks = set()
+    if args.fingerprints:
+        from fingerprint_index import duplicate_tracks
+
+        skip_tracks = duplicate_tracks(args.fingerprints)
+    process_all_tracks_parallel(args.base_directory, args.output_directory, workers=args.workers,
+                                timeout=args.timeout, max_tasks_per_worker=args.max_tasks_per_worker,
+                                batch_size=args.batch_size, artifacts=set(args.artifacts),
+                                manifest_path=args.manifest, retry_failed=args.retry_failed,
+                                note_store=NoteStore(args.note_store) if args.note_store else None,
+                                thresholds=thresholds, skip_tracks=skip_tracks)
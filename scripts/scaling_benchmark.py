@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+End-to-end scaling benchmark on a synthetic corpus.
+
+For every track length in --durations and corpus size in --tracks, this
+generates the tracks with synth_corpus.py (reused between runs) and pushes
+them through each stage:
+
+- segmentation: segmentation.segment_file (streaming for tracks of
+  STREAMING_MIN_SEC or more), scored against the ground-truth labels
+  (boundary F-measure at 3 s)
+- separation: InMemoryStemSeparator, stems written as in the orchestrator
+- transcription: basic-pitch on the separated stems, or on the
+  ground-truth stems when separation is not part of the run
+- export: Drive upload of the label files (only with --drive-folder)
+
+A stage runs in --workers child processes, each handling a slice of the
+tracks, with the interpreter given by --python <stage>=<path> as in
+orchestrator.py. Every child reports its model setup time, the latency of
+each track and its peak RSS. For each (stage, length, tracks) cell the table
+shows throughput, realtime factor (seconds of audio per wall second),
+latency percentiles and peak memory, so it is visible which stage stops
+scaling first as the corpus or the tracks grow.
+
+    python scaling_benchmark.py /tmp/bench --tracks 1 4 16 --durations 30 300 1800 \\
+        --stages segmentation --python segmentation=~/miniconda3/envs/segmenter/bin/python
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from orchestrator import parse_assignments
+from synth_corpus import generate_corpus
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+STAGES = ['segmentation', 'separation', 'transcription', 'export']
+PERCENTILES = [50, 90, 99]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return 0.0
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return max_rss / 2**20 if sys.platform == 'darwin' else max_rss / 2**10
+
+
+# Stage runners; each runs in a child process over its slice of the tracks.
+# They return a setup function (model loading, timed separately) and a per-track function.
+
+def segmentation_runner(corpus_dir, work_dir, params):
+    from benchmark_segmentation import boundary_scores, segment_boundaries
+    from segmentation import read_labels, segment_file
+
+    labels_dir = Path(work_dir) / "labels"
+    labels_dir.mkdir(parents=True, exist_ok=True)
+
+    def run(audio_path):
+        # As production runs it: tracks of STREAMING_MIN_SEC or more are segmented block by block
+        name = Path(audio_path).name
+        segment_file(name, str(Path(audio_path).parent), str(labels_dir))
+        estimate = read_labels(labels_dir / f"{name}_labels.txt")
+        reference = read_labels(Path(corpus_dir) / "labels" / f"{name}_labels.txt")
+        _, _, f_measure = boundary_scores(segment_boundaries(reference), segment_boundaries(estimate), 3.0)
+        return {'f_measure_3s': f_measure}
+    return run
+
+
+def separation_runner(corpus_dir, work_dir, params):
+    from stem_separation import InMemoryStemSeparator
+
+    separator = InMemoryStemSeparator(device=params.get('device'))
+
+    def run(audio_path):
+        stems = separator.separate(audio_path)
+        activity = separator.analyze(stems)
+        separator.save_stems(stems, Path(work_dir) / "stems" / Path(audio_path).stem, activity=activity)
+        return {'silent_stems': sum(entry['silent'] for entry in activity.values())}
+    return run
+
+
+def transcription_runner(corpus_dir, work_dir, params):
+    from audio_to_midi import build_multitrack_midi
+    from stem_activity import stem_activity
+    from transcription import AUDIO_SAMPLE_RATE, StemJob, TranscriptionEngine, estimate_tempo, load_stem
+
+    engine = TranscriptionEngine()
+    midi_dir = Path(work_dir) / "midi"
+    midi_dir.mkdir(parents=True, exist_ok=True)
+
+    def run(audio_path):
+        track = Path(audio_path).stem
+        separated = Path(work_dir) / "stems" / track
+        stem_files = sorted(separated.glob("*.mp3")) if separated.exists() else \
+            sorted((Path(corpus_dir) / "stems" / track).glob("*.wav"))
+        jobs = []
+        for stem_file in stem_files:
+            y = load_stem(stem_file)
+            if not stem_activity(y, AUDIO_SAMPLE_RATE)['silent']:
+                jobs.append(StemJob(track, stem_file.stem, y, tempo=estimate_tempo(y), source_path=stem_file))
+        results = list(engine.transcribe(jobs))
+        failed = [result for result in results if result.error]
+        if failed:
+            raise RuntimeError("; ".join(f"{result.job.stem}: {result.error}" for result in failed))
+        if results:
+            build_multitrack_midi(results).write(str(midi_dir / f"{track}.mid"))
+        return {'stems': len(results), 'notes': sum(len(result.note_events) for result in results)}
+    return run
+
+
+def export_runner(corpus_dir, work_dir, params):
+    from export_batch import get_google_drive_service, upload_to_drive
+
+    service = get_google_drive_service()
+
+    def run(audio_path):
+        name = Path(audio_path).name
+        labels_file = Path(work_dir) / "labels" / f"{name}_labels.txt"
+        if not labels_file.exists():
+            labels_file = Path(corpus_dir) / "labels" / f"{name}_labels.txt"
+        upload_to_drive(service, str(labels_file), params['drive_folder'])
+        return {'bytes': labels_file.stat().st_size}
+    return run
+
+
+RUNNERS = {
+    'segmentation': segmentation_runner,
+    'separation': separation_runner,
+    'transcription': transcription_runner,
+    'export': export_runner,
+}
+
+
+def run_child(stage, audio_paths, corpus_dir, work_dir, params, result_path):
+    """Child side: set the stage up once, time every track, write the result JSON"""
+    start = time.perf_counter()
+    run = RUNNERS[stage](corpus_dir, work_dir, params)
+    result = {'setup_sec': time.perf_counter() - start, 'tracks': []}
+    for audio_path in audio_paths:
+        start = time.perf_counter()
+        try:
+            extra = run(audio_path)
+            error = None
+        except Exception as e:
+            extra = {}
+            error = str(e)
+            print(f"Error in {stage} for {Path(audio_path).name}: {error}")
+        result['tracks'].append({'track': Path(audio_path).stem, 'seconds': time.perf_counter() - start,
+                                 'error': error, **extra})
+    result['peak_rss_mb'] = peak_rss_mb()
+    with open(result_path, 'w') as f:
+        json.dump(result, f)
+
+
+def run_stage(stage, audio_paths, corpus_dir, work_dir, workers, python, params, log_dir):
+    """Run a stage over the tracks in up to `workers` children; (wall seconds, child results)"""
+    slices = [audio_paths[i::workers] for i in range(min(workers, len(audio_paths)))]
+
+    def child(index, paths):
+        result_path = Path(log_dir) / f"{stage}-{index}.json"
+        if result_path.exists():
+            result_path.unlink()  # left by an earlier run
+        command = [python, str(SCRIPTS_DIR / "scaling_benchmark.py"), "--run-stage", stage,
+                   "--paths", json.dumps([str(p) for p in paths]), "--corpus", str(corpus_dir),
+                   "--output", str(work_dir), "--params", json.dumps(params), "--result", str(result_path)]
+        with open(Path(log_dir) / f"{stage}-{index}.log", 'w') as log:
+            subprocess.run(command, stdout=log, stderr=subprocess.STDOUT, cwd=SCRIPTS_DIR)
+        if not result_path.exists():
+            return None  # the child died; its log has the details
+        with open(result_path) as f:
+            return json.load(f)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(slices)) as executor:
+        results = list(executor.map(child, range(len(slices)), slices))
+    return time.perf_counter() - start, results
+
+
+def summarize_cell(stage, duration, n_tracks, wall, results):
+    """One row of the scaling table"""
+    finished = [result for result in results if result is not None]
+    tracks = [track for result in finished for track in result['tracks'] if track['error'] is None]
+    latencies = np.array([track['seconds'] for track in tracks])
+    row = {
+        'stage': stage, 'duration': duration, 'tracks': n_tracks, 'ok': len(tracks),
+        'failed': n_tracks - len(tracks), 'wall_sec': wall,
+        'setup_sec': max((result['setup_sec'] for result in finished), default=0.0),
+        'tracks_per_min': 60 * len(tracks) / wall if wall else 0.0,
+        'realtime_factor': len(tracks) * duration / wall if wall else 0.0,
+        'peak_rss_mb': max((result['peak_rss_mb'] for result in finished), default=0.0),
+    }
+    for p in PERCENTILES:
+        row[f'p{p}_sec'] = float(np.percentile(latencies, p)) if len(latencies) else None
+    if tracks and 'f_measure_3s' in tracks[0]:
+        row['f_measure_3s'] = float(np.mean([track['f_measure_3s'] for track in tracks]))
+    return row
+
+
+def print_row(row):
+    percentiles = " ".join(f"{row[f'p{p}_sec']:>7.2f}" if row[f'p{p}_sec'] is not None else f"{'-':>7}"
+                           for p in PERCENTILES)
+    extra = f"  F@3s {row['f_measure_3s']:.3f}" if 'f_measure_3s' in row else ""
+    print(f"{row['stage']:<14} {row['duration']:>8g} {row['tracks']:>6} {row['failed']:>6} {row['wall_sec']:>8.1f} "
+          f"{row['setup_sec']:>7.1f} {row['tracks_per_min']:>8.2f} {row['realtime_factor']:>8.2f} {percentiles} "
+          f"{row['peak_rss_mb']:>8.0f}{extra}")
+
+
+def run_benchmark(work_root, stages, track_counts, durations, corpus_dir=None, workers=1, pythons=None,
+                  seed=0, params=None):
+    """Run every (length, corpus size, stage) cell; returns the table rows"""
+    pythons = pythons or {}
+    # Children run from the scripts directory
+    work_root = os.path.abspath(work_root)
+    corpus_dir = os.path.abspath(corpus_dir or os.path.join(work_root, "corpus"))
+    # Without a separation stage, transcription reads the ground-truth stems
+    ground_truth_stems = 'transcription' in stages and 'separation' not in stages
+
+    print(f"{'stage':<14} {'length':>8} {'tracks':>6} {'failed':>6} {'wall s':>8} {'setup':>7} {'trk/min':>8} "
+          f"{'x rt':>8} " + " ".join(f"{f'p{p} s':>7}" for p in PERCENTILES) + f" {'peak MB':>8}")
+    rows = []
+    for duration in durations:
+        audio_paths = generate_corpus(corpus_dir, max(track_counts), duration, seed=seed, stems=ground_truth_stems)
+        for n_tracks in sorted(track_counts):
+            work_dir = Path(work_root) / f"{int(duration)}s-{n_tracks}"
+            log_dir = work_dir / "logs"
+            log_dir.mkdir(parents=True, exist_ok=True)
+            for stage in stages:
+                wall, results = run_stage(stage, audio_paths[:n_tracks], corpus_dir, work_dir, workers,
+                                          pythons.get(stage, sys.executable), params or {}, log_dir)
+                row = summarize_cell(stage, duration, n_tracks, wall, results)
+                print_row(row)
+                rows.append(row)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark pipeline stages on synthetic corpora of growing size and length")
+    parser.add_argument("work_dir", nargs="?", help="Directory for the corpus, stage outputs and logs")
+    parser.add_argument("--stages", nargs="+", default=['segmentation'], choices=STAGES)
+    parser.add_argument("--tracks", type=int, nargs="+", default=[1, 4, 16], help="Corpus sizes")
+    parser.add_argument("--durations", type=float, nargs="+", default=[30.0, 300.0, 1800.0],
+                        help="Track lengths in seconds (30 to 5400)")
+    parser.add_argument("--corpus", default=None, help="Corpus directory (default: <work_dir>/corpus)")
+    parser.add_argument("--workers", type=int, default=1, help="Child processes per stage")
+    parser.add_argument("--python", nargs="*", default=[], metavar="STAGE=PATH",
+                        help="Interpreter per stage, e.g. segmentation=~/miniconda3/envs/segmenter/bin/python")
+    parser.add_argument("--seed", type=int, default=0, help="Corpus seed")
+    parser.add_argument("--device", default=None, help="Torch device for separation")
+    parser.add_argument("--drive-folder", default=None, help="Drive folder id for the export stage")
+    parser.add_argument("--report", default=None, help="Write the table rows as JSON")
+    parser.add_argument("--run-stage", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--paths", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--output", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--params", default="{}", help=argparse.SUPPRESS)
+    parser.add_argument("--result", default=None, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.run_stage is not None:
+        run_child(args.run_stage, json.loads(args.paths), args.corpus, args.output, json.loads(args.params),
+                  args.result)
+        sys.exit(0)
+
+    if args.work_dir is None:
+        parser.error("the following arguments are required: work_dir")
+    if 'export' in args.stages and not args.drive_folder:
+        parser.error("the export stage uploads to Google Drive and needs --drive-folder")
+    for duration in args.durations:
+        if not 30 <= duration <= 5400:
+            parser.error(f"duration {duration:g}s is outside 30..5400")
+
+    rows = run_benchmark(args.work_dir, args.stages, args.tracks, args.durations, corpus_dir=args.corpus,
+                         workers=args.workers, pythons=parse_assignments(args.python), seed=args.seed,
+                         params={'device': args.device, 'drive_folder': args.drive_folder})
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(rows, f, indent=2)
+        print(f"\nReport written to {args.report}")
@@ -0,0 +1,465 @@
+"""
+Structural segmentation of songs into intro/verse/chorus/transition/outro labels.
+
+This is the pipeline behind notebooks/music-segmentation.ipynb, pulled into a
+module so the notebook and the benchmark harness run the same code. Each stage
+runs inside `stage(name)`, a context manager factory the caller can use to time
+or profile it. It defaults to instrumentation.span, which is a no-op unless
+tracing is enabled.
+
+Labels are written in Audacity's label text format: start<TAB>end<TAB>label.
+"""
+
+import os
+import tempfile
+
+import numpy as np
+import scipy.signal
+from scipy.spatial.distance import cdist
+import librosa
+
+from pychorus import create_chroma
+from pychorus.similarity_matrix import Line
+import msaf
+
+from banded_similarity import BandedTimeLagSimilarityMatrix
+from instrumentation import span
+
+# Denoising size in seconds
+SMOOTHING_SIZE_SEC = 1.5
+
+# For line detection
+LINE_THRESHOLD = 0.10
+MIN_LINES = 5
+NUM_ITERATIONS = 40
+
+# We allow an error proportional to the length of the clip
+OVERLAP_PERCENT_MARGIN = 0.2
+
+# Longest lag (in seconds) kept in the time lag similarity matrix.
+# Repeats further apart than this are not considered as choruses
+MAX_LAG_SEC = 180
+
+# Set to a directory to keep the similarity matrix in a memmap instead of RAM
+SIMILARITY_SPILL_DIR = None
+
+# Segments shorter than this (in seconds) are dropped
+MIN_SEGMENT_SEC = 5
+
+# Hop length of the per-track MFCC and onset frames
+HOP_LENGTH = 512
+
+# Stage names, in the order they run
+STAGES = ['chroma', 'msaf', 'mfcc', 'similarity', 'line_detection',
+          'overlap_scoring', 'chorus_selection', 'dtw']
+
+
+def local_maxima_rows(denoised_time_lag):
+    """Find rows whose normalized sum is a local maxima"""
+    row_sums = np.sum(denoised_time_lag, axis=1)
+    num_samples = denoised_time_lag.shape[1]
+    divisor = np.arange(num_samples, num_samples - row_sums.shape[0], -1)
+    normalized_rows = row_sums / divisor
+    local_minima_rows = scipy.signal.argrelextrema(normalized_rows, np.greater)
+    return local_minima_rows[0]
+
+
+def detect_lines(denoised_time_lag, rows, min_length_samples):
+    """Detect lines in the time lag matrix. Reduce the threshold until we find enough lines"""
+    cur_threshold = LINE_THRESHOLD
+    for _ in range(NUM_ITERATIONS):
+        line_segments = detect_lines_helper(denoised_time_lag, rows,
+                                            cur_threshold, min_length_samples)
+        if len(line_segments) >= MIN_LINES:
+            return line_segments
+        cur_threshold *= 0.95
+
+    return line_segments
+
+
+def detect_lines_helper(denoised_time_lag, rows, threshold,
+                        min_length_samples):
+    """Detect lines where at least min_length_samples are above threshold"""
+    num_samples = denoised_time_lag.shape[1]
+    line_segments = []
+    cur_segment_start = None
+    for row in rows:
+        if row < min_length_samples:
+            continue
+        for col in range(row, num_samples):
+            if denoised_time_lag[row, col] > threshold:
+                if cur_segment_start is None:
+                    cur_segment_start = col
+            else:
+                if (cur_segment_start is not None
+                   ) and (col - cur_segment_start) > min_length_samples:
+                    line_segments.append(Line(cur_segment_start, col, row))
+                cur_segment_start = None
+    return line_segments
+
+
+def count_overlapping_lines(lines, margin, min_length_samples):
+    """Look at all pairs of lines and see which ones overlap vertically and diagonally"""
+    line_scores = {}
+    for line in lines:
+        line_scores[line] = 0
+
+    # Iterate over all pairs of lines
+    for line_1 in lines:
+        for line_2 in lines:
+            # If line_2 completely covers line_1 (with some margin), line_1 gets a point
+            lines_overlap_vertically = (
+                line_2.start < (line_1.start + margin)) and (
+                    line_2.end > (line_1.end - margin)) and (
+                        abs(line_2.lag - line_1.lag) > min_length_samples)
+
+            lines_overlap_diagonally = (
+                (line_2.start - line_2.lag) < (line_1.start - line_1.lag + margin)) and (
+                    (line_2.end - line_2.lag) > (line_1.end - line_1.lag - margin)) and (
+                        abs(line_2.lag - line_1.lag) > min_length_samples)
+
+            if lines_overlap_vertically or lines_overlap_diagonally:
+                line_scores[line_1] += 1
+
+    return line_scores
+
+
+def sorted_segments(line_scores):
+    """Return the p line, sorted first by chorus matches, then by duration"""
+    lines_to_sort = []
+    for line in line_scores:
+        lines_to_sort.append((line, line_scores[line], line.end - line.start))
+
+    lines_to_sort.sort(key=lambda x: (x[1], x[2]), reverse=True)
+    return lines_to_sort
+
+
+def fastdtw(x, y, dist, warp=1):
+    """Returns the similarity between two song segments using dynamic time warping algorithm"""
+    """Uses mfcc as the feature of comparison"""
+    assert len(x)
+    assert len(y)
+    if np.ndim(x) == 1:
+        x = x.reshape(-1, 1)
+    if np.ndim(y) == 1:
+        y = y.reshape(-1, 1)
+    r, c = len(x), len(y)
+    D0 = np.zeros((r + 1, c + 1))
+    D0[0, 1:] = np.inf
+    D0[1:, 0] = np.inf
+    D1 = D0[1:, 1:]
+    D0[1:, 1:] = cdist(x, y, dist)
+    C = D1.copy()
+    for i in range(r):
+        for j in range(c):
+            min_list = [D0[i, j]]
+            for k in range(1, warp + 1):
+                min_list += [D0[min(i + k, r), j],
+                             D0[i, min(j + k, c)]]
+            D1[i, j] += min(min_list)
+    return D1[-1, -1] / sum(D1.shape)
+
+
+class TrackFrames:
+    """MFCC and onset frames for a whole track, sliced per segment.
+
+    Slicing replaces a fresh STFT per segment/chorus candidate: the per-frame
+    MFCC series is a view, and the mean onset position comes from prefix sums,
+    so both cost O(1) per segment.
+    """
+
+    def __init__(self, song_wav_data, sr, hop_length=HOP_LENGTH):
+        self.sr = sr
+        self.hop_length = hop_length
+        mel_freq = librosa.feature.mfcc(y=song_wav_data, sr=sr, hop_length=hop_length)
+        self.mfcc_average = np.average(mel_freq, axis=0)
+        self.num_frames = self.mfcc_average.shape[0]
+
+        self.onset_envelope = librosa.onset.onset_strength(y=song_wav_data, sr=sr, hop_length=hop_length)
+        onsets = librosa.onset.onset_detect(onset_envelope=self.onset_envelope, sr=sr, hop_length=hop_length)
+        indicator = np.zeros(self.num_frames)
+        indicator[onsets[onsets < self.num_frames]] = 1
+        self.onset_counts = np.concatenate([[0], np.cumsum(indicator)])
+        self.onset_index_sums = np.concatenate([[0], np.cumsum(indicator * np.arange(self.num_frames))])
+
+    def frame_range(self, start_sec, end_sec):
+        """Frames covering [start_sec, end_sec), as a centered STFT of that slice would produce"""
+        start_sample = int(start_sec * self.sr)
+        end_sample = int(end_sec * self.sr)
+        start = min(start_sample // self.hop_length, self.num_frames)
+        stop = min(start + 1 + (end_sample - start_sample) // self.hop_length, self.num_frames)
+        return start, stop
+
+    def mfcc_series(self, start_sec, end_sec):
+        """Per-frame average MFCC over the segment"""
+        start, stop = self.frame_range(start_sec, end_sec)
+        return self.mfcc_average[start:stop]
+
+    def mean_onset_frame(self, start_sec, end_sec):
+        """Mean onset frame index relative to the segment start (nan without onsets)"""
+        start, stop = self.frame_range(start_sec, end_sec)
+        count = self.onset_counts[stop] - self.onset_counts[start]
+        if count == 0:
+            return np.nan
+        return (self.onset_index_sums[stop] - self.onset_index_sums[start]) / count - start
+
+
+def read_labels(labels_path):
+    """Read an Audacity label file into a list of (start, end, label) tuples"""
+    segments = []
+    with open(labels_path) as f:
+        for line in f:
+            # Spectral selection lines start with a backslash
+            if not line.strip() or line.startswith('\\'):
+                continue
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) < 2:
+                continue
+            label = parts[2].strip() if len(parts) > 2 else ''
+            segments.append((float(parts[0]), float(parts[1]), label))
+    return segments
+
+
+def write_labels(labels_path, segments):
+    """Write (start, end, label) tuples as an Audacity label file, atomically"""
+    # A uniquely named temp file, so workers on different nodes never write into the same one
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(labels_path) or '.', suffix='.tmp')
+    with os.fdopen(fd, "w") as frames:
+        for start, end, label in segments:
+            frames.write(f"{round(start)}\t{round(end)}\t{label}\n")
+    os.replace(tmp_path, labels_path)
+
+
+def segment_audio_file(audio_path, stage=span):
+    """Segment one audio file; returns a list of (start, end, label) tuples"""
+    with stage('chroma'):
+        #read in the song and create a chromagram based off of the song
+        chroma, song_wav_data, sr, song_length_sec = create_chroma(audio_path)
+
+    with stage('msaf'):
+        #novelty based segmentation and labeling
+        boundaries, labels = msaf.process(audio_path,
+                                          feature="mfcc",
+                                          boundaries_id="foote",
+                                          labels_id="fmc2d",
+                                          out_sr=sr)
+
+    new_boundaries = []
+    new_labels = []
+    mfccs = []
+    with stage('mfcc'):
+        #mfcc and onset frames are computed once for the whole track and sliced per segment
+        frames = TrackFrames(song_wav_data, sr)
+
+        #parse out segments longer than 5 seconds, and grab the mel frequency coefficients
+        for x in range(len(boundaries) - 1):
+            if boundaries[x + 1] - boundaries[x] >= MIN_SEGMENT_SEC:
+                new_boundaries.append(boundaries[x])
+                new_labels.append(labels[x])
+                mfccs.append(frames.mfcc_series(boundaries[x], boundaries[x + 1]))
+
+    num_samples = chroma.shape[1]
+    chroma_sr = num_samples / song_length_sec
+    clip_length = 10
+    smoothing_size_samples = int(SMOOTHING_SIZE_SEC * chroma_sr)
+    clip_length_samples = clip_length * chroma_sr
+
+    with stage('similarity'):
+        #create and denoise the (banded) time lag similarity matrix
+        time_lag_similarity = BandedTimeLagSimilarityMatrix(chroma, sr,
+                                                            max_lag=int(MAX_LAG_SEC * chroma_sr),
+                                                            spill_dir=SIMILARITY_SPILL_DIR)
+        time_lag_similarity.denoise(smoothing_size_samples)
+
+    with stage('line_detection'):
+        candidate_rows = local_maxima_rows(time_lag_similarity.matrix)
+        #detect the lines from the time lag similarity matrix
+        lines = detect_lines(time_lag_similarity.matrix, candidate_rows,
+                             clip_length_samples)
+        time_lag_similarity.close()
+
+    if len(lines) == 0:
+        print("No repeating segments were detected.")
+        # Create a basic label set with one segment
+        return [(0, int(song_length_sec), "intro")]
+
+    with stage('overlap_scoring'):
+        #count the overlapping lines, and sort them
+        line_scores = count_overlapping_lines(
+            lines, OVERLAP_PERCENT_MARGIN * clip_length_samples,
+            clip_length_samples)
+
+        choruses = sorted_segments(line_scores)
+
+    with stage('chorus_selection'):
+        unsorted_chorus_times = []
+        #find the start and stop times of each segment
+        for c in choruses:
+            unsorted_chorus_times.append((c[0].start / chroma_sr, c[0].end / chroma_sr))
+
+        #sort each segment chronologically
+        unsorted_chorus_times.sort(key=lambda x: x[0])
+
+        chorus_times = []
+        #get rid of segments that overlap each other
+        chorus_times.append(unsorted_chorus_times[0])
+        for i in range(1, len(unsorted_chorus_times)):
+            if (unsorted_chorus_times[i][0] - chorus_times[-1][0]) >= clip_length:
+                chorus_times.append(unsorted_chorus_times[i])
+
+        max_onset = 0
+        best_chorus = None
+        #get potential chorus segments between 10 and 30 seconds, and then use onset detection
+        #to find the best potential chorus section
+        for time in chorus_times:
+            if 10 <= (time[1] - time[0]) and (time[1] - time[0]) <= 30:
+                mean_onset = frames.mean_onset_frame(time[0], time[1])
+                if mean_onset >= max_onset:
+                    max_onset = mean_onset
+                    best_chorus = time
+
+        if best_chorus is None:
+            raise ValueError("No chorus candidate between 10 and 30 seconds was found")
+
+        #take the mfcc of the best chorus segment
+        chorus_mfcc = frames.mfcc_series(best_chorus[0], best_chorus[1])
+
+    structure_labels = [""] * len(new_labels)
+
+    with stage('dtw'):
+        #calculate the dtw similarity between each segment and the detected chorus segment
+        #also detect the minimum and maximum distance values
+        max_dist = 0
+        min_dist = 100
+        similarity_measures = []
+        euclidean_norm = lambda x, y: np.abs(x - y)
+        for x in range(len(new_boundaries)):
+            dist = fastdtw(mfccs[x], chorus_mfcc, dist=euclidean_norm)
+            similarity_measures.append(dist)
+            if dist > max_dist:
+                max_dist = dist
+            if dist < min_dist:
+                min_dist = dist
+
+    #normalize the similarity measures and sort
+    normalized = [float(i)/max(similarity_measures) for i in similarity_measures]
+    sorted_norms = sorted(normalized)
+
+    #normalize the threshold; songs with larger ranges, take a lower threshold value,
+    #whereas for songs for a higher range, take a higher threshold
+    bottom = []
+    if max_dist - min_dist <= 2:
+        bottom = sorted_norms[int(len(sorted_norms) * 0) : int(len(sorted_norms) * .5)]
+    else:
+        bottom = sorted_norms[int(len(sorted_norms) * 0) : int(len(sorted_norms) * .40)]
+
+    #if the calculated dtw similarity value for a segment is below the normalized threshold,
+    #that segment is labeled the chorus
+    for x in range(len(structure_labels)):
+        if normalized[x] <= bottom[-1]:
+            structure_labels[x] = "chorus"
+
+    #label the other segments -- repeating non chorus segments are considered verses,
+    #transitions are unique segments that appear in the middle of a song,
+    #and intros and outros are unique segments that appear at the beginning and ending
+    #of a song respectively
+    for x in range(len(structure_labels)):
+        found_match = False
+        for y in range(x + 1, len(structure_labels)):
+            if (new_labels[x] == new_labels[y]) and structure_labels[y] == ""  and structure_labels[x] == "":
+                found_match = True
+                structure_labels[x] = "verse"
+                structure_labels[y] = "verse"
+        if found_match == False and structure_labels[x] == "":
+            if x == 0:
+                structure_labels[x] = "intro"
+            elif x == (len(new_boundaries) - 1):
+                structure_labels[x] = "outro"
+            else:
+                structure_labels[x] = "transition"
+
+    segments = []
+    for e in range(len(new_boundaries)):
+        if e < len(new_boundaries) - 1:
+            segments.append((new_boundaries[e], new_boundaries[e + 1], structure_labels[e]))
+        else:
+            segments.append((new_boundaries[e], song_length_sec, structure_labels[e]))
+    return segments
+
+
+def process_audio_file(file_name, audio_directory='../audio/', labels_directory='../labels/', stage=span):
+    """Segment ./audio/<file_name> and write ./labels/<file_name>_labels.txt"""
+    print(f"Processing {file_name}...")
+    with span('segmentation.track', file=file_name):
+        segments = segment_audio_file(os.path.join(audio_directory, file_name), stage=stage)
+
+    #write the labels to a text file, to be used in Audacity
+    write_labels(os.path.join(labels_directory, file_name + "_labels.txt"), segments)
+    return True
+
+
+# Tracks longer than this (in seconds) are segmented block by block, as in the notebook
+STREAMING_MIN_SEC = 20 * 60
+
+
+def audio_duration(path):
+    """Duration of an audio file in seconds"""
+    try:
+        return librosa.get_duration(path=path)
+    except TypeError:
+        # librosa < 0.10 (the segmenter environment pins 0.9.2) only knows filename=, which 0.10 deprecated
+        return librosa.get_duration(filename=path)
+
+
+def segment_file(file_name, audio_directory, labels_directory, streaming_min_sec=STREAMING_MIN_SEC):
+    """The notebook's per-file step: streaming segmentation for long recordings, the full pipeline otherwise"""
+    duration = audio_duration(os.path.join(audio_directory, file_name))
+    if duration >= streaming_min_sec:
+        from streaming_segmentation import process_audio_file_streaming
+        return process_audio_file_streaming(file_name, audio_directory, labels_directory)
+    return process_audio_file(file_name, audio_directory, labels_directory)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Segment every audio file of a directory into Audacity labels")
+    parser.add_argument("audio_dir", nargs="?", default="../audio/")
+    parser.add_argument("--labels-dir", default="../labels/")
+    parser.add_argument("--streaming-min-sec", type=float, default=STREAMING_MIN_SEC,
+                        help="Tracks at least this long are segmented block by block")
+    parser.add_argument("--fingerprints", metavar="DB",
+                        help="Skip files this fingerprint index flags as duplicates (their labels are copied on ingest)")
+    parser.add_argument("--queue", metavar="DB", help="Claim files from a shared work queue database (multi-node runs)")
+    parser.add_argument("--queue-name", default="segmentation", help="Queue within the work queue database")
+    parser.add_argument("--lease-sec", type=float, default=600,
+                        help="Seconds a claimed file stays leased after its worker stops sending heartbeats")
+
+    args = parser.parse_args()
+
+    os.makedirs(args.labels_dir, exist_ok=True)
+    audio_files = sorted(f for f in os.listdir(args.audio_dir) if f.endswith('.mp3') or f.endswith('.wav'))
+    if args.fingerprints:
+        from fingerprint_index import duplicate_files
+
+        duplicates = duplicate_files(args.fingerprints)
+        audio_files = [f for f in audio_files if f not in duplicates]
+
+    if args.queue:
+        from work_queue import WorkQueue, run_worker
+
+        def handler(items):
+            return [item for item in items
+                    if segment_file(item, args.audio_dir, args.labels_dir, args.streaming_min_sec)]
+
+        with WorkQueue(args.queue, args.queue_name, lease_sec=args.lease_sec) as work_queue:
+            print(f"Added {work_queue.add(audio_files)} files to the {args.queue_name} queue")
+            done = run_worker(work_queue, handler)
+        print(f"Queue drained; this worker segmented {done} files")
+    else:
+        for file_name in audio_files:
+            try:
+                segment_file(file_name, args.audio_dir, args.labels_dir, args.streaming_min_sec)
+            except Exception as e:
+                print(f"Error processing {file_name}: {str(e)}")
+                continue
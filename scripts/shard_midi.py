@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Hash-shard a MIDI corpus into the 16 split folders anticipation expects.
+
+Replaces split_midi_files from notebooks/anticipation-setup.ipynb. A file
+still lands in the split named by the first hex digit of its MD5, so the
+splits (and with them valid = e, test = f) are the same as before. The
+differences:
+
+- files are hashed in 1 MB chunks on a thread pool (hashlib releases the GIL
+  for large updates), instead of read whole on one thread
+- a split entry is a hardlink to the original by default (a symlink when the
+  output is on another filesystem), not a copy; --mode manifest only writes
+  the manifest
+- <output>/shards.tsv records split, MD5, size and mtime per file. A re-run
+  only hashes files that are new or whose size/mtime changed, and removes
+  entries for files that disappeared from the input
+"""
+
+import argparse
+import errno
+import hashlib
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+SPLITS = '0123456789abcdef'
+MANIFEST_NAME = "shards.tsv"
+MODES = ['hardlink', 'symlink', 'copy', 'manifest']
+CHUNK_SIZE = 1 << 20
+CHECKPOINT_EVERY = 10000
+
+
+def file_md5(path, chunk_size=CHUNK_SIZE):
+    """MD5 hex digest of a file, read in chunks"""
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_manifest(manifest_path):
+    """filename -> (split, md5, size, mtime_ns)"""
+    entries = {}
+    if not os.path.exists(manifest_path):
+        return entries
+    with open(manifest_path) as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if line.startswith("#") or len(fields) != 5:
+                continue  # header, or a torn line from an interrupted run
+            split, md5, size, mtime_ns, filename = fields
+            entries[filename] = (split, md5, int(size), int(mtime_ns))
+    return entries
+
+
+def write_manifest(manifest_path, entries):
+    with open(manifest_path + ".tmp", 'w') as f:
+        f.write("# split\tmd5\tsize\tmtime_ns\tfilename\n")
+        for filename in sorted(entries):
+            split, md5, size, mtime_ns = entries[filename]
+            f.write(f"{split}\t{md5}\t{size}\t{mtime_ns}\t{filename}\n")
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def place_file(source, destination, mode):
+    """Put source at destination without copying where possible; returns the mode actually used"""
+    if os.path.lexists(destination):
+        os.remove(destination)
+    if mode == 'hardlink':
+        try:
+            os.link(source, destination)
+            return mode
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            mode = 'symlink'  # different filesystem, or links not allowed
+    if mode == 'symlink':
+        os.symlink(os.path.abspath(source), destination)
+    elif mode == 'copy':
+        shutil.copy2(source, destination)
+    return mode
+
+
+def remove_entry(output_folder, filename, split):
+    path = os.path.join(output_folder, split, filename)
+    if os.path.lexists(path):
+        os.remove(path)
+
+
+def split_midi_files(input_folder, output_folder, mode='hardlink', workers=None, rehash=False):
+    """Shard every .mid/.midi in input_folder into output_folder/<first MD5 hex digit>/"""
+    os.makedirs(output_folder, exist_ok=True)
+    if mode != 'manifest':
+        for split in SPLITS:
+            os.makedirs(os.path.join(output_folder, split), exist_ok=True)
+
+    manifest_path = os.path.join(output_folder, MANIFEST_NAME)
+    entries = read_manifest(manifest_path)
+
+    # Only files that are new or changed since the last run need hashing
+    to_hash = []
+    missing = []
+    current = set()
+    with os.scandir(input_folder) as scan:
+        for entry in scan:
+            if not entry.name.endswith(('.mid', '.midi')) or not entry.is_file():
+                continue
+            current.add(entry.name)
+            stat = entry.stat()
+            known = entries.get(entry.name)
+            if rehash or known is None or known[2:] != (stat.st_size, stat.st_mtime_ns):
+                to_hash.append((entry.name, stat.st_size, stat.st_mtime_ns))
+            elif mode != 'manifest' and not os.path.lexists(os.path.join(output_folder, known[0], entry.name)):
+                missing.append(entry.name)  # unchanged, but its split entry was deleted
+
+    removed = [filename for filename in entries if filename not in current]
+    for filename in removed:
+        if mode != 'manifest':
+            remove_entry(output_folder, filename, entries[filename][0])
+        del entries[filename]
+
+    print(f"Found {len(current)} MIDI files: {len(to_hash)} to hash, {len(removed)} removed since the last run")
+
+    placed = {}
+    for filename in missing:
+        used = place_file(os.path.join(input_folder, filename),
+                          os.path.join(output_folder, entries[filename][0], filename), mode)
+        placed[used] = placed.get(used, 0) + 1
+    with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) * 2)) as executor:
+        for start in range(0, len(to_hash), CHECKPOINT_EVERY):
+            batch = to_hash[start:start + CHECKPOINT_EVERY]
+            hashes = executor.map(lambda item: file_md5(os.path.join(input_folder, item[0])), batch)
+            for (filename, size, mtime_ns), md5 in zip(batch, hashes):
+                split = md5[0]
+                previous = entries.get(filename)
+                if mode != 'manifest':
+                    if previous is not None and previous[0] != split:
+                        remove_entry(output_folder, filename, previous[0])
+                    used = place_file(os.path.join(input_folder, filename),
+                                      os.path.join(output_folder, split, filename), mode)
+                    placed[used] = placed.get(used, 0) + 1
+                entries[filename] = (split, md5, size, mtime_ns)
+            # Checkpoint so an interrupted run does not have to rehash what it finished
+            write_manifest(manifest_path, entries)
+            print(f"Hashed {start + len(batch)}/{len(to_hash)} files")
+
+    write_manifest(manifest_path, entries)
+
+    per_split = {split: 0 for split in SPLITS}
+    for split, _, _, _ in entries.values():
+        per_split[split] += 1
+    print(f"Files have been split into subfolders in {output_folder}")
+    if placed:
+        print("Placed: " + ", ".join(f"{count} {used}" for used, count in sorted(placed.items())))
+    print("Per split: " + " ".join(f"{split}:{count}" for split, count in per_split.items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shard MIDI files into 16 folders by the first hex digit of their MD5")
+    parser.add_argument("input_folder", help="Folder containing the .mid/.midi files")
+    parser.add_argument("output_folder", help="Folder that receives the 0-f split folders and the manifest")
+    parser.add_argument("--mode", choices=MODES, default='hardlink',
+                        help="How files are placed in the splits (hardlink falls back to symlink across filesystems)")
+    parser.add_argument("--workers", type=int, default=None, help="Hashing threads")
+    parser.add_argument("--rehash", action="store_true", help="Hash every file again, even if unchanged")
+
+    args = parser.parse_args()
+
+    split_midi_files(args.input_folder, args.output_folder, mode=args.mode, workers=args.workers,
+                     rehash=args.rehash)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Multi-resolution tile pyramids of STFT and CQT magnitudes for zoomable review.
+
+A full-track figure from compare_fft_cqt.py is large and slow, and zooming
+means recomputing it. Here each track's dB magnitudes (taken from the
+compare_fft_cqt.py transform cache, computed on a miss) are stored once per
+zoom level:
+
+- level 0 has one column per hop
+- level k max-pools 2**k columns into one, so onsets and transients stay
+  visible when zoomed out
+- the levels stop once a single tile covers the whole track
+
+Each level is one .npy of shape (tiles, bins, TILE_FRAMES), either uint8
+(-80..0 dB quantized to 0..255) or float16 dB. np.load memory-maps it, so
+fetching a window only touches the tiles it overlaps:
+
+    <tiles_dir>/<track>/<kind>/level-<k>.npy
+    <tiles_dir>/<track>/<kind>/meta.json
+
+SpectrogramPyramid.tiles returns the tiles for a time window at a given
+level, and .window stitches them at the finest level that fits a column
+budget, e.g. a few seconds around a label boundary.
+"""
+
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+
+TILE_FRAMES = 256
+TOP_DB = 80.0  # librosa.amplitude_to_db's default dynamic range
+FORMATS = ('uint8', 'float16')
+
+
+def quantize(S_db, fmt):
+    """dB (<= 0, relative to the track maximum) to the storage format"""
+    if fmt == 'float16':
+        return S_db.astype(np.float16)
+    scaled = (np.clip(S_db, -TOP_DB, 0.0) + TOP_DB) * (255.0 / TOP_DB)
+    return np.round(scaled).astype(np.uint8)
+
+
+def dequantize(tiles, fmt):
+    """Stored values back to dB as float32"""
+    if fmt == 'float16':
+        return tiles.astype(np.float32)
+    return tiles.astype(np.float32) * (TOP_DB / 255.0) - TOP_DB
+
+
+def pool_columns(S, factor=2):
+    """Max over groups of `factor` columns; a short last group is pooled on its own"""
+    n = S.shape[1]
+    full = n - n % factor
+    pooled = S[:, :full].reshape(S.shape[0], -1, factor).max(axis=2)
+    if full < n:
+        pooled = np.concatenate([pooled, S[:, full:].max(axis=1, keepdims=True)], axis=1)
+    return pooled
+
+
+def to_tiles(S, fill):
+    """(bins, frames) -> (tiles, bins, TILE_FRAMES), padding the last tile with `fill`"""
+    bins, frames = S.shape
+    n_tiles = max(1, -(-frames // TILE_FRAMES))
+    padded = np.full((bins, n_tiles * TILE_FRAMES), fill, dtype=S.dtype)
+    padded[:, :frames] = S
+    return np.ascontiguousarray(padded.reshape(bins, n_tiles, TILE_FRAMES).transpose(1, 0, 2))
+
+
+def build_pyramid(S_db, directory, sr, hop_length, fmt='uint8'):
+    """Write every zoom level of one transform and its meta.json to directory"""
+    os.makedirs(directory, exist_ok=True)
+    fill = quantize(np.full((1, 1), -TOP_DB, dtype=np.float32), fmt)[0, 0]
+    level_data = quantize(S_db, fmt)
+    frames = [S_db.shape[1]]
+    level = 0
+    while True:
+        np.save(os.path.join(directory, f"level-{level}.npy"), to_tiles(level_data, fill))
+        if level_data.shape[1] <= TILE_FRAMES:
+            break
+        # Pooling the quantized values is exact: quantization is monotonic
+        level_data = pool_columns(level_data)
+        frames.append(level_data.shape[1])
+        level += 1
+
+    meta = {'sr': sr, 'hop_length': hop_length, 'bins': S_db.shape[0], 'frames': frames,
+            'tile_frames': TILE_FRAMES, 'format': fmt}
+    with open(os.path.join(directory, "meta.json"), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+
+class SpectrogramPyramid:
+    """Read side of one transform's pyramid"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        self.sr = meta['sr']
+        self.hop_length = meta['hop_length']
+        self.bins = meta['bins']
+        self.frames = meta['frames']
+        self.format = meta['format']
+        self._levels = {}
+
+    @property
+    def levels(self):
+        return len(self.frames)
+
+    @property
+    def duration(self):
+        return self.frames[0] * self.hop_length / self.sr
+
+    def seconds_per_column(self, level):
+        return self.hop_length * 2 ** level / self.sr
+
+    def level_array(self, level):
+        if level not in self._levels:
+            self._levels[level] = np.load(os.path.join(self.directory, f"level-{level}.npy"), mmap_mode='r')
+        return self._levels[level]
+
+    def tiles(self, start_sec, end_sec, level):
+        """[(tile start in seconds, stored tile)] covering [start_sec, end_sec) at a zoom level"""
+        tile_sec = TILE_FRAMES * self.seconds_per_column(level)
+        data = self.level_array(level)
+        first = max(0, int(start_sec // tile_sec))
+        last = min(data.shape[0] - 1, int(max(start_sec, end_sec - 1e-9) // tile_sec))
+        return [(i * tile_sec, data[i]) for i in range(first, last + 1)]
+
+    def level_for(self, start_sec, end_sec, max_columns):
+        """Finest level at which the window fits in max_columns columns"""
+        for level in range(self.levels):
+            if (end_sec - start_sec) / self.seconds_per_column(level) <= max_columns:
+                return level
+        return self.levels - 1
+
+    def window(self, start_sec, end_sec, max_columns=1024, level=None, db=True):
+        """(bins, columns) array for the window, plus the level and its seconds per column"""
+        level = self.level_for(start_sec, end_sec, max_columns) if level is None else level
+        column_sec = self.seconds_per_column(level)
+        tiles = self.tiles(start_sec, end_sec, level)
+        if not tiles:
+            return np.zeros((self.bins, 0), dtype=np.float32 if db else self.format), level, column_sec
+        stitched = np.concatenate([tile for _, tile in tiles], axis=1)
+        offset = int(round(tiles[0][0] / column_sec))
+        first = max(0, int(start_sec / column_sec) - offset)
+        stop = min(self.frames[level], int(np.ceil(end_sec / column_sec))) - offset
+        S = stitched[:, first:max(first, stop)]
+        return (dequantize(S, self.format) if db else np.array(S)), level, column_sec
+
+
+def open_pyramid(tiles_dir, track, kind):
+    return SpectrogramPyramid(os.path.join(tiles_dir, track, kind))
+
+
+def build_track(audio_path, tiles_dir, cache_dir, all_params, fmt='uint8'):
+    """Build the STFT and CQT pyramids for one audio file from the transform cache"""
+    # librosa and matplotlib are only needed to build pyramids, not to read them
+    from compare_fft_cqt import load_transforms
+
+    transforms = load_transforms(audio_path, cache_dir, all_params)
+    track_dir = Path(tiles_dir) / Path(audio_path).stem
+    for params in all_params:
+        build_pyramid(transforms[params['kind']], track_dir / params['kind'], params['sr'],
+                      params['hop_length'], fmt)
+    return track_dir
+
+
+def build_all(input_path, tiles_dir, cache_dir, workers=None, fmt='uint8', overwrite=False):
+    """Build pyramids for every audio file in input_path on a process pool"""
+    from compare_fft_cqt import TRANSFORMS, find_audio_files, transform_params
+
+    all_params = [transform_params(kind) for kind in TRANSFORMS]
+    audio_files = find_audio_files(input_path)
+    if not overwrite:
+        audio_files = [f for f in audio_files
+                       if not all((Path(tiles_dir) / f.stem / kind / "meta.json").exists() for kind in TRANSFORMS)]
+    print(f"Building tile pyramids for {len(audio_files)} files")
+
+    successful = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(build_track, f, tiles_dir, cache_dir, all_params, fmt): f for f in audio_files}
+        for future in as_completed(futures):
+            try:
+                print(f"Built: {future.result()}")
+                successful += 1
+            except Exception as e:
+                print(f"Error building tiles for {futures[future].name}: {str(e)}")
+    print(f"\nBuilt: {successful} files")
+    print(f"Failed: {len(audio_files) - successful} files")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build STFT/CQT tile pyramids for a directory of audio")
+    parser.add_argument("input_path", help="Audio file or directory of audio files")
+    parser.add_argument("tiles_dir", help="Directory for the per-track pyramids")
+    parser.add_argument("--cache-dir", default=None, help="compare_fft_cqt.py transform cache (default: <tiles_dir>/.cache)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--format", choices=FORMATS, default='uint8', help="Stored value type")
+    parser.add_argument("--overwrite", action="store_true", help="Rebuild pyramids that already exist")
+
+    args = parser.parse_args()
+
+    build_all(args.input_path, args.tiles_dir, args.cache_dir or os.path.join(args.tiles_dir, ".cache"),
+              workers=args.workers, fmt=args.format, overwrite=args.overwrite)
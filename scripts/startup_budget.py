@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Check that the pipeline's command-line scripts start quickly.
+
+Each script is imported in a fresh interpreter (`python -X importtime -c
+"import <module>"`, run from this directory), which is what `--help`, a dry
+run or a TUI launch pays before the script does anything. The wall time
+includes interpreter startup and is the median of --repeat runs. The slowest
+direct imports from -X importtime are listed for each script, and the exit
+status is 1 when any script is over its budget, so this can run in CI or a
+pre-commit hook:
+
+    python startup_budget.py
+    python startup_budget.py --budget checks.py=0.3 --repeat 5
+
+Scripts whose whole job is running a model (audio_to_midi.py,
+transcription.py, audio_pipeline.py) are left out: they load TensorFlow or
+torch either way.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Seconds of cold start allowed per script
+BUDGETS = {
+    'checks.py': 0.6,
+    'compare_fft_cqt.py': 0.5,
+    'export_batch.py': 0.6,
+    'fingerprint_index.py': 0.5,
+    'instrumentation.py': 0.3,
+    'label_store.py': 0.3,
+    'orchestrator.py': 0.3,
+    'shard_midi.py': 0.3,
+    'spectrogram_tiles.py': 0.5,
+    'stem_activity.py': 0.5,
+    'stem_separation.py': 0.5,
+    'token_loader.py': 0.5,
+    'token_shards.py': 0.5,
+    'tokenize_splits.py': 0.5,
+    'work_queue.py': 0.3,
+}
+
+
+def parse_importtime(stderr):
+    """[(cumulative seconds, module)] for the imports made directly by the script's module"""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Each nesting level indents the name by two more spaces; the script's module itself is at one
+        if len(name) - len(name.lstrip()) == 3:
+            imports.append((int(cumulative) / 1e6, name.strip()))
+    return imports
+
+
+def measure(script, python=sys.executable, repeat=3):
+    """Median wall seconds to import the script in a new interpreter, plus its slowest direct imports"""
+    module = os.path.splitext(script)[0]
+    # Tracing must stay off, and the scripts import each other from this directory
+    env = {key: value for key, value in os.environ.items() if not key.startswith("PIPELINE_")}
+    seconds = []
+    imports = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([python, "-X", "importtime", "-c", f"import {module}"], cwd=SCRIPTS_DIR, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        seconds.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}"
+            raise RuntimeError(error)
+        imports = parse_importtime(result.stderr)
+    top = sorted(imports, reverse=True)[:5]
+    return statistics.median(seconds), top
+
+
+def check_budgets(budgets, python=sys.executable, repeat=3):
+    """Measure every script; returns the names of those over budget (or failing to import)"""
+    over = []
+    print(f"{'script':<24} {'seconds':>8} {'budget':>8}  slowest imports")
+    for script, budget in sorted(budgets.items()):
+        try:
+            seconds, top = measure(script, python, repeat)
+        except RuntimeError as e:
+            print(f"{script:<24} {'error':>8} {budget:>8.2f}  {e}")
+            over.append(script)
+            continue
+        status = "" if seconds <= budget else "  OVER BUDGET"
+        slowest = ", ".join(f"{name} {cumulative:.2f}s" for cumulative, name in top[:3])
+        print(f"{script:<24} {seconds:>8.2f} {budget:>8.2f}  {slowest}{status}")
+        if seconds > budget:
+            over.append(script)
+    return over
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fail when a pipeline script's cold start exceeds its budget")
+    parser.add_argument("scripts", nargs="*", help="Scripts to check (default: all in BUDGETS)")
+    parser.add_argument("--budget", action="append", default=[], metavar="SCRIPT=SECONDS",
+                        help="Override or add a budget; repeatable")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per script; the median is compared")
+    parser.add_argument("--python", default=sys.executable, help="Interpreter of the environment to check")
+
+    args = parser.parse_args()
+
+    budgets = dict(BUDGETS)
+    for item in args.budget:
+        script, seconds = item.split("=", 1)
+        budgets[script] = float(seconds)
+    if args.scripts:
+        unknown = [script for script in args.scripts if script not in budgets]
+        if unknown:
+            parser.error(f"no budget for {', '.join(unknown)}; pass --budget SCRIPT=SECONDS")
+        budgets = {script: budgets[script] for script in args.scripts}
+
+    over = check_budgets(budgets, args.python, args.repeat)
+    if over:
+        print(f"\n{len(over)} over budget: {', '.join(over)}")
+        sys.exit(1)
+    print("\nAll within budget")
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Find separated stems that are silent or close to it.
+
+htdemucs_6s always produces guitar and piano stems, and on a lot of tracks
+they hold nothing but faint bleed from the other sources. Each stem is cut
+into short frames and a frame counts as active when its RMS level is above
+silence_db (dBFS). A stem with fewer than min_active_sec seconds of active
+frames is marked silent.
+
+Results are kept per track next to the stems:
+
+    <stems_dir>/<track>/activity.json
+    {"thresholds": {"silence_db": -50.0, "min_active_sec": 2.0},
+     "stems": {"guitar": {"peak_db": -61.2, "active_sec": 0.0, "active_ratio": 0.0, "silent": true}, ...}}
+
+The separators skip storing (and, in process, encoding) silent stems, and
+audio_to_midi.py skips decoding and transcribing them. Run this file to build
+the manifests for stems that were separated earlier, and optionally delete
+the silent MP3s with --prune.
+"""
+
+import argparse
+import glob
+import json
+import os
+from collections import Counter
+
+import numpy as np
+
+MANIFEST_NAME = "activity.json"
+FRAME_SEC = 0.05
+DEFAULT_THRESHOLDS = {'silence_db': -50.0, 'min_active_sec': 2.0}
+
+
+def frame_levels_db(y, sr, frame_sec=FRAME_SEC):
+    """RMS level in dBFS of consecutive frames of mono or (channels, samples) audio"""
+    y = np.asarray(y, dtype=np.float32)
+    if y.ndim > 1:
+        y = y.mean(axis=0)
+    frame_length = max(1, int(sr * frame_sec))
+    n_frames = -(-len(y) // frame_length)
+    padded = np.zeros(n_frames * frame_length, dtype=np.float32)
+    padded[:len(y)] = y
+    rms = np.sqrt(np.mean(padded.reshape(n_frames, frame_length) ** 2, axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+
+def stem_activity(y, sr, silence_db=DEFAULT_THRESHOLDS['silence_db'],
+                  min_active_sec=DEFAULT_THRESHOLDS['min_active_sec']):
+    """Activity statistics for one stem, and whether it counts as silent"""
+    levels = frame_levels_db(y, sr)
+    if not len(levels):
+        return {'peak_db': -200.0, 'active_sec': 0.0, 'active_ratio': 0.0, 'silent': True}
+    active = int(np.count_nonzero(levels > silence_db))
+    active_sec = active * max(1, int(sr * FRAME_SEC)) / sr
+    return {'peak_db': round(float(levels.max()), 1), 'active_sec': round(active_sec, 2),
+            'active_ratio': round(active / len(levels), 4), 'silent': active_sec < min_active_sec}
+
+
+def analyze_stems(stems, sr, **thresholds):
+    """{stem: activity} for {stem: waveform} at one sample rate"""
+    thresholds = {**DEFAULT_THRESHOLDS, **thresholds}
+    return {name: stem_activity(np.asarray(y), sr, **thresholds) for name, y in stems.items()}
+
+
+def read_manifest(track_dir):
+    """The track's activity manifest, or None"""
+    path = os.path.join(track_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(track_dir, activity, **thresholds):
+    """Write the activity manifest atomically"""
+    os.makedirs(track_dir, exist_ok=True)
+    path = os.path.join(track_dir, MANIFEST_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'thresholds': {**DEFAULT_THRESHOLDS, **thresholds}, 'stems': activity}, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def known_silence(manifest, stem, **thresholds):
+    """True/False when the manifest answers for these thresholds, None when the stem must be analyzed"""
+    thresholds = {**DEFAULT_THRESHOLDS, **thresholds}
+    if manifest is None or stem not in manifest['stems']:
+        return None
+    # active_sec was counted at the manifest's silence_db; only min_active_sec can change without re-analysis
+    if manifest['thresholds']['silence_db'] != thresholds['silence_db']:
+        return None
+    return manifest['stems'][stem]['active_sec'] < thresholds['min_active_sec']
+
+
+def silent_stems(track_dir, **thresholds):
+    """Stems the track's manifest marks silent"""
+    manifest = read_manifest(track_dir)
+    if manifest is None:
+        return set()
+    return {stem for stem in manifest['stems'] if known_silence(manifest, stem, **thresholds)}
+
+
+def analyze_track(track_dir, overwrite=False, prune=False, **thresholds):
+    """Add the track's MP3 stems to its manifest (decoding only the new ones); returns the silent stems"""
+    import librosa
+
+    thresholds = {**DEFAULT_THRESHOLDS, **thresholds}
+    manifest = None if overwrite else read_manifest(track_dir)
+    if manifest is not None and manifest['thresholds']['silence_db'] != thresholds['silence_db']:
+        manifest = None
+    activity = dict(manifest['stems']) if manifest else {}
+
+    for mp3_file in sorted(glob.glob(os.path.join(track_dir, '*.mp3'))):
+        stem = os.path.splitext(os.path.basename(mp3_file))[0]
+        if stem not in activity:
+            y, sr = librosa.load(mp3_file, sr=22050, mono=True)
+            activity[stem] = stem_activity(y, sr, **thresholds)
+        activity[stem]['silent'] = activity[stem]['active_sec'] < thresholds['min_active_sec']
+    write_manifest(track_dir, activity, **thresholds)
+
+    silent = {stem for stem, entry in activity.items() if entry['silent']}
+    if prune:
+        for stem in silent:
+            path = os.path.join(track_dir, f"{stem}.mp3")
+            if os.path.exists(path):
+                os.remove(path)
+    return silent
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mark silent stems in every track folder of a stems directory")
+    parser.add_argument("stems_dir", help="Directory with one folder of stems per track")
+    parser.add_argument("--silence-db", type=float, default=DEFAULT_THRESHOLDS['silence_db'],
+                        help="Frames quieter than this (dBFS RMS) are inactive")
+    parser.add_argument("--min-active-sec", type=float, default=DEFAULT_THRESHOLDS['min_active_sec'],
+                        help="Stems with fewer active seconds than this are silent")
+    parser.add_argument("--overwrite", action="store_true", help="Re-analyze stems already in a manifest")
+    parser.add_argument("--prune", action="store_true", help="Delete the MP3s of silent stems")
+
+    args = parser.parse_args()
+
+    track_dirs = sorted(d for d in glob.glob(os.path.join(args.stems_dir, '*')) if os.path.isdir(d))
+    print(f"Found {len(track_dirs)} tracks")
+    silent_counts = Counter()
+    stem_counts = Counter()
+    for track_dir in track_dirs:
+        try:
+            silent = analyze_track(track_dir, overwrite=args.overwrite, prune=args.prune,
+                                   silence_db=args.silence_db, min_active_sec=args.min_active_sec)
+        except Exception as e:
+            print(f"Error analyzing {os.path.basename(track_dir)}: {str(e)}")
+            continue
+        silent_counts.update(silent)
+        stem_counts.update(read_manifest(track_dir)['stems'])
+        if silent:
+            print(f"{os.path.basename(track_dir)}: silent {', '.join(sorted(silent))}")
+
+    print("\nSilent stems:")
+    for stem, total in sorted(stem_counts.items()):
+        print(f"  {stem}: {silent_counts[stem]}/{total}")
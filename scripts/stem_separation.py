@@ -10,9 +10,11 @@ import sys
 from typing import Dict, Tuple, Optional, IO
 import os
 import time
-import torch
 from tqdm import tqdm
 
+from instrumentation import count, span
+from stem_activity import DEFAULT_THRESHOLDS, analyze_stems, stem_activity, write_manifest
+
 class BatchStemSeparator:
     def __init__(self, input_path: str, output_path: str, batch_size: int = 5):
         self.input_path = Path(input_path)
@@ -23,9 +25,14 @@ class BatchStemSeparator:
         self.mp3_rate = 320
         self.float32 = False
         self.int24 = False
+        # Stems below these activity thresholds are recorded as silent and not stored (None keeps every stem)
+        self.silence_thresholds = dict(DEFAULT_THRESHOLDS)
         
-        # Progress tracking file
+        # Progress tracking file (not written when a shared work queue tracks progress instead)
         self.progress_file = self.output_path / "progress.json"
+        self.track_progress = True
+        # Files not to separate, e.g. duplicates flagged by fingerprint_index.py
+        self.skip_files = set()
         self.processed_files = self.load_progress()
         
         # Create output directory if it doesn't exist
@@ -40,6 +47,8 @@ class BatchStemSeparator:
 
     def save_progress(self):
         """Save the current progress."""
+        if not self.track_progress:
+            return
         with open(self.progress_file, 'w') as f:
             json.dump(list(self.processed_files), f)
 
@@ -48,7 +57,7 @@ class BatchStemSeparator:
         files = []
         for file in in_path.iterdir():
             if (file.suffix.lower().lstrip(".") in self.extensions and 
-                file.name not in self.processed_files):
+                file.name not in self.processed_files and file.name not in self.skip_files):
                 files.append(file)
         return files
 
@@ -81,6 +90,9 @@ class BatchStemSeparator:
 
     def separate_batch(self, model_name: str, temp_output: Path, files: list) -> bool:
         """Run separation for a batch of files."""
+        # torch is only needed for the MPS check; importing it at module level slowed every --help
+        import torch
+
         cmd = ["python3", "-m", "demucs.separate", 
                "-o", str(temp_output), 
                "-n", model_name,
@@ -101,9 +113,10 @@ class BatchStemSeparator:
         print('\n'.join(file_paths))
         
         try:
-            p = sp.Popen(cmd + file_paths, stdout=sp.PIPE, stderr=sp.PIPE)
-            self._copy_process_streams(p)
-            p.wait()
+            with span('separation.batch', model=model_name, files=len(file_paths)):
+                p = sp.Popen(cmd + file_paths, stdout=sp.PIPE, stderr=sp.PIPE)
+                self._copy_process_streams(p)
+                p.wait()
             return p.returncode == 0
         except Exception as e:
             print(f"Error processing batch: {e}")
@@ -122,46 +135,68 @@ class BatchStemSeparator:
             output_dir = self.output_path / filename
             output_dir.mkdir(parents=True, exist_ok=True)
 
-            # Copy stems from htdemucs_ft
-            for stem in ['bass', 'drums', 'vocals']:
-                stem_path = model_output_ft / f"{stem}.mp3"
-                if stem_path.exists():
+            activity = {}
+            for model_output, stems in [(model_output_ft, STEM_SOURCES["htdemucs_ft"]),
+                                        (model_output_6s, STEM_SOURCES["htdemucs_6s"])]:
+                for stem in stems:
+                    stem_path = model_output / f"{stem}.mp3"
+                    if not stem_path.exists():
+                        continue
+                    if self.silence_thresholds is not None:
+                        activity[stem] = self.stem_file_activity(stem_path)
+                        if activity[stem]['silent']:
+                            continue
                     shutil.copy2(stem_path, output_dir / f"{stem}.mp3")
 
-            # Copy stems from htdemucs_6s
-            for stem in ['other', 'guitar', 'piano']:
-                stem_path = model_output_6s / f"{stem}.mp3"
-                if stem_path.exists():
-                    shutil.copy2(stem_path, output_dir / f"{stem}.mp3")
+            if self.silence_thresholds is not None:
+                write_manifest(output_dir, activity, **self.silence_thresholds)
+                silent = sorted(stem for stem, entry in activity.items() if entry['silent'])
+                if silent:
+                    print(f"Skipped silent stems for {filename}: {', '.join(silent)}")
+                    count('separation.silent_stems', len(silent))
 
             return True
         except Exception as e:
             print(f"Error organizing stems for {filename}: {e}")
             return False
 
-    def process_batch(self, batch: list, temp_dir: Path):
-        """Process a batch of files through both models."""
+    def stem_file_activity(self, stem_path: Path) -> dict:
+        """Decode a separated MP3 as mono and measure its activity"""
+        from demucs.audio import AudioFile
+
+        samplerate = 22050
+        with span('separation.activity', stem=stem_path.stem):
+            y = AudioFile(stem_path).read(streams=0, samplerate=samplerate, channels=1)
+        return stem_activity(y.numpy(), samplerate, **self.silence_thresholds)
+
+    def process_batch(self, batch: list, temp_dir: Path) -> list:
+        """Process a batch of files through both models; returns the names of the files whose stems were stored."""
         print(f"\nProcessing batch of {len(batch)} files...")
         
         # Process with first model
         if not self.separate_batch("htdemucs_ft", temp_dir, batch):
             print("Failed to process batch with htdemucs_ft")
-            return False
+            return []
 
         # Process with second model
         if not self.separate_batch("htdemucs_6s", temp_dir, batch):
             print("Failed to process batch with htdemucs_6s")
-            return False
+            return []
 
         # Organize stems for each file in the batch
+        organized_files = []
         for file in batch:
-            if self.organize_stems_for_file(temp_dir, file.stem):
+            with span('separation.organize', file=file.name):
+                organized = self.organize_stems_for_file(temp_dir, file.stem)
+            if organized:
                 self.processed_files.add(file.name)
                 self.save_progress()
+                count('separation.files')
+                organized_files.append(file.name)
             else:
                 print(f"Failed to organize stems for {file.name}")
 
-        return True
+        return organized_files
 
     def process(self):
         """Run the complete separation and organization process."""
@@ -193,6 +228,119 @@ class BatchStemSeparator:
         print("\nProcessing complete!")
         print(f"Successfully processed {len(self.processed_files)} files")
 
+    def process_queue(self, work_queue):
+        """Separate the files claimed from a shared work queue (see work_queue.py) until it is drained.
+
+        Several nodes can run this against the same input and output directories:
+        the queue hands each file to one worker at a time, and progress.json is
+        left alone.
+        """
+        from work_queue import run_worker
+
+        self.track_progress = False
+        added = work_queue.add(sorted(f.name for f in self.find_files(self.input_path)))
+        print(f"Added {added} files to the {work_queue.queue} queue")
+
+        # One temp directory per worker, so nodes sharing a working directory don't collide
+        temp_dir = Path(f"temp_separation_{work_queue.worker_id.replace(':', '_')}")
+
+        def handler(names):
+            temp_dir.mkdir(exist_ok=True)
+            try:
+                return self.process_batch([self.input_path / name for name in names], temp_dir)
+            finally:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+
+        done = run_worker(work_queue, handler, batch_size=self.batch_size)
+        print(f"\nQueue drained; this worker separated {done} files")
+
+# Stems kept from each model, as organize_stems_for_file picks them
+STEM_SOURCES = {
+    "htdemucs_ft": ['bass', 'drums', 'vocals'],
+    "htdemucs_6s": ['other', 'guitar', 'piano'],
+}
+
+
+class InMemoryStemSeparator:
+    """Runs both Demucs models in-process and returns stem waveforms instead of MP3 files.
+
+    The mix is decoded once and shared by both models. Writing MP3 stems is optional
+    (save_stems), so transcription can work from the float waveforms directly.
+    """
+
+    def __init__(self, device: Optional[str] = None, shifts: int = 1, overlap: float = 0.25):
+        import torch
+        from demucs.pretrained import get_model
+
+        if device is None:
+            if torch.backends.mps.is_available():
+                device = "mps"
+            elif torch.cuda.is_available():
+                device = "cuda"
+            else:
+                device = "cpu"
+        self.device = device
+        self.shifts = shifts
+        self.overlap = overlap
+        self.models = {}
+        for model_name in STEM_SOURCES:
+            model = get_model(model_name)
+            model.cpu()
+            model.eval()
+            self.models[model_name] = model
+        first = next(iter(self.models.values()))
+        self.samplerate = first.samplerate
+        self.audio_channels = first.audio_channels
+
+    def separate(self, audio_path: Path) -> Dict[str, "torch.Tensor"]:
+        """Separate one file; returns {stem: (channels, samples) tensor at self.samplerate}"""
+        import torch
+        from demucs.apply import apply_model
+        from demucs.separate import load_track
+
+        with span('separation.load', file=Path(audio_path).name):
+            wav = load_track(Path(audio_path), self.audio_channels, self.samplerate)
+        ref = wav.mean(0)
+        wav = (wav - ref.mean()) / ref.std()
+
+        stems = {}
+        with torch.no_grad():
+            for model_name, model in self.models.items():
+                with span('separation.model', model=model_name):
+                    sources = apply_model(model, wav[None], device=self.device, shifts=self.shifts,
+                                          split=True, overlap=self.overlap, progress=False)[0]
+                sources = sources * ref.std() + ref.mean()
+                for source, name in zip(sources, model.sources):
+                    if name in STEM_SOURCES[model_name]:
+                        stems[name] = source.cpu()
+        return stems
+
+    def analyze(self, stems: Dict[str, "torch.Tensor"], **thresholds) -> dict:
+        """{stem: activity} for separated stems; see stem_activity.py"""
+        with span('separation.activity'):
+            return analyze_stems({name: source.numpy() for name, source in stems.items()}, self.samplerate,
+                                 **thresholds)
+
+    def save_stems(self, stems: Dict[str, "torch.Tensor"], output_dir: Path, bitrate: int = 320,
+                   activity: Optional[dict] = None, skip_silent: bool = True, **thresholds):
+        """Write stems as <output_dir>/<stem>.mp3, the layout BatchStemSeparator produces
+
+        Silent stems are not encoded; the activity manifest records them.
+        """
+        from demucs.audio import save_audio
+
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        if skip_silent:
+            activity = activity if activity is not None else self.analyze(stems, **thresholds)
+            write_manifest(output_dir, activity, **thresholds)
+        for name, source in stems.items():
+            if skip_silent and activity[name]['silent']:
+                continue
+            with span('separation.encode', stem=name):
+                save_audio(source, str(output_dir / f"{name}.mp3"), samplerate=self.samplerate, bitrate=bitrate)
+
+
 if __name__ == "__main__":
     import argparse
     
@@ -201,8 +349,33 @@ if __name__ == "__main__":
     parser.add_argument("output_path", help="Directory for output stems")
     parser.add_argument("--batch-size", type=int, default=5, 
                       help="Number of files to process in each batch")
+    parser.add_argument("--silence-db", type=float, default=DEFAULT_THRESHOLDS['silence_db'],
+                      help="Frames quieter than this (dBFS RMS) count as inactive")
+    parser.add_argument("--min-active-sec", type=float, default=DEFAULT_THRESHOLDS['min_active_sec'],
+                      help="Stems with less activity than this are not stored")
+    parser.add_argument("--keep-silent", action="store_true",
+                      help="Store every stem, without activity analysis")
+    parser.add_argument("--fingerprints", metavar="DB",
+                      help="Skip files this fingerprint index flags as duplicates (their stems are copied on ingest)")
+    parser.add_argument("--queue", metavar="DB",
+                      help="Claim files from a shared work queue database instead of progress.json (multi-node runs)")
+    parser.add_argument("--queue-name", default="separation", help="Queue within the work queue database")
+    parser.add_argument("--lease-sec", type=float, default=600,
+                      help="Seconds a claimed batch stays leased after its worker stops sending heartbeats")
     
     args = parser.parse_args()
     
     separator = BatchStemSeparator(args.input_path, args.output_path, args.batch_size)
-    separator.process()
\ No newline at end of file
+    separator.silence_thresholds = None if args.keep_silent else {
+        'silence_db': args.silence_db, 'min_active_sec': args.min_active_sec}
+    if args.fingerprints:
+        from fingerprint_index import duplicate_files
+
+        separator.skip_files = duplicate_files(args.fingerprints)
+    if args.queue:
+        from work_queue import WorkQueue
+
+        with WorkQueue(args.queue, args.queue_name, lease_sec=args.lease_sec) as work_queue:
+            separator.process_queue(work_queue)
+    else:
+        separator.process()
\ No newline at end of file
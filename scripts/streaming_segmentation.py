@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Streaming, block-wise segmentation for hour-long mixes and live recordings.
+
+process_audio_file (scripts/segmentation.py) loads the whole song, computes
+chroma/MFCCs on the full array and slices the waveform again for every segment.
+Here the audio is read in blocks with librosa.stream, and one STFT per block
+gives chroma, MFCC and onset-strength frames. Only the frame features are kept,
+and only for the last few seconds, so memory stays bounded however long the
+recording is.
+
+Segmentation is hierarchical:
+
+1. Coarse: frames are averaged into windows of a couple of seconds and a Foote
+   checkerboard novelty curve is computed over those windows as they arrive.
+   A novelty peak becomes a boundary once the kernel has seen enough audio
+   after it.
+2. Fine: each coarse boundary is refined to the frame with the highest
+   frame-level novelty within one coarse window of it.
+
+Each segment is emitted as soon as its end boundary is known, with a letter
+label (A, B, ...) from clustering it against earlier segments. When the stream
+ends, clusters are renamed the same way the notebook names segments: the
+repeated cluster with the most onset activity is the chorus, other repeated
+clusters are verses, and unique segments are intro/outro/transition.
+"""
+
+import argparse
+import os
+import string
+from pathlib import Path
+
+import numpy as np
+import librosa
+import soundfile as sf
+
+from segmentation import write_labels
+
+HOP_LENGTH = 512
+N_FFT = 2048
+N_MFCC = 20
+
+# Seconds of audio read per block
+BLOCK_SEC = 30.0
+
+# Coarse novelty windows and checkerboard half-width (in windows)
+COARSE_WINDOW_SEC = 2.0
+KERNEL_WINDOWS = 8
+
+# Half-width of the frame-level checkerboard used to refine boundaries
+FINE_KERNEL_SEC = 1.0
+
+# Boundaries need novelty above mean + NOVELTY_ALPHA * std of the curve so far
+NOVELTY_ALPHA = 0.5
+
+MIN_SEGMENT_SEC = 8.0
+
+# Cosine similarity above which a segment joins an existing cluster
+LABEL_THRESHOLD = 0.92
+
+_EPS = 1e-8
+
+
+def stream_features(path, sr, block_sec=BLOCK_SEC, hop_length=HOP_LENGTH, n_fft=N_FFT, n_mfcc=N_MFCC):
+    """Yield (chroma, mfcc, onset_strength) frame blocks, reading the audio one block at a time"""
+    block_frames = max(1, int(block_sec * sr / hop_length))
+    stream = librosa.stream(path, block_length=block_frames, frame_length=n_fft,
+                            hop_length=hop_length, mono=True, fill_value=0)
+    previous_mel_db = None
+    for y_block in stream:
+        # center=False so frames line up exactly across blocks
+        power = np.abs(librosa.stft(y_block, n_fft=n_fft, hop_length=hop_length, center=False)) ** 2
+        chroma = librosa.feature.chroma_stft(S=power, sr=sr, tuning=0.0)
+        mel_db = librosa.power_to_db(librosa.feature.melspectrogram(S=power, sr=sr))
+        mfcc = librosa.feature.mfcc(S=mel_db, n_mfcc=n_mfcc)
+
+        # Spectral flux onset strength, carrying the last frame over from the previous block
+        if previous_mel_db is None:
+            previous_mel_db = mel_db[:, :1]
+        flux = np.diff(np.concatenate([previous_mel_db, mel_db], axis=1), axis=1)
+        onset_strength = np.mean(np.maximum(flux, 0), axis=0)
+        previous_mel_db = mel_db[:, -1:]
+
+        yield chroma.astype(np.float32), mfcc.astype(np.float32), onset_strength.astype(np.float32)
+
+
+def _normalize_features(chroma, mfcc):
+    """Unit-normalize chroma and MFCC (without the energy coefficient) and stack them"""
+    chroma = chroma / (np.linalg.norm(chroma, axis=0, keepdims=True) + _EPS)
+    timbre = mfcc[1:] / (np.linalg.norm(mfcc[1:], axis=0, keepdims=True) + _EPS)
+    return np.vstack([chroma, timbre]) / np.sqrt(2)
+
+
+def _checkerboard_novelty(features, centers, half_width):
+    """Foote novelty at each center column of `features` (dim x frames)"""
+    similarity = features.T @ features
+    integral = np.zeros((similarity.shape[0] + 1, similarity.shape[1] + 1))
+    integral[1:, 1:] = similarity.cumsum(axis=0).cumsum(axis=1)
+
+    def block(r0, r1, c0, c1):
+        return integral[r1, c1] - integral[r0, c1] - integral[r1, c0] + integral[r0, c0]
+
+    lo = np.maximum(centers - half_width, 0)
+    hi = np.minimum(centers + half_width, similarity.shape[0])
+    within = block(lo, centers, lo, centers) + block(centers, hi, centers, hi)
+    across = block(lo, centers, centers, hi)
+    return (within - 2 * across) / (half_width * half_width)
+
+
+class StreamingSegmenter:
+    """Online coarse-to-fine segmenter fed with blocks of frame features"""
+
+    def __init__(self, sr, hop_length=HOP_LENGTH, n_fft=N_FFT,
+                 coarse_window_sec=COARSE_WINDOW_SEC, kernel_windows=KERNEL_WINDOWS,
+                 fine_kernel_sec=FINE_KERNEL_SEC, novelty_alpha=NOVELTY_ALPHA,
+                 min_segment_sec=MIN_SEGMENT_SEC, label_threshold=LABEL_THRESHOLD):
+        self.frame_rate = sr / hop_length
+        self.hop_sec = hop_length / sr
+        self.frame_center_sec = n_fft / 2 / sr
+        self.frames_per_window = max(1, int(round(coarse_window_sec * self.frame_rate)))
+        self.window_sec = self.frames_per_window / self.frame_rate
+        self.kernel_windows = kernel_windows
+        self.fine_kernel = max(1, min(int(fine_kernel_sec * self.frame_rate),
+                                      kernel_windows * self.frames_per_window))
+        self.novelty_alpha = novelty_alpha
+        self.min_segment_sec = min_segment_sec
+        self.min_segment_windows = max(1, int(np.ceil(min_segment_sec / self.window_sec)))
+        self.label_threshold = label_threshold
+
+        # Recent frame features only; _buffer_start is the absolute index of the first column
+        self._features = None
+        self._onsets = np.zeros(0, dtype=np.float32)
+        self._buffer_start = 0
+        self.num_frames = 0
+
+        # One entry per coarse window, kept for the whole track (a few KB per hour)
+        self._coarse = []
+        self._coarse_onsets = []
+        self._novelty = []
+        self._next_center = kernel_windows
+
+        self._boundary_windows = [0]
+        self._boundary_times = [0.0]
+        self._prototypes = []
+        self._segment_onsets = []
+        self.segments = []
+
+    def frame_time(self, frame):
+        """Time in seconds of the center of an absolute frame index"""
+        return float(frame * self.hop_sec + self.frame_center_sec)
+
+    def push(self, chroma, mfcc, onset_strength):
+        """Add a block of frames; returns the segments closed by it"""
+        block = _normalize_features(chroma, mfcc)
+        if self._features is None:
+            self._features = block
+        else:
+            self._features = np.hstack([self._features, block])
+        self._onsets = np.concatenate([self._onsets, onset_strength])
+        self.num_frames += block.shape[1]
+
+        self._add_complete_windows()
+        closed = self._decide_boundaries(final=False)
+        self._trim_buffer()
+        return closed
+
+    def finish(self, duration=None):
+        """Flush the stream; returns the full segmentation with structural labels"""
+        if self._features is not None:
+            self._add_complete_windows(final=True)
+            self._decide_boundaries(final=True)
+        if duration is None:
+            duration = self.num_frames * self.hop_sec
+        if not self._coarse:
+            return [(0.0, duration, "intro")]
+        if duration > self._boundary_times[-1]:
+            if self.segments and duration - self._boundary_times[-1] < self.min_segment_sec:
+                # Too short for a segment of its own: the tail joins the last one, as boundaries do in-stream
+                start, _, label = self.segments[-1]
+                self.segments[-1] = (start, duration, label)
+                self._boundary_windows[-1] = len(self._coarse)
+                self._boundary_times[-1] = duration
+            else:
+                self._close_segment(len(self._coarse), duration)
+        return self.structural_segments()
+
+    def _add_complete_windows(self, final=False):
+        """Turn buffered frames into coarse windows, and extend the novelty curve"""
+        fpw = self.frames_per_window
+        while True:
+            start = len(self._coarse) * fpw
+            stop = start + fpw
+            if stop > self.num_frames and not (final and start < self.num_frames):
+                break
+            stop = min(stop, self.num_frames)
+            columns = slice(start - self._buffer_start, stop - self._buffer_start)
+            window = self._features[:, columns].mean(axis=1)
+            self._coarse.append(window / (np.linalg.norm(window) + _EPS))
+            self._coarse_onsets.append(float(self._onsets[columns].mean()))
+
+        k = self.kernel_windows
+        while len(self._novelty) + k <= len(self._coarse) - k or (final and len(self._novelty) + k < len(self._coarse)):
+            center = len(self._novelty) + k
+            lo, hi = center - k, min(center + k, len(self._coarse))
+            windows = np.array(self._coarse[lo:hi]).T
+            value = _checkerboard_novelty(windows, np.array([center - lo]), k)[0]
+            self._novelty.append(float(value))
+
+    def _novelty_at(self, center):
+        index = center - self.kernel_windows
+        if 0 <= index < len(self._novelty):
+            return self._novelty[index]
+        return -np.inf
+
+    def _decide_boundaries(self, final):
+        """Decide peaks whose right-hand neighbour on the novelty curve is known"""
+        closed = []
+        last_known = len(self._novelty) + self.kernel_windows - 1
+        while self._next_center < last_known or (final and self._next_center <= last_known):
+            center = self._next_center
+            self._next_center += 1
+            values = np.array(self._novelty[:center - self.kernel_windows + 2])
+            threshold = values.mean() + self.novelty_alpha * values.std()
+            value = self._novelty_at(center)
+            is_peak = (value > threshold and value >= self._novelty_at(center - 1)
+                       and value > self._novelty_at(center + 1))
+            if is_peak and center - self._boundary_windows[-1] >= self.min_segment_windows:
+                closed.append(self._close_segment(center, self._refine(center)))
+        return closed
+
+    def _refine(self, center):
+        """Frame-level boundary time near coarse window `center`"""
+        fpw = self.frames_per_window
+        kf = self.fine_kernel
+        lo = max(center * fpw - fpw, self._buffer_start + kf)
+        hi = min(center * fpw + fpw, self.num_frames - kf)
+        if hi <= lo:
+            return self.frame_time(center * fpw)
+        span_start = lo - kf
+        features = self._features[:, span_start - self._buffer_start:hi + kf - self._buffer_start]
+        candidates = np.arange(lo, hi + 1) - span_start
+        novelty = _checkerboard_novelty(features, candidates, kf)
+        return self.frame_time(span_start + candidates[int(np.argmax(novelty))])
+
+    def _close_segment(self, boundary_window, boundary_time):
+        """Close the segment ending at boundary_time and cluster it"""
+        start_window = self._boundary_windows[-1]
+        windows = self._coarse[start_window:max(boundary_window, start_window + 1)]
+        onsets = self._coarse_onsets[start_window:max(boundary_window, start_window + 1)]
+        mean = np.mean(windows, axis=0)
+        mean = mean / (np.linalg.norm(mean) + _EPS)
+
+        label = self._assign_cluster(mean)
+        segment = (self._boundary_times[-1], boundary_time, label)
+        self.segments.append(segment)
+        self._segment_onsets.append(float(np.mean(onsets)) if onsets else 0.0)
+        self._boundary_windows.append(boundary_window)
+        self._boundary_times.append(boundary_time)
+        return segment
+
+    def _assign_cluster(self, vector):
+        """Letter label of the most similar earlier cluster, or a new one"""
+        best, best_similarity = None, -1.0
+        for index, (label, prototype, count) in enumerate(self._prototypes):
+            similarity = float(vector @ prototype) / (np.linalg.norm(prototype) + _EPS)
+            if similarity > best_similarity:
+                best, best_similarity = index, similarity
+        if best is not None and best_similarity >= self.label_threshold:
+            label, prototype, count = self._prototypes[best]
+            self._prototypes[best] = (label, prototype + vector, count + 1)
+            return label
+        index = len(self._prototypes)
+        label = string.ascii_uppercase[index] if index < 26 else f"S{index}"
+        self._prototypes.append((label, vector.copy(), 1))
+        return label
+
+    def _trim_buffer(self):
+        """Drop frames that no future coarse window or refinement can need"""
+        fpw = self.frames_per_window
+        keep_from = min((self._next_center - 1) * fpw - self.fine_kernel, len(self._coarse) * fpw)
+        drop = keep_from - self._buffer_start
+        if drop > 0:
+            self._features = self._features[:, drop:]
+            self._onsets = self._onsets[drop:]
+            self._buffer_start += drop
+
+    def structural_segments(self):
+        """Rename cluster letters to chorus/verse/intro/outro/transition"""
+        counts = {}
+        onset_by_label = {}
+        for (start, end, label), onset in zip(self.segments, self._segment_onsets):
+            counts[label] = counts.get(label, 0) + 1
+            onset_by_label.setdefault(label, []).append(onset)
+        repeated = [label for label, count in counts.items() if count > 1]
+        chorus = max(repeated, key=lambda label: np.mean(onset_by_label[label])) if repeated else None
+
+        named = []
+        for index, (start, end, label) in enumerate(self.segments):
+            if label == chorus:
+                name = "chorus"
+            elif label in repeated:
+                name = "verse"
+            elif index == 0:
+                name = "intro"
+            elif index == len(self.segments) - 1:
+                name = "outro"
+            else:
+                name = "transition"
+            named.append((start, end, name))
+        return named
+
+
+def segment_stream(path, on_segment=None, block_sec=BLOCK_SEC, **segmenter_options):
+    """Segment an audio file block by block; on_segment(segmenter, segment) is called as segments close"""
+    sr = librosa.get_samplerate(path)
+    segmenter = StreamingSegmenter(sr, **segmenter_options)
+    for chroma, mfcc, onset_strength in stream_features(path, sr, block_sec=block_sec):
+        for segment in segmenter.push(chroma, mfcc, onset_strength):
+            if on_segment is not None:
+                on_segment(segmenter, segment)
+    return segmenter.finish(duration=sf.info(path).duration)
+
+
+def process_audio_file_streaming(file_name, audio_directory='../audio/', labels_directory='../labels/',
+                                 block_sec=BLOCK_SEC):
+    """Streaming counterpart of segmentation.process_audio_file.
+
+    The label file is rewritten with cluster letters as each segment closes, so
+    the first labels can be inspected before the whole file has been read.
+    """
+    print(f"Processing {file_name} (streaming)...")
+    labels_path = os.path.join(labels_directory, file_name + "_labels.txt")
+
+    def on_segment(segmenter, segment):
+        print(f"  {segment[0]:8.1f}s - {segment[1]:8.1f}s  {segment[2]}")
+        write_labels(labels_path, segmenter.segments)
+
+    segments = segment_stream(os.path.join(audio_directory, file_name), on_segment=on_segment,
+                              block_sec=block_sec)
+    write_labels(labels_path, segments)
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Segment long recordings block by block")
+    parser.add_argument("inputs", nargs="+", help="Audio files or directories of audio files")
+    parser.add_argument("--labels-dir", default="./labels", help="Directory for the label files")
+    parser.add_argument("--block-sec", type=float, default=BLOCK_SEC, help="Seconds of audio read per block")
+
+    args = parser.parse_args()
+
+    os.makedirs(args.labels_dir, exist_ok=True)
+    for item in args.inputs:
+        path = Path(item)
+        files = sorted(f for f in path.iterdir() if f.suffix.lower() in ('.mp3', '.wav')) if path.is_dir() else [path]
+        for file in files:
+            try:
+                process_audio_file_streaming(file.name, str(file.parent), args.labels_dir, args.block_sec)
+            except Exception as e:
+                print(f"Error processing {file.name}: {str(e)}")
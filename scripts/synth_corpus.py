@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Generate a synthetic corpus of songs with known structure, for benchmarks.
+
+Every track follows a song form (intro, verse/chorus repeats with the odd
+transition, outro) at a random tempo and key. Each section type has its own
+chord progression, melody and arrangement, and a repeat of a section is
+sample-identical to its first occurrence, so the ground-truth labels are
+exact. Instruments are rendered as separate layers, one per Demucs stem, and
+some tracks leave out guitar or piano entirely. Tracks can be anywhere from
+30 s to 90 min long. Sections are rendered once and streamed to disk, so
+memory use does not grow with the length of the track.
+
+The output uses the layout the other scripts expect:
+
+    <out>/audio/<track>.wav                ground-truth mix
+    <out>/labels/<track>.wav_labels.txt    Audacity labels (intro/verse/chorus/transition/outro)
+    <out>/stems/<track>/<stem>.wav         per-instrument layers (--stems)
+    <out>/meta/<track>.json                tempo, key, sections and layers
+
+so benchmark_segmentation.py --audio-dir <out>/audio --reference-dir
+<out>/labels scores segmentation against it directly. Generation is
+deterministic in (--seed, duration, track index), and tracks that already
+exist are skipped.
+"""
+
+import argparse
+import json
+import os
+import wave
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+SR = 22050
+STEMS = ('bass', 'drums', 'vocals', 'other', 'guitar', 'piano')
+MAJOR_SCALE = [0, 2, 4, 5, 7, 9, 11]
+
+# (min, max) bars per section type; short tracks use the minimum
+SECTION_BARS = {'intro': (2, 8), 'verse': (4, 16), 'chorus': (4, 8), 'transition': (2, 4), 'outro': (2, 8)}
+FORM = ['verse', 'chorus', 'verse', 'chorus', 'transition']
+LAYERS = {
+    'intro': ('piano', 'other'),
+    'verse': ('drums', 'bass', 'piano', 'vocals'),
+    'chorus': ('drums', 'bass', 'piano', 'guitar', 'vocals', 'other'),
+    'transition': ('drums', 'bass', 'other'),
+    'outro': ('piano', 'other'),
+}
+GAINS = {'bass': 0.2, 'drums': 0.25, 'vocals': 0.15, 'other': 0.06, 'guitar': 0.08, 'piano': 0.1}
+
+
+def midi_to_hz(pitch):
+    return 440.0 * 2 ** ((np.asarray(pitch, dtype=np.float64) - 69) / 12)
+
+
+def tone(freq, n, sr, harmonics=(1.0, 0.5, 0.25), decay=None, vibrato=0.0):
+    """A harmonic tone of n samples with a short attack and an optional exponential decay (seconds)"""
+    t = np.arange(n) / sr
+    phase = 2 * np.pi * freq * t
+    if vibrato:
+        phase += vibrato * np.sin(2 * np.pi * 5.5 * t)
+    y = sum(amplitude * np.sin(k * phase) for k, amplitude in enumerate(harmonics, start=1))
+    envelope = np.minimum(1.0, t / 0.005)
+    if decay:
+        envelope *= np.exp(-t / decay)
+    else:
+        envelope *= np.minimum(1.0, (n / sr - t) / 0.02)  # release instead of a click
+    return (y * envelope).astype(np.float32)
+
+
+def drum_hits(n, sr, rng):
+    """Kick, snare and hi-hat one-shots"""
+    t = np.arange(n) / sr
+    kick = np.sin(2 * np.pi * np.cumsum(50 + 100 * np.exp(-t / 0.03)) / sr) * np.exp(-t / 0.15)
+    snare = rng.standard_normal(n) * np.exp(-t / 0.08) * 0.6
+    hat = np.diff(rng.standard_normal(n + 1)) * np.exp(-t / 0.02) * 0.2
+    return {'kick': kick.astype(np.float32), 'snare': snare.astype(np.float32), 'hat': hat.astype(np.float32)}
+
+
+def add(buffer, start, sound):
+    """Mix sound into buffer at sample `start`, cutting it at the end of the buffer"""
+    stop = min(len(buffer), start + len(sound))
+    if start < stop:
+        buffer[start:stop] += sound[:stop - start]
+
+
+def plan_track(duration, rng):
+    """Tempo, key, per-section patterns and the list of (start, end, label) sections"""
+    tempo = int(rng.integers(100, 141))
+    bar_sec = 4 * 60.0 / tempo
+    short = duration < 90
+    bars = {kind: low if short else int(rng.integers(low // 2, high // 2 + 1)) * 2
+            for kind, (low, high) in SECTION_BARS.items()}
+    patterns = {}
+    for kind in SECTION_BARS:
+        degrees = [0] + list(rng.choice(7, size=3)) if kind == 'chorus' else list(rng.choice(7, size=4))
+        patterns[kind] = {
+            'degrees': [int(d) for d in degrees],
+            'melody': [int(d) for d in rng.choice(7, size=16)],
+        }
+    # Some tracks have no guitar or piano at all, as separated pop/EDM stems often do
+    stems = [stem for stem in STEMS if not (stem == 'guitar' and rng.random() < 0.5)
+             and not (stem == 'piano' and rng.random() < 0.3)]
+
+    sections = []
+    t = 0.0
+    for kind in ['intro'] + FORM * int(duration // (bar_sec * 8) + 1):
+        length = bars[kind] * bar_sec
+        if t + length + bars['outro'] * bar_sec > duration:
+            break
+        sections.append((t, t + length, kind))
+        t += length
+    sections.append((t, float(duration), 'outro'))  # the outro takes up the rest
+    return {'tempo': tempo, 'key': int(rng.integers(40, 52)), 'stems': stems, 'patterns': patterns,
+            'sections': sections}
+
+
+def render_section(kind, n, plan, sr, rng):
+    """{stem: float32 audio} for n samples of one section type"""
+    beat = 60.0 * sr / plan['tempo']
+    bar = 4 * beat
+    key = plan['key']
+    pattern = plan['patterns'][kind]
+    layers = {stem: np.zeros(n, dtype=np.float32) for stem in STEMS}
+    active = [stem for stem in LAYERS[kind] if stem in plan['stems']]
+    hits = drum_hits(int(0.3 * sr), sr, rng)
+
+    for b in range(int(np.ceil(n / bar))):
+        degree = pattern['degrees'][b % len(pattern['degrees'])]
+        root = key + MAJOR_SCALE[degree]
+        chord = [key + MAJOR_SCALE[(degree + step) % 7] + 12 * ((degree + step) // 7) for step in (0, 2, 4)]
+        bar_start = int(b * bar)
+        if 'bass' in active:
+            for eighth in range(8):
+                add(layers['bass'], bar_start + int(eighth * beat / 2),
+                    tone(midi_to_hz(root), int(beat / 2), sr, harmonics=(1.0, 0.3), decay=0.25))
+        if 'drums' in active:
+            for beat_index in range(4):
+                onset = bar_start + int(beat_index * beat)
+                add(layers['drums'], onset, hits['kick'] if beat_index % 2 == 0 else hits['snare'])
+                add(layers['drums'], onset + int(beat / 2), hits['hat'])
+        if 'piano' in active:
+            for pitch in chord:
+                add(layers['piano'], bar_start, tone(midi_to_hz(pitch + 24), int(bar), sr, decay=0.8))
+        if 'guitar' in active:
+            for beat_index in range(4):
+                for i, pitch in enumerate(chord):
+                    add(layers['guitar'], bar_start + int(beat_index * beat) + i * int(0.012 * sr),
+                        tone(midi_to_hz(pitch + 12), int(beat), sr, harmonics=(1.0, 0.7, 0.5, 0.35), decay=0.3))
+        if 'other' in active:
+            for pitch in chord:
+                add(layers['other'], bar_start, tone(midi_to_hz(pitch + 12), int(bar), sr, harmonics=(1.0, 0.2)))
+        if 'vocals' in active:
+            for beat_index in range(4):
+                step = pattern['melody'][(b * 4 + beat_index) % len(pattern['melody'])]
+                pitch = key + 24 + MAJOR_SCALE[step]
+                add(layers['vocals'], bar_start + int(beat_index * beat),
+                    tone(midi_to_hz(pitch), int(beat * 0.9), sr, harmonics=(1.0, 0.4, 0.2), vibrato=0.3))
+    return {stem: layers[stem] * GAINS[stem] for stem in STEMS}
+
+
+def to_pcm(y):
+    return (np.clip(y, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+
+
+def open_wav(path, sr):
+    writer = wave.open(path, 'wb')
+    writer.setnchannels(1)
+    writer.setsampwidth(2)
+    writer.setframerate(sr)
+    return writer
+
+
+def track_name(duration, index):
+    return f"synth-{int(duration)}s-{index:04d}"
+
+
+def generate_track(output_dir, duration, index, seed=0, sr=SR, stems=False):
+    """Write one track (audio, labels, metadata and optionally stems); returns its metadata"""
+    name = track_name(duration, index)
+    rng = np.random.default_rng([seed, int(duration), index])
+    plan = plan_track(duration, rng)
+    audio_path = os.path.join(output_dir, "audio", f"{name}.wav")
+    stem_dir = os.path.join(output_dir, "stems", name)
+    if stems:
+        os.makedirs(stem_dir, exist_ok=True)
+
+    # Write to .tmp names and rename at the end, so an interrupted run never leaves a short track
+    mix_writer = open_wav(audio_path + ".tmp", sr)
+    stem_writers = {stem: open_wav(os.path.join(stem_dir, f"{stem}.wav.tmp"), sr) for stem in STEMS} if stems else {}
+    rendered = {}
+    try:
+        for start, end, kind in plan['sections']:
+            n = int(round(end * sr)) - int(round(start * sr))
+            if (kind, n) not in rendered:
+                # Seeded per section type, so every repeat is identical
+                rendered[(kind, n)] = render_section(kind, n, plan, sr, np.random.default_rng([seed, index, list(SECTION_BARS).index(kind)]))
+            layers = rendered[(kind, n)]
+            mix_writer.writeframes(to_pcm(sum(layers.values())))
+            for stem, writer in stem_writers.items():
+                writer.writeframes(to_pcm(layers[stem]))
+    finally:
+        mix_writer.close()
+        for writer in stem_writers.values():
+            writer.close()
+    for stem in stem_writers:
+        os.replace(os.path.join(stem_dir, f"{stem}.wav.tmp"), os.path.join(stem_dir, f"{stem}.wav"))
+
+    with open(os.path.join(output_dir, "labels", f"{name}.wav_labels.txt"), 'w') as f:
+        for start, end, kind in plan['sections']:
+            f.write(f"{start:.6f}\t{end:.6f}\t{kind}\n")
+    meta = {'track': name, 'duration': float(duration), 'sr': sr, 'seed': seed, 'tempo': plan['tempo'],
+            'key': plan['key'], 'stems': plan['stems'], 'sections': plan['sections'],
+            'layers': {kind: [stem for stem in LAYERS[kind] if stem in plan['stems']] for kind in LAYERS}}
+    with open(os.path.join(output_dir, "meta", f"{name}.json"), 'w') as f:
+        json.dump(meta, f, indent=2)
+    # The mix is published last: its presence marks the track as complete
+    os.replace(audio_path + ".tmp", audio_path)
+    return meta
+
+
+def generate_corpus(output_dir, tracks, duration, seed=0, sr=SR, stems=False, workers=None, overwrite=False):
+    """Generate tracks 0..tracks-1 of one duration on a process pool; returns their audio paths"""
+    for sub in ("audio", "labels", "meta"):
+        os.makedirs(os.path.join(output_dir, sub), exist_ok=True)
+
+    def done(index):
+        name = track_name(duration, index)
+        if not os.path.exists(os.path.join(output_dir, "audio", f"{name}.wav")):
+            return False
+        return not stems or os.path.exists(os.path.join(output_dir, "stems", name, f"{STEMS[-1]}.wav"))
+
+    pending = [i for i in range(tracks) if overwrite or not done(i)]
+    if pending:
+        print(f"Generating {len(pending)} tracks of {duration:g}s in {output_dir}")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(generate_track, output_dir, duration, i, seed, sr, stems): i for i in pending}
+            for future in as_completed(futures):
+                meta = future.result()
+                print(f"Generated {meta['track']}: {len(meta['sections'])} sections, {meta['tempo']} BPM, "
+                      f"stems {', '.join(meta['stems'])}")
+    return [os.path.join(output_dir, "audio", f"{track_name(duration, i)}.wav") for i in range(tracks)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic songs with ground-truth structure labels")
+    parser.add_argument("output_dir", help="Corpus directory (audio/, labels/, meta/ and stems/ inside)")
+    parser.add_argument("--tracks", type=int, default=10, help="Tracks per duration")
+    parser.add_argument("--durations", type=float, nargs="+", default=[180.0],
+                        help="Track lengths in seconds (30 to 5400)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sr", type=int, default=SR, help="Sample rate")
+    parser.add_argument("--stems", action="store_true", help="Also write each instrument layer as a stem")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--overwrite", action="store_true", help="Regenerate tracks that already exist")
+
+    args = parser.parse_args()
+
+    for duration in args.durations:
+        if not 30 <= duration <= 5400:
+            parser.error(f"duration {duration:g}s is outside 30..5400")
+        generate_corpus(args.output_dir, args.tracks, duration, seed=args.seed, sr=args.sr, stems=args.stems,
+                        workers=args.workers, overwrite=args.overwrite)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Batched loading of the anticipation training data.
+
+The setup notebook leaves train/valid/test either as newline-delimited token
+text (train.txt, one sequence per line) or as binary shards
+(token_shards.py). TokenTextDataset gives the text files random access
+without reading them into RAM: a line-offset index is built once, cached
+next to the file as <file>.idx.npy, and lines are parsed on demand from a
+memory-mapped view. open_split picks the shards when they exist.
+
+BatchLoader serves batches in a full random permutation, through a shuffle
+buffer over sequential reads (cheaper on slow disks), or in order. Worker
+processes do the reading and parsing, and a bounded number of chunks are kept
+in flight ahead of the consumer. Run this file to benchmark a split in
+tokens/s.
+"""
+
+import argparse
+import mmap
+import multiprocessing
+import os
+import time
+from collections import deque
+
+import numpy as np
+
+from token_shards import TokenShards
+
+INDEX_SUFFIX = ".idx.npy"
+SCAN_BLOCK = 64 << 20
+
+
+def build_line_index(path):
+    """Byte offsets of every line start plus the file size; cached in <path>.idx.npy"""
+    index_path = path + INDEX_SUFFIX
+    size = os.path.getsize(path)
+    if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(path):
+        offsets = np.load(index_path)
+        if len(offsets) and offsets[-1] == size:
+            return offsets
+
+    starts = [np.zeros(1, dtype=np.int64)]
+    if size:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for block_start in range(0, size, SCAN_BLOCK):
+                block = np.frombuffer(data, dtype=np.uint8, count=min(SCAN_BLOCK, size - block_start),
+                                      offset=block_start)
+                starts.append(np.flatnonzero(block == ord('\n')).astype(np.int64) + block_start + 1)
+                del block  # the mmap cannot close while a view of it exists
+    offsets = np.concatenate(starts)
+    if offsets[-1] != size:
+        offsets = np.append(offsets, size)  # last line without a trailing newline
+    np.save(index_path, offsets)
+    return offsets
+
+
+class TokenTextDataset:
+    """Random access to the lines of a token text file, parsed to int64 arrays on demand"""
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets = build_line_index(path)
+        self._file = open(path, 'rb')
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b''
+
+    def __getstate__(self):
+        # Workers re-open the file; the index is loaded from its cache
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return np.array(self._data[self.offsets[i]:self.offsets[i + 1]].split(), dtype=np.int64)
+
+
+def open_split(datapath, name):
+    """Binary shards for the split if token_shards.py made them, otherwise <name>.txt"""
+    if os.path.exists(os.path.join(datapath, f"{name}.json")):
+        return TokenShards(datapath, name)
+    return TokenTextDataset(os.path.join(datapath, f"{name}.txt"))
+
+
+def collate(sequences):
+    """Stack equal-length sequences into one int64 array; ragged batches stay a list"""
+    if len({len(sequence) for sequence in sequences}) == 1:
+        return np.stack(sequences).astype(np.int64, copy=False)
+    return [np.asarray(sequence, dtype=np.int64) for sequence in sequences]
+
+
+_worker_dataset = None
+
+
+def _init_worker(dataset):
+    global _worker_dataset
+    _worker_dataset = dataset
+
+
+def _load_chunk(indices):
+    return [np.asarray(_worker_dataset[int(i)]) for i in indices]
+
+
+class BatchLoader:
+    """Iterate over batches of a dataset with background parsing and prefetch
+
+    shuffle: 'permutation' visits the sequences in a fresh random order each
+    epoch; 'buffer' reads in file order and draws batches from a buffer of
+    shuffle_buffer sequences; None keeps file order.
+    """
+
+    def __init__(self, dataset, batch_size=16, shuffle='permutation', shuffle_buffer=10000, seed=None,
+                 num_workers=2, prefetch=8, drop_last=False):
+        if shuffle not in ('permutation', 'buffer', None):
+            raise ValueError(f"unknown shuffle mode: {shuffle}")
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.shuffle_buffer = shuffle_buffer
+        self.rng = np.random.default_rng(seed)
+        self.num_workers = num_workers
+        self.prefetch = prefetch
+        self.drop_last = drop_last
+        self._pool = None
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.dataset) // self.batch_size
+        return -(-len(self.dataset) // self.batch_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def _chunks(self):
+        """Index lists handed to the workers, one batch worth each"""
+        n = len(self.dataset)
+        order = self.rng.permutation(n) if self.shuffle == 'permutation' else np.arange(n)
+        for start in range(0, n, self.batch_size):
+            yield order[start:start + self.batch_size]
+
+    def _loaded_chunks(self):
+        """Parsed chunks in order, with up to `prefetch` chunks in flight"""
+        if self.num_workers == 0:
+            for indices in self._chunks():
+                yield [np.asarray(self.dataset[int(i)]) for i in indices]
+            return
+
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.num_workers, initializer=_init_worker, initargs=(self.dataset,))
+        pending = deque()
+        for indices in self._chunks():
+            pending.append(self._pool.apply_async(_load_chunk, (indices,)))
+            if len(pending) >= self.prefetch:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+    def __iter__(self):
+        """One epoch of batches"""
+        if self.shuffle != 'buffer':
+            for sequences in self._loaded_chunks():
+                if len(sequences) == self.batch_size or not self.drop_last:
+                    yield collate(sequences)
+            return
+
+        buffer = []
+        batch = []
+        for sequences in self._loaded_chunks():
+            buffer.extend(sequences)
+            while len(buffer) >= self.shuffle_buffer:
+                batch.append(self._pop_random(buffer))
+                if len(batch) == self.batch_size:
+                    yield collate(batch)
+                    batch = []
+        while buffer:
+            batch.append(self._pop_random(buffer))
+            if len(batch) == self.batch_size:
+                yield collate(batch)
+                batch = []
+        if batch and not self.drop_last:
+            yield collate(batch)
+
+    def _pop_random(self, buffer):
+        """Remove a random element in O(1) by swapping it with the last one"""
+        i = self.rng.integers(len(buffer))
+        buffer[i], buffer[-1] = buffer[-1], buffer[i]
+        return buffer.pop()
+
+
+def benchmark(loader, max_batches=None):
+    """Tokens per second over one epoch (or the first max_batches batches)"""
+    tokens = 0
+    batches = 0
+    start = time.perf_counter()
+    for batch in loader:
+        tokens += batch.size if isinstance(batch, np.ndarray) else sum(len(sequence) for sequence in batch)
+        batches += 1
+        if max_batches is not None and batches >= max_batches:
+            break
+    seconds = time.perf_counter() - start
+    return {'batches': batches, 'tokens': tokens, 'seconds': seconds,
+            'tokens_per_sec': tokens / seconds if seconds else 0.0}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark loading of anticipation training data in tokens/s")
+    parser.add_argument("datapath", help="Folder with <split>.txt or <split> binary shards")
+    parser.add_argument("--split", default="train", help="train, valid or test")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--shuffle", choices=['permutation', 'buffer', 'none'], default='permutation')
+    parser.add_argument("--shuffle-buffer", type=int, default=10000, help="Sequences held by the shuffle buffer")
+    parser.add_argument("--workers", type=int, default=2, help="Parsing processes (0 parses in the main process)")
+    parser.add_argument("--prefetch", type=int, default=8, help="Batches loaded ahead of the consumer")
+    parser.add_argument("--batches", type=int, default=None, help="Stop after this many batches")
+    parser.add_argument("--seed", type=int, default=None)
+
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    dataset = open_split(args.datapath, args.split)
+    print(f"Opened {args.split}: {len(dataset)} sequences ({type(dataset).__name__}) in {time.perf_counter() - start:.2f}s")
+
+    with BatchLoader(dataset, batch_size=args.batch_size, shuffle=None if args.shuffle == 'none' else args.shuffle,
+                     shuffle_buffer=args.shuffle_buffer, seed=args.seed, num_workers=args.workers,
+                     prefetch=args.prefetch) as loader:
+        result = benchmark(loader, args.batches)
+    print(f"{result['batches']} batches, {result['tokens']} tokens in {result['seconds']:.2f}s: "
+          f"{result['tokens_per_sec']:.0f} tokens/s")
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Binary token shards for the anticipation training data.
+
+anticipation-setup.ipynb used to build the splits with text tools: rename
+tokenized-events-e/f.txt to valid/test.txt, `cat` the rest into
+train-ordered.txt and `shuf` that into train.txt. shuf holds the whole file in
+RAM (and needs GNU coreutils on macOS), and every training run parses the
+integers from text again.
+
+This script reads tokenized-events-<split>.txt once and writes each of
+train/valid/test as fixed-dtype binary shards:
+
+    <output>/<name>-00000.bin      tokens of consecutive sequences, raw
+    <output>/<name>-00000.idx.npy  int64 offsets, sequence i is bin[idx[i]:idx[i+1]]
+    <output>/<name>.json           dtype, shard list, sequence and token counts
+
+TokenShards memory-maps them and indexes sequences across shards. Train is
+shuffled out of core: sequences are first scattered into random bucket files,
+then each bucket (sized to --memory-mb) is permuted in memory and appended to
+the output, which yields a uniform random permutation in two passes.
+"""
+
+import argparse
+import json
+import math
+import os
+import shutil
+import tempfile
+from array import array
+
+import numpy as np
+
+SPLITS = '0123456789abcdef'
+DEFAULT_DTYPE = 'uint16'
+DEFAULT_SHARD_TOKENS = 1 << 28  # 512 MB of uint16 per shard
+DEFAULT_MEMORY_MB = 1024
+
+
+def parse_sequence(line):
+    """One line of tokenized-events-*.txt as int64 tokens"""
+    return np.array(line.split(), dtype=np.int64)
+
+
+def read_sequences(path):
+    """Token arrays for the non-empty lines of a text file"""
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield parse_sequence(line)
+
+
+class ShardWriter:
+    """Append sequences to <name>-NNNNN.bin/.idx.npy shards of at most shard_tokens tokens"""
+
+    def __init__(self, directory, name, dtype=DEFAULT_DTYPE, shard_tokens=DEFAULT_SHARD_TOKENS):
+        self.directory = directory
+        self.name = name
+        self.dtype = np.dtype(dtype)
+        self.shard_tokens = shard_tokens
+        self.shards = []
+        self.sequences = 0
+        self.tokens = 0
+        self._file = None
+        self._offsets = None
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, tokens):
+        tokens = np.asarray(tokens)
+        if tokens.size and (tokens.min() < 0 or tokens.max() > np.iinfo(self.dtype).max):
+            raise ValueError(f"token out of range for {self.dtype}: {tokens.min()}..{tokens.max()}")
+        if self._file is None or (self._offsets[-1] and self._offsets[-1] + tokens.size > self.shard_tokens):
+            self._close_shard()
+            self._open_shard()
+        self._file.write(tokens.astype(self.dtype).tobytes())
+        self._offsets.append(self._offsets[-1] + tokens.size)
+        self.sequences += 1
+        self.tokens += tokens.size
+
+    def _open_shard(self):
+        shard = f"{self.name}-{len(self.shards):05d}"
+        self._file = open(os.path.join(self.directory, shard + ".bin"), 'wb')
+        self._offsets = array('q', [0])
+        self.shards.append(shard)
+
+    def _close_shard(self):
+        if self._file is None:
+            return
+        self._file.close()
+        np.save(os.path.join(self.directory, self.shards[-1] + ".idx.npy"), np.frombuffer(self._offsets, dtype=np.int64))
+        self._file = None
+
+    def close(self):
+        """Finish the last shard and write <name>.json"""
+        self._close_shard()
+        meta = {'dtype': self.dtype.name, 'shards': self.shards,
+                'sequences': self.sequences, 'tokens': self.tokens}
+        with open(os.path.join(self.directory, f"{self.name}.json"), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TokenShards:
+    """Read-only, memory-mapped view of one split's shards; indexable by sequence number"""
+
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        with open(os.path.join(directory, f"{name}.json")) as f:
+            meta = json.load(f)
+        self.dtype = np.dtype(meta['dtype'])
+        self.tokens = meta['tokens']
+        self.data = [np.memmap(os.path.join(directory, shard + ".bin"), dtype=self.dtype, mode='r')
+                     if os.path.getsize(os.path.join(directory, shard + ".bin")) else np.zeros(0, self.dtype)
+                     for shard in meta['shards']]
+        self.offsets = [np.load(os.path.join(directory, shard + ".idx.npy"), mmap_mode='r')
+                        for shard in meta['shards']]
+        # First global sequence number of each shard
+        self.starts = np.cumsum([0] + [len(o) - 1 for o in self.offsets])
+
+    def __getstate__(self):
+        # Pickle by location so worker processes map the shards themselves instead of copying them
+        return {'directory': self.directory, 'name': self.name}
+
+    def __setstate__(self, state):
+        self.__init__(state['directory'], state['name'])
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        shard = int(np.searchsorted(self.starts, i, side='right')) - 1
+        j = i - self.starts[shard]
+        offsets = self.offsets[shard]
+        return self.data[shard][offsets[j]:offsets[j + 1]]
+
+    def __iter__(self):
+        for data, offsets in zip(self.data, self.offsets):
+            for j in range(len(offsets) - 1):
+                yield data[offsets[j]:offsets[j + 1]]
+
+
+def external_shuffle(sequences, writer, num_buckets, scratch_directory, seed=None):
+    """Write sequences to writer in a uniformly random order, holding about 1/num_buckets of them in RAM"""
+    rng = np.random.default_rng(seed)
+    buckets = [open(os.path.join(scratch_directory, f"bucket-{b:04d}.bin"), 'wb') for b in range(num_buckets)]
+    lengths = [array('q') for _ in range(num_buckets)]
+    choices = np.zeros(0, dtype=np.int64)
+    position = 0
+
+    # Pass 1: scatter each sequence to a random bucket
+    for tokens in sequences:
+        if position == len(choices):
+            choices = rng.integers(num_buckets, size=1 << 16)
+            position = 0
+        b = choices[position]
+        position += 1
+        buckets[b].write(tokens.astype(np.int64).tobytes())
+        lengths[b].append(tokens.size)
+    for bucket in buckets:
+        bucket.close()
+
+    # Pass 2: permute each bucket in memory
+    for b in range(num_buckets):
+        path = os.path.join(scratch_directory, f"bucket-{b:04d}.bin")
+        data = np.fromfile(path, dtype=np.int64)
+        os.remove(path)
+        offsets = np.concatenate([[0], np.cumsum(np.frombuffer(lengths[b], dtype=np.int64))])
+        for j in rng.permutation(len(offsets) - 1):
+            writer.append(data[offsets[j]:offsets[j + 1]])
+
+
+def build_splits(datapath, output_directory=None, valid_split='e', test_split='f', dtype=DEFAULT_DTYPE,
+                 shard_tokens=DEFAULT_SHARD_TOKENS, memory_mb=DEFAULT_MEMORY_MB, seed=None):
+    """Convert <datapath>/tokenized-events-<split>.txt into shuffled train and ordered valid/test shards"""
+    output_directory = output_directory or datapath
+    os.makedirs(output_directory, exist_ok=True)
+    sources = {split: os.path.join(datapath, f"tokenized-events-{split}.txt") for split in SPLITS}
+    sources = {split: path for split, path in sources.items() if os.path.exists(path)}
+    if not sources:
+        raise FileNotFoundError(f"No tokenized-events-*.txt files in {datapath}")
+
+    for name, split in (('valid', valid_split), ('test', test_split)):
+        if split not in sources:
+            print(f"No tokenized-events-{split}.txt; skipping {name}")
+            continue
+        with ShardWriter(output_directory, name, dtype, shard_tokens) as writer:
+            for tokens in read_sequences(sources[split]):
+                writer.append(tokens)
+        print(f"{name}: {writer.sequences} sequences, {writer.tokens} tokens")
+
+    train_sources = [path for split, path in sorted(sources.items()) if split not in (valid_split, test_split)]
+    # A token takes at least 2 bytes of text ("5 ") and 8 in a bucket, so 4x the text size bounds the buckets
+    bucket_bytes = 4 * sum(os.path.getsize(path) for path in train_sources)
+    num_buckets = max(1, math.ceil(bucket_bytes / (memory_mb * 2**20)))
+
+    scratch_directory = tempfile.mkdtemp(prefix=".shuffle.", dir=output_directory)
+    try:
+        def train_sequences():
+            for path in train_sources:
+                yield from read_sequences(path)
+
+        with ShardWriter(output_directory, 'train', dtype, shard_tokens) as writer:
+            external_shuffle(train_sequences(), writer, num_buckets, scratch_directory, seed)
+    finally:
+        shutil.rmtree(scratch_directory, ignore_errors=True)
+    print(f"train: {writer.sequences} sequences, {writer.tokens} tokens, shuffled in {num_buckets} buckets")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert tokenized-events-*.txt into binary train/valid/test token shards")
+    parser.add_argument("datapath", help="Folder with tokenized-events-<0-f>.txt (e.g. ../midi/rag-split)")
+    parser.add_argument("--output-dir", default=None, help="Where to write the shards (default: datapath)")
+    parser.add_argument("--valid-split", default='e', help="Hash split used for validation")
+    parser.add_argument("--test-split", default='f', help="Hash split used for testing")
+    parser.add_argument("--dtype", default=DEFAULT_DTYPE, choices=['uint16', 'uint32', 'int32', 'int64'],
+                        help="Token dtype on disk")
+    parser.add_argument("--shard-tokens", type=int, default=DEFAULT_SHARD_TOKENS, help="Maximum tokens per shard")
+    parser.add_argument("--memory-mb", type=int, default=DEFAULT_MEMORY_MB,
+                        help="Approximate memory for one shuffle bucket")
+    parser.add_argument("--seed", type=int, default=None, help="Shuffle seed")
+
+    args = parser.parse_args()
+
+    build_splits(args.datapath, args.output_dir, valid_split=args.valid_split, test_split=args.test_split,
+                 dtype=args.dtype, shard_tokens=args.shard_tokens, memory_mb=args.memory_mb, seed=args.seed)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Preprocess and tokenize the 16 hash splits of an anticipation corpus in parallel.
+
+anticipation-setup.ipynb runs anticipation's train/midi-preprocess.py and
+train/tokenize-lakh.py --augment 1 over the whole $DATAPATH. If anything
+fails the whole build starts over. This driver treats each hex split (0-f)
+as a job. The job converts the split's MIDI files to .compound.txt, as
+midi-preprocess.py does, then tokenizes them into
+<datapath>/tokenized-events-<split>.txt with anticipation.tokenize.tokenize,
+as tokenize-lakh.py does.
+
+Each split job runs in its own Python process, and up to --workers of them
+run at once, so a crash only loses that split. Failed splits are retried up
+to --retries times.
+
+Progress is kept on disk:
+
+- finished .compound.txt files are not converted again
+- tokenized-events-<split>.txt only appears once the split is complete
+- <datapath>/.tokenize-checkpoints/<split>.json records a finished split
+  with its files/s and tokens/s; re-runs skip it
+
+The anticipation clone must be importable; by default ./anticipation, the
+location the notebook uses.
+"""
+
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+SPLITS = '0123456789abcdef'
+CHECKPOINT_DIR = ".tokenize-checkpoints"
+# tokenize-lakh.py never augments the validation and test splits
+UNAUGMENTED_SPLITS = 'ef'
+
+
+def checkpoint_path(datapath, split):
+    return os.path.join(datapath, CHECKPOINT_DIR, f"{split}.json")
+
+
+def read_checkpoint(datapath, split):
+    path = checkpoint_path(datapath, split)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def preprocess_split(split_directory):
+    """midi-preprocess.py for one split: write <file>.compound.txt next to each MIDI file"""
+    from anticipation.convert import midi_to_compound
+
+    filenames = sorted(glob.glob(os.path.join(split_directory, '*.mid')) +
+                       glob.glob(os.path.join(split_directory, '*.midi')))
+    converted = skipped = failed = 0
+    start = time.perf_counter()
+    for filename in filenames:
+        output = f"{filename}.compound.txt"
+        if os.path.exists(output):
+            skipped += 1
+            continue
+        try:
+            tokens = midi_to_compound(filename)
+        except Exception:
+            failed += 1
+            continue
+        with open(output + ".tmp", 'w') as f:
+            f.write(' '.join(str(tok) for tok in tokens))
+        os.replace(output + ".tmp", output)
+        converted += 1
+    seconds = time.perf_counter() - start
+    return {'files': len(filenames), 'converted': converted, 'skipped': skipped, 'failed': failed,
+            'seconds': seconds, 'files_per_sec': converted / seconds if seconds else 0.0}
+
+
+def tokenize_split(datapath, split, augment):
+    """tokenize-lakh.py for one split, written atomically to tokenized-events-<split>.txt"""
+    from anticipation.tokenize import tokenize
+
+    datafiles = sorted(glob.glob(os.path.join(datapath, split, '*.compound.txt')))
+    output = os.path.join(datapath, f"tokenized-events-{split}.txt")
+    start = time.perf_counter()
+    seq_count, rest_count, too_short, too_long, too_many_instruments, inexpressible, truncations = \
+        tokenize(datafiles, output + ".tmp", augment, idx=SPLITS.index(split))
+    with open(output + ".tmp") as f:
+        tokens = sum(len(line.split()) for line in f)
+    os.replace(output + ".tmp", output)
+    seconds = time.perf_counter() - start
+    return {'files': len(datafiles), 'sequences': seq_count, 'rest_tokens': rest_count, 'tokens': tokens,
+            'too_short': too_short, 'too_long': too_long, 'too_many_instruments': too_many_instruments,
+            'inexpressible': inexpressible, 'truncations': truncations,
+            'seconds': seconds, 'tokens_per_sec': tokens / seconds if seconds else 0.0}
+
+
+def run_split(datapath, split, augment, anticipation_dir):
+    """Worker process body: preprocess and tokenize one split, then write its checkpoint"""
+    sys.path.insert(0, os.path.abspath(anticipation_dir))
+    record = {'split': split, 'augment': augment}
+    record['preprocess'] = preprocess_split(os.path.join(datapath, split))
+    record['tokenize'] = tokenize_split(datapath, split, augment)
+
+    path = checkpoint_path(datapath, split)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", 'w') as f:
+        json.dump(record, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def launch_split(datapath, split, augment, anticipation_dir, retries):
+    """Run one split in a child process, retrying on failure; returns (split, checkpoint or None, attempts)"""
+    command = [sys.executable, os.path.abspath(__file__), datapath, '--run-split', split,
+               '--augment', str(augment), '--anticipation-dir', anticipation_dir]
+    for attempt in range(1, retries + 2):
+        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if result.returncode == 0:
+            return split, read_checkpoint(datapath, split), attempt
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}"
+        print(f"Split {split} failed (attempt {attempt}): {error}")
+    return split, None, retries + 1
+
+
+def print_report(records):
+    print(f"\n{'split':<6} {'files':>8} {'conv':>8} {'failed':>7} {'files/s':>9} {'seqs':>9} {'tokens':>12} {'tokens/s':>11}")
+    for split in SPLITS:
+        record = records.get(split)
+        if record is None:
+            continue
+        pre, tok = record['preprocess'], record['tokenize']
+        print(f"{split:<6} {pre['files']:>8} {pre['converted']:>8} {pre['failed']:>7} {pre['files_per_sec']:>9.1f} "
+              f"{tok['sequences']:>9} {tok['tokens']:>12} {tok['tokens_per_sec']:>11.0f}")
+
+
+def tokenize_all_splits(datapath, augment=1, workers=None, retries=2, anticipation_dir='./anticipation',
+                        splits=SPLITS, force=False):
+    """Preprocess and tokenize every split that has no checkpoint yet, up to `workers` at a time"""
+    records = {}
+    todo = []
+    for split in splits:
+        record = None if force else read_checkpoint(datapath, split)
+        if record is not None and os.path.exists(os.path.join(datapath, f"tokenized-events-{split}.txt")):
+            records[split] = record
+        elif os.path.isdir(os.path.join(datapath, split)):
+            todo.append(split)
+    print(f"{len(records)} splits already done, {len(todo)} to run")
+
+    failed = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers or min(len(SPLITS), os.cpu_count() or 1)) as executor:
+        futures = [executor.submit(launch_split, datapath, split,
+                                   1 if split in UNAUGMENTED_SPLITS else augment, anticipation_dir, retries)
+                   for split in todo]
+        for future in as_completed(futures):
+            split, record, attempts = future.result()
+            if record is None:
+                failed.append(split)
+                continue
+            records[split] = record
+            print(f"Split {split} done in {record['preprocess']['seconds'] + record['tokenize']['seconds']:.0f}s"
+                  f" ({attempts} attempt{'s' if attempts > 1 else ''})")
+
+    print_report(records)
+    total_tokens = sum(r['tokenize']['tokens'] for r in records.values())
+    print(f"\nWall time: {time.perf_counter() - start:.0f}s, {total_tokens} tokens in {len(records)} splits")
+    if failed:
+        print(f"Failed splits: {' '.join(sorted(failed))} (re-run to retry)")
+    return not failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run midi-preprocess and tokenize-lakh per hash split, in parallel")
+    parser.add_argument("datapath", help="Folder with the 0-f split folders (e.g. ../midi/rag-split)")
+    parser.add_argument("--augment", type=int, default=1, help="Augmentation factor for the training splits")
+    parser.add_argument("--workers", type=int, default=None, help="Splits processed at once (default: CPU count, max 16)")
+    parser.add_argument("--retries", type=int, default=2, help="Retries per failed split")
+    parser.add_argument("--anticipation-dir", default="./anticipation", help="Path of the anticipation clone")
+    parser.add_argument("--splits", default=SPLITS, help="Only these splits, e.g. 0123")
+    parser.add_argument("--force", action="store_true", help="Ignore checkpoints and re-tokenize the selected splits")
+    parser.add_argument("--run-split", default=None, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.run_split is not None:
+        run_split(args.datapath, args.run_split, args.augment, args.anticipation_dir)
+    else:
+        ok = tokenize_all_splits(args.datapath, augment=args.augment, workers=args.workers, retries=args.retries,
+                                 anticipation_dir=args.anticipation_dir, splits=args.splits, force=args.force)
+        sys.exit(0 if ok else 1)
@@ -0,0 +1,274 @@
+"""
+Persistent, batched basic-pitch transcription.
+
+basic-pitch's predict_and_save loads (or is handed) a model and runs it on one
+file's windows at a time, so the notebook ended up rebuilding the model per
+track and calling the model with small batches per stem. TranscriptionEngine
+loads the model once and packs the 2-second windows of many stems, from many
+tracks, into large inference batches. Each stem's result is yielded as soon as
+its last window has been through the model, in the order the stems came in.
+
+Windowing, un-windowing and note creation match basic_pitch.inference exactly,
+so the notes are the same as predict_and_save would produce.
+"""
+
+import os
+from collections import deque
+
+import numpy as np
+import librosa
+
+from basic_pitch import ICASSP_2022_MODEL_PATH
+from basic_pitch.constants import AUDIO_SAMPLE_RATE, AUDIO_N_SAMPLES, FFT_HOP
+from basic_pitch.inference import Model, unwrap_output, save_note_events
+import basic_pitch.note_creation as infer
+
+from instrumentation import count, span
+
+# Same overlap as basic_pitch.inference.run_inference
+N_OVERLAPPING_FRAMES = 30
+OVERLAP_LEN = N_OVERLAPPING_FRAMES * FFT_HOP
+HOP_SIZE = AUDIO_N_SAMPLES - OVERLAP_LEN
+
+# Windows per model call; each window is about 2 seconds of audio
+DEFAULT_BATCH_SIZE = 64
+
+
+def load_stem(audio_path):
+    """Decode a stem once, as mono at basic-pitch's sample rate"""
+    with span('transcription.load'):
+        y, _ = librosa.load(str(audio_path), sr=AUDIO_SAMPLE_RATE, mono=True)
+    return y
+
+
+def estimate_tempo(y, sr=AUDIO_SAMPLE_RATE):
+    """Tempo in whole BPM, as the notebook estimated it"""
+    with span('transcription.tempo'):
+        tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
+    return int(np.atleast_1d(tempo)[0])
+
+
+def window_audio(audio):
+    """Pad and window mono audio like basic_pitch.inference.get_audio_input; (n_windows, AUDIO_N_SAMPLES, 1)"""
+    padded = np.concatenate([np.zeros(OVERLAP_LEN // 2, dtype=np.float32), audio.astype(np.float32)])
+    starts = range(0, padded.shape[0], HOP_SIZE)
+    windows = np.zeros((len(starts), AUDIO_N_SAMPLES, 1), dtype=np.float32)
+    for i, start in enumerate(starts):
+        chunk = padded[start:start + AUDIO_N_SAMPLES]
+        windows[i, :chunk.shape[0], 0] = chunk
+    return windows
+
+
+class StemJob:
+    """One stem to transcribe: mono audio at AUDIO_SAMPLE_RATE plus the tempo to write into its MIDI"""
+
+    def __init__(self, track, stem, audio, tempo=120, source_path=None):
+        self.track = track
+        self.stem = stem
+        self.audio = audio
+        self.tempo = tempo
+        self.source_path = source_path
+
+
+class TranscriptionResult:
+    """Model output and note events for one StemJob; the per-stem MIDI is only built on request
+
+    A stem that could not be transcribed gets a result with `error` set and no notes.
+    """
+
+    def __init__(self, job, model_output, note_events, multiple_pitch_bends=False, error=None):
+        self.job = job
+        self.model_output = model_output
+        self.note_events = note_events
+        self.multiple_pitch_bends = multiple_pitch_bends
+        self.error = error
+        self._midi_data = None
+
+    @property
+    def midi_data(self):
+        if self._midi_data is None:
+            self._midi_data = infer.note_events_to_midi(self.note_events, self.multiple_pitch_bends,
+                                                        self.job.tempo)
+        return self._midi_data
+
+
+class _PendingStem:
+    def __init__(self, job):
+        self.job = job
+        self.error = None
+        self.dispatched = 0
+        self.completed = 0
+        self.outputs = {"note": [], "onset": [], "contour": []}
+        try:
+            self.windows = window_audio(job.audio)
+            self.original_length = job.audio.shape[0]
+        except Exception as e:
+            # No windows to run, so the stem is finished (as failed) straight away
+            self.error = f"{type(e).__name__}: {e}"
+            self.windows = np.zeros((0, AUDIO_N_SAMPLES, 1), dtype=np.float32)
+            self.original_length = 0
+
+    @property
+    def num_windows(self):
+        return self.windows.shape[0]
+
+
+class TranscriptionEngine:
+    """Loads the basic-pitch model once and transcribes streams of StemJobs in large batches"""
+
+    def __init__(self, model_path=ICASSP_2022_MODEL_PATH, batch_size=DEFAULT_BATCH_SIZE,
+                 onset_threshold=0.5, frame_threshold=0.3, minimum_note_length=127.70,
+                 minimum_frequency=None, maximum_frequency=None,
+                 multiple_pitch_bends=False, melodia_trick=True):
+        self.model = Model(model_path)
+        self.batch_size = batch_size
+        self.onset_threshold = onset_threshold
+        self.frame_threshold = frame_threshold
+        self.min_note_len = int(np.round(minimum_note_length / 1000 * (AUDIO_SAMPLE_RATE / FFT_HOP)))
+        self.minimum_frequency = minimum_frequency
+        self.maximum_frequency = maximum_frequency
+        self.multiple_pitch_bends = multiple_pitch_bends
+        self.melodia_trick = melodia_trick
+        self.windows_processed = 0
+
+    def transcribe(self, jobs):
+        """Yield a TranscriptionResult per job, in job order, as each stem finishes
+
+        An error in one batch or stem fails only the stems involved (their
+        results carry the error); the other jobs keep going.
+        """
+        jobs = iter(jobs)
+        pending = deque()
+        exhausted = False
+
+        while True:
+            # Pull jobs until there are enough undispatched windows for a full batch
+            queued = sum(p.num_windows - p.dispatched for p in pending)
+            while not exhausted and queued < self.batch_size:
+                job = next(jobs, None)
+                if job is None:
+                    exhausted = True
+                    break
+                stem = _PendingStem(job)
+                pending.append(stem)
+                queued += stem.num_windows
+
+            if queued == 0:
+                # Anything left failed before it had windows to run
+                while pending:
+                    yield self._finish(pending.popleft())
+                break
+
+            self._run_batch(pending)
+
+            while pending and pending[0].completed == pending[0].num_windows:
+                yield self._finish(pending.popleft())
+
+    def transcribe_one(self, job):
+        """Transcribe a single StemJob"""
+        return next(self.transcribe([job]))
+
+    def _run_batch(self, pending):
+        """Run the model on the next batch_size undispatched windows, across stems"""
+        parts = []
+        remaining = self.batch_size
+        for stem in pending:
+            if remaining == 0:
+                break
+            take = min(remaining, stem.num_windows - stem.dispatched)
+            if take > 0:
+                parts.append((stem, stem.dispatched, stem.dispatched + take))
+                stem.dispatched += take
+                remaining -= take
+
+        self._run_parts(parts)
+
+    def _run_parts(self, parts):
+        """Predict (stem, start, stop) window ranges in one call; when that fails, retry each stem alone"""
+        try:
+            batch = np.concatenate([stem.windows[start:stop] for stem, start, stop in parts])
+            with span('transcription.predict', windows=batch.shape[0]):
+                outputs = self._predict(batch)
+        except Exception as e:
+            if len(parts) > 1:
+                for part in parts:
+                    self._run_parts([part])
+                return
+            stem, start, stop = parts[0]
+            stem.error = stem.error or f"{type(e).__name__}: {e}"
+            print(f"Inference failed for {stem.job.track}/{stem.job.stem}: {stem.error}")
+            stem.completed += stop - start
+            return
+        self.windows_processed += batch.shape[0]
+        count('transcription.windows', batch.shape[0])
+
+        offset = 0
+        for stem, start, stop in parts:
+            n = stop - start
+            for key, value in outputs.items():
+                stem.outputs[key].append(value[offset:offset + n])
+            stem.completed += n
+            offset += n
+
+    def _predict(self, batch):
+        """model.predict on a batch; when that call fails (e.g. a fixed-batch backend), one window per call"""
+        if batch.shape[0] > 1:
+            try:
+                return self.model.predict(batch)
+            except Exception as e:
+                print(f"Batched inference failed ({e}); running this batch one window per call")
+        outputs = [self.model.predict(batch[i:i + 1]) for i in range(batch.shape[0])]
+        return {key: np.concatenate([o[key] for o in outputs]) for key in outputs[0]}
+
+    def _finish(self, stem):
+        """Un-window the model output and turn it into note events"""
+        if stem.error is None:
+            try:
+                with span('transcription.notes', stem=stem.job.stem):
+                    return self._note_events(stem)
+            except Exception as e:
+                stem.error = f"{type(e).__name__}: {e}"
+                print(f"Note creation failed for {stem.job.track}/{stem.job.stem}: {stem.error}")
+        stem.windows = None
+        stem.outputs = None
+        return TranscriptionResult(stem.job, None, [], self.multiple_pitch_bends, error=stem.error)
+
+    def _note_events(self, stem):
+        model_output = {
+            key: unwrap_output(np.concatenate(values), stem.original_length, N_OVERLAPPING_FRAMES)
+            for key, values in stem.outputs.items()
+        }
+        stem.windows = None
+
+        # infer.model_output_to_notes without building a PrettyMIDI per stem
+        estimated_notes = infer.output_to_notes_polyphonic(
+            model_output["note"],
+            model_output["onset"],
+            onset_thresh=self.onset_threshold,
+            frame_thresh=self.frame_threshold,
+            infer_onsets=True,
+            min_note_len=self.min_note_len,
+            min_freq=self.minimum_frequency,
+            max_freq=self.maximum_frequency,
+            melodia_trick=self.melodia_trick,
+        )
+        with_pitch_bends = infer.get_pitch_bends(model_output["contour"], estimated_notes)
+        times_s = infer.model_frames_to_time(model_output["contour"].shape[0])
+        note_events = [
+            (times_s[note[0]], times_s[note[1]], note[2], note[3], note[4]) for note in with_pitch_bends
+        ]
+        return TranscriptionResult(stem.job, model_output, note_events, self.multiple_pitch_bends)
+
+
+def save_outputs(result, output_directory, save_midi=True, save_model_outputs=False, save_notes=False,
+                 sonify_midi=False, sonification_samplerate=44100):
+    """Write a result with predict_and_save's file names (<stem>_basic_pitch.mid/.npz/.csv/.wav)"""
+    base = os.path.join(output_directory, f"{result.job.stem}_basic_pitch")
+    if save_model_outputs:
+        np.savez(base + ".npz", basic_pitch_model_output=result.model_output)
+    if save_midi:
+        result.midi_data.write(base + ".mid")
+    if save_notes:
+        save_note_events(result.note_events, base + ".csv")
+    if sonify_midi:
+        infer.sonify_midi(result.midi_data, base + ".wav", sr=sonification_samplerate)
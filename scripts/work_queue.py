@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+Lease-based work queue for running pipeline stages on several machines.
+
+BatchStemSeparator and the segmentation loop were written for one process
+owning the whole input directory. Several nodes pointed at the same NFS mount
+would each separate every track and race on progress.json and the label
+files. Here the tracks of a stage are rows in one SQLite database on the
+shared filesystem (./work_queue.db by default):
+
+    tasks(queue, item, status, owner, lease_expires, attempts, error, ...)
+
+- claim: a worker takes up to n pending items, or items whose lease has
+  expired, in one BEGIN IMMEDIATE transaction, so no two workers get the
+  same item. Each claim counts as an attempt.
+- renew: a Heartbeat thread extends the leases of the items a worker is
+  processing every lease_sec / 3 seconds.
+- expiry: when a worker dies (crash, OOM kill, node reboot) its heartbeats
+  stop and its items are claimable again once the lease runs out.
+- complete / fail: a finished item is marked done. A failed one goes back to
+  pending until it has used max_attempts, then it is left as failed with the
+  error for someone to look at (`requeue` puts it back).
+
+Leases are compared against each node's wall clock, so node clocks must agree
+to well within lease_sec (NTP is plenty with the default of 10 minutes).
+Claims are short transactions and workers take batches, so the database is
+not the bottleneck and fleet throughput grows with the number of nodes.
+
+The default journal mode is 'delete' because SQLite's WAL mode does not work
+across hosts; use --journal-mode wal only when every worker is on one host.
+
+Every node runs the same command; adding items is idempotent:
+
+    python stem_separation.py /mnt/audio /mnt/stems --queue /mnt/work_queue.db
+    python segmentation.py /mnt/audio --labels-dir /mnt/labels --queue /mnt/work_queue.db
+    python work_queue.py --db /mnt/work_queue.db status
+
+`python work_queue.py drill` runs simulated workers as local processes,
+some of which crash mid-item, and checks that every item is done.
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+
+from label_store import _Transaction
+
+DEFAULT_PATH = "./work_queue.db"
+DEFAULT_LEASE_SEC = 600.0
+DEFAULT_MAX_ATTEMPTS = 3
+STATUSES = ('pending', 'leased', 'done', 'failed')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    queue TEXT NOT NULL,
+    item TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    added_at REAL,
+    updated_at REAL,
+    PRIMARY KEY (queue, item)
+);
+CREATE INDEX IF NOT EXISTS tasks_claim ON tasks (queue, status, lease_expires);
+"""
+
+
+def default_worker_id():
+    """host:pid, unique across the nodes sharing a queue"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WorkQueue:
+    """One named queue of items in a shared SQLite database, claimed under time-limited leases"""
+
+    def __init__(self, path=DEFAULT_PATH, queue='default', worker_id=None, lease_sec=DEFAULT_LEASE_SEC,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS, journal_mode='delete', timeout=60.0):
+        self.path = path
+        self.queue = queue
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_sec = lease_sec
+        self.max_attempts = max_attempts
+        self.journal_mode = journal_mode
+        self.timeout = timeout
+        self.conn = self._connect()
+        self.conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        return conn
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write(self, conn=None):
+        """A transaction that takes the write lock up front, so select-then-update is atomic"""
+        return _Transaction(conn or self.conn, "BEGIN IMMEDIATE")
+
+    # Reads
+
+    def counts(self):
+        """{status: number of items}, with expired leases counted as pending"""
+        counts = dict.fromkeys(STATUSES, 0)
+        rows = self.conn.execute(
+            "SELECT CASE WHEN status = 'leased' AND lease_expires < ? THEN 'pending' ELSE status END AS s, "
+            "COUNT(*) AS n FROM tasks WHERE queue = ? GROUP BY s", (time.time(), self.queue))
+        for row in rows:
+            counts[row['s']] = row['n']
+        return counts
+
+    def items(self, status=None):
+        """Rows of the queue, all or with one status, in item order"""
+        if status is None:
+            rows = self.conn.execute("SELECT * FROM tasks WHERE queue = ? ORDER BY item", (self.queue,))
+        else:
+            rows = self.conn.execute("SELECT * FROM tasks WHERE queue = ? AND status = ? ORDER BY item",
+                                     (self.queue, status))
+        return [dict(row) for row in rows]
+
+    def is_drained(self):
+        """True when nothing is pending or leased, so no worker can get more items"""
+        counts = self.counts()
+        return counts['pending'] == 0 and counts['leased'] == 0
+
+    # Writes
+
+    def add(self, items):
+        """Enqueue items; ones already in the queue (in any status) are left alone. Returns the number added"""
+        now = time.time()
+        with self._write():
+            before = self.conn.total_changes
+            self.conn.executemany("INSERT OR IGNORE INTO tasks (queue, item, added_at, updated_at) VALUES (?, ?, ?, ?)",
+                                  [(self.queue, item, now, now) for item in items])
+            return self.conn.total_changes - before
+
+    def claim(self, n=1):
+        """Lease up to n pending or expired items to this worker; returns their names"""
+        now = time.time()
+        with self._write():
+            # Expired leases that already used every attempt are not handed out again
+            self.conn.execute(
+                "UPDATE tasks SET status = 'failed', owner = NULL, updated_at = ?, "
+                "error = COALESCE(error, 'lease expired') "
+                "WHERE queue = ? AND status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, self.queue, now, self.max_attempts))
+            rows = self.conn.execute(
+                "SELECT item FROM tasks WHERE queue = ? AND (status = 'pending' "
+                "OR (status = 'leased' AND lease_expires < ?)) ORDER BY attempts, item LIMIT ?",
+                (self.queue, now, n)).fetchall()
+            items = [row['item'] for row in rows]
+            self.conn.executemany(
+                "UPDATE tasks SET status = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1, "
+                "updated_at = ? WHERE queue = ? AND item = ?",
+                [(self.worker_id, now + self.lease_sec, now, self.queue, item) for item in items])
+        return items
+
+    def renew(self, items, conn=None):
+        """Extend this worker's leases; returns the items whose lease it still holds"""
+        conn = conn or self.conn
+        now = time.time()
+        held = []
+        with self._write(conn):
+            for item in items:
+                cursor = conn.execute(
+                    "UPDATE tasks SET lease_expires = ?, updated_at = ? "
+                    "WHERE queue = ? AND item = ? AND status = 'leased' AND owner = ?",
+                    (now + self.lease_sec, now, self.queue, item, self.worker_id))
+                if cursor.rowcount:
+                    held.append(item)
+        return held
+
+    def complete(self, item):
+        """Mark an item done. False when the lease was lost to another worker, which will redo it"""
+        now = time.time()
+        with self._write():
+            cursor = self.conn.execute(
+                "UPDATE tasks SET status = 'done', owner = NULL, lease_expires = NULL, error = NULL, updated_at = ? "
+                "WHERE queue = ? AND item = ? AND status = 'leased' AND owner = ?",
+                (now, self.queue, item, self.worker_id))
+        return cursor.rowcount > 0
+
+    def fail(self, item, error=''):
+        """Give an item back after an error: pending again, or failed once it used max_attempts"""
+        now = time.time()
+        with self._write():
+            self.conn.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "owner = NULL, lease_expires = NULL, error = ?, updated_at = ? "
+                "WHERE queue = ? AND item = ? AND status = 'leased' AND owner = ?",
+                (self.max_attempts, str(error), now, self.queue, item, self.worker_id))
+
+    def release(self, items):
+        """Give back items that were not started (e.g. on shutdown), without using up an attempt"""
+        now = time.time()
+        with self._write():
+            self.conn.executemany(
+                "UPDATE tasks SET status = 'pending', owner = NULL, lease_expires = NULL, "
+                "attempts = MAX(attempts - 1, 0), updated_at = ? "
+                "WHERE queue = ? AND item = ? AND status = 'leased' AND owner = ?",
+                [(now, self.queue, item, self.worker_id) for item in items])
+
+    def requeue(self, status='failed'):
+        """Put every item with this status back to pending with fresh attempts; returns how many"""
+        with self._write():
+            cursor = self.conn.execute(
+                "UPDATE tasks SET status = 'pending', owner = NULL, lease_expires = NULL, attempts = 0, "
+                "updated_at = ? WHERE queue = ? AND status = ?", (time.time(), self.queue, status))
+        return cursor.rowcount
+
+    def heartbeat(self, items, interval=None):
+        """Context manager that keeps renewing the leases on items while the block runs"""
+        return Heartbeat(self, items, interval)
+
+
+class Heartbeat:
+    """Background thread renewing a worker's leases; `lost` collects items whose lease was taken over"""
+
+    def __init__(self, work_queue, items, interval=None):
+        self.work_queue = work_queue
+        self.items = list(items)
+        self.interval = interval if interval is not None else work_queue.lease_sec / 3
+        self.lost = set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        # sqlite3 connections stay in the thread that made them
+        conn = self.work_queue._connect()
+        try:
+            while not self._stop.wait(self.interval):
+                pending = [item for item in self.items if item not in self.lost]
+                try:
+                    held = self.work_queue.renew(pending, conn)
+                except sqlite3.OperationalError as e:
+                    # A busy or briefly unreachable share; the next beat tries again before the lease runs out
+                    print(f"Lease renewal failed: {e}")
+                    continue
+                self.lost.update(set(pending) - set(held))
+        finally:
+            conn.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_worker(work_queue, handler, batch_size=1, poll_sec=30.0, max_items=None):
+    """Claim batches and call handler(items) under a heartbeat until the queue is drained
+
+    handler returns the items it finished; the others are failed (and retried).
+    An exception fails the whole batch. While other workers still hold leases
+    the loop waits poll_sec and claims again, so it picks up the items of a
+    worker that dies. Returns the number of items this worker completed.
+    """
+    done = 0
+    while max_items is None or done < max_items:
+        n = batch_size if max_items is None else min(batch_size, max_items - done)
+        items = work_queue.claim(n)
+        if not items:
+            if work_queue.is_drained():
+                break
+            time.sleep(poll_sec)
+            continue
+        try:
+            with work_queue.heartbeat(items):
+                finished = set(handler(items) or ())
+            error = 'not completed'
+        except Exception as e:
+            finished = set()
+            error = f"{type(e).__name__}: {e}"
+            print(f"Error processing {', '.join(items)}: {error}")
+        for item in items:
+            if item in finished:
+                done += work_queue.complete(item)
+            else:
+                work_queue.fail(item, error)
+    return done
+
+
+def _drill_worker(path, queue, lease_sec, work_sec, crash_rate, seed, journal_mode, log_path):
+    """Simulated worker: sleeps work_sec per item, sometimes dies holding its lease"""
+    rng = random.Random(seed)
+    work_queue = WorkQueue(path, queue, lease_sec=lease_sec, max_attempts=100, journal_mode=journal_mode)
+
+    def handler(items):
+        for item in items:
+            if rng.random() < crash_rate:
+                os._exit(1)
+            time.sleep(work_sec)
+            with open(log_path, 'a') as f:
+                f.write(f"{item}\n")
+        return items
+
+    run_worker(work_queue, handler, batch_size=1, poll_sec=lease_sec / 4)
+
+
+def drill(path, items=200, workers=(1, 2, 4, 8), work_sec=0.05, lease_sec=2.0, crash_rate=0.02,
+          journal_mode='delete'):
+    """Run simulated workers over fresh queues; returns {workers: (seconds, items done, restarts)}"""
+    ctx = mp.get_context('spawn')
+    results = {}
+    for n in workers:
+        queue = f"drill-{n}-{time.time():.0f}"
+        log_path = f"{path}.{queue}.log"
+        with WorkQueue(path, queue, journal_mode=journal_mode) as work_queue:
+            work_queue.add(f"item-{i:05d}" for i in range(items))
+            start = time.perf_counter()
+            processes = []
+            restarts = 0
+            for w in range(n):
+                p = ctx.Process(target=_drill_worker, args=(path, queue, lease_sec, work_sec, crash_rate,
+                                                            w, journal_mode, log_path))
+                p.start()
+                processes.append(p)
+            # Replace crashed workers, the way a cluster scheduler would restart them
+            while processes:
+                for i, p in enumerate(processes):
+                    if p.exitcode is None:
+                        continue
+                    processes.pop(i)
+                    if p.exitcode != 0:
+                        restarts += 1
+                        p = ctx.Process(target=_drill_worker, args=(path, queue, lease_sec, work_sec, crash_rate,
+                                                                    1000 * n + restarts, journal_mode, log_path))
+                        p.start()
+                        processes.append(p)
+                    break
+                else:
+                    time.sleep(0.05)
+            seconds = time.perf_counter() - start
+            counts = work_queue.counts()
+        with open(log_path) as f:
+            finished = set(f.read().split())
+        os.remove(log_path)
+        missing = items - len(finished)
+        if counts['done'] != items or missing:
+            raise RuntimeError(f"{n} workers: {counts['done']}/{items} done, {missing} never processed")
+        results[n] = (seconds, counts['done'], restarts)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect and maintain the shared work queue")
+    parser.add_argument("--db", default=DEFAULT_PATH, help="Work queue database on the shared filesystem")
+    parser.add_argument("--journal-mode", default='delete', choices=['wal', 'delete'],
+                        help="'wal' only when every worker runs on this host")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    add_parser = subparsers.add_parser("add", help="Enqueue the audio files of a directory")
+    add_parser.add_argument("queue", help="Queue name, e.g. separation or segmentation")
+    add_parser.add_argument("audio_dir")
+
+    status_parser = subparsers.add_parser("status", help="Count items per status in each queue")
+    status_parser.add_argument("queue", nargs="?")
+
+    failed_parser = subparsers.add_parser("failed", help="List failed items with their errors")
+    failed_parser.add_argument("queue")
+
+    requeue_parser = subparsers.add_parser("requeue", help="Retry every failed item of a queue")
+    requeue_parser.add_argument("queue")
+
+    drill_parser = subparsers.add_parser("drill", help="Run simulated workers as local processes")
+    drill_parser.add_argument("--items", type=int, default=200)
+    drill_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    drill_parser.add_argument("--work-sec", type=float, default=0.05, help="Simulated seconds per item")
+    drill_parser.add_argument("--lease-sec", type=float, default=2.0)
+    drill_parser.add_argument("--crash-rate", type=float, default=0.02,
+                              help="Chance that a worker dies holding its lease, per item")
+
+    args = parser.parse_args()
+
+    if args.command == "add":
+        extensions = ('.mp3', '.wav', '.ogg', '.flac')
+        files = sorted(f for f in os.listdir(args.audio_dir) if f.lower().endswith(extensions))
+        with WorkQueue(args.db, args.queue, journal_mode=args.journal_mode) as work_queue:
+            print(f"Added {work_queue.add(files)} of {len(files)} files to {args.queue}")
+    elif args.command == "status":
+        with WorkQueue(args.db, journal_mode=args.journal_mode) as work_queue:
+            queues = [args.queue] if args.queue else [row['queue'] for row in work_queue.conn.execute(
+                "SELECT DISTINCT queue FROM tasks ORDER BY queue")]
+            for queue in queues:
+                work_queue.queue = queue
+                counts = work_queue.counts()
+                print(f"{queue}: " + ", ".join(f"{status} {counts[status]}" for status in STATUSES))
+                for row in work_queue.items('leased'):
+                    if row['lease_expires'] >= time.time():
+                        print(f"  {row['item']}  {row['owner']}  lease {row['lease_expires'] - time.time():.0f}s")
+    elif args.command == "failed":
+        with WorkQueue(args.db, args.queue, journal_mode=args.journal_mode) as work_queue:
+            for row in work_queue.items('failed'):
+                print(f"{row['item']}  attempts {row['attempts']}  {row['error']}")
+    elif args.command == "requeue":
+        with WorkQueue(args.db, args.queue, journal_mode=args.journal_mode) as work_queue:
+            print(f"Requeued {work_queue.requeue()} items")
+    elif args.command == "drill":
+        results = drill(args.db, args.items, args.workers, args.work_sec, args.lease_sec, args.crash_rate,
+                        args.journal_mode)
+        base = results[args.workers[0]][0] * args.workers[0]
+        print(f"{'workers':>8} {'seconds':>8} {'items/s':>8} {'speedup':>8} {'restarts':>9}")
+        for n, (seconds, done, restarts) in results.items():
+            print(f"{n:>8} {seconds:>8.2f} {done / seconds:>8.1f} {base / seconds:>8.2f} {restarts:>9}")
+        print("\nEvery item done")